@@ -1,6 +1,20 @@
 import os, os.path, sys, io, tempfile, traceback, base64, re, time, uuid
+import ast
+import threading
+import collections
+import contextvars
+import difflib
+import inspect
+import gzip
+import hashlib
+import math
+import shutil
+import sqlite3
+import types
+import unicodedata
 import builtins
 import logging
+from functools import partial
 import requests
 import json
 from qgis.utils import iface
@@ -13,33 +27,46 @@ from qgis.core import (
     QgsFillSymbol, QgsSingleSymbolRenderer, QgsSymbol, QgsRendererCategory,
     QgsCategorizedSymbolRenderer,
     QgsPalLayerSettings, QgsTextFormat, QgsTextBufferSettings, QgsVectorLayerSimpleLabeling,
-    QgsProperty, QgsWkbTypes
+    QgsProperty, QgsWkbTypes, QgsTask, QgsDataSourceUri, QgsFields, QgsVectorLayerFeatureSource,
+    QgsProcessingAlgorithm, QgsProcessingAlgRunnerTask, QgsProcessingContext, QgsProcessingException,
+    QgsProcessingOutputMapLayer, QgsProcessingOutputRasterLayer, QgsProcessingOutputVectorLayer,
+    QgsProcessingUtils
 )
 
 try:
     from qgis.PyQt import QtCore, QtGui, QtWidgets
     from qgis.PyQt.QtCore import (
         QSettings, QTranslator, QCoreApplication, Qt, QTimer, QThread,
-        pyqtSignal, QEvent, QVariant, QObject
+        pyqtSignal, QEvent, QVariant, QObject, QEventLoop
     )
     from qgis.PyQt.QtGui import QIcon, QColor, QFont
     from qgis.PyQt.QtWidgets import (
         QAction, QDockWidget, QLineEdit, QWidget, QHBoxLayout, QLabel,
-        QPushButton, QApplication, QTextEdit
+        QPushButton, QApplication, QTextEdit, QMessageBox
     )
 except ImportError:
     from PyQt5.QtCore import (
         QSettings, QTranslator, QCoreApplication, Qt, QTimer, QThread,
-        pyqtSignal, QEvent, QVariant, QObject
+        pyqtSignal, QEvent, QVariant, QObject, QEventLoop
     )
     from PyQt5.QtGui import QIcon, QColor, QFont
     from PyQt5.QtWidgets import (
         QAction, QDockWidget, QLineEdit, QWidget, QHBoxLayout, QLabel,
-        QPushButton, QApplication, QTextEdit
+        QPushButton, QApplication, QTextEdit, QMessageBox
     )
 
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib.parse import urlparse, unquote
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from osgeo import ogr
+except ImportError:
+    ogr = None
 
 from .resources import *
 from .dockwidget import Ui_DockWidget
@@ -50,35 +77,107 @@ logger = logging.getLogger(__name__)
 ENABLE_REMOTE_LOG = True
 REPORT_ENDPOINT = "https://querygis.com/report-error"
 REPORT_TIMEOUT_SEC = 5
-REPORT_RETRIES = 2
+REPORT_BATCH_ENDPOINT = "https://querygis.com/report-error/batch"
+TELEMETRY_QUEUE_MAX = 500
+TELEMETRY_BATCH_ROWS = 20
+TELEMETRY_FLUSH_SEC = 5.0
+TELEMETRY_RETRY_MAX_SEC = 300.0
+TELEMETRY_SPOOL_SEGMENT_BYTES = 1024 * 1024
+TELEMETRY_SPOOL_SEGMENTS = 8
+REQUEST_COMPRESS_MIN_BYTES = 2048
+RESPONSE_CACHE_MAX_ENTRIES = 500
+RESPONSE_CACHE_TTL_HOURS = 168
+VERIFIED_CODE_MAX_ENTRIES = 1000
+VERIFIED_CODE_THRESHOLD = 0.85
+COMPILED_CODE_CACHE_SIZE = 64
+CONTEXT_BUDGET_TOKENS = 16000
+CONTEXT_SOURCE_MAX_CHARS = 160
+CONTEXT_SAMPLE_FIELDS = 16
+CONTEXT_SAMPLE_SCAN = 50
+ALGORITHM_CATALOGUE = os.path.join(os.path.dirname(__file__), "qgis모음.txt")
+ALGORITHM_INDEX_DELAY_MS = 3000
 
 class _SoftErrorSignal(Exception):
     pass
 
+class _PreflightError(Exception):
+    pass
+
 class AutoVerifyWrapper:
+    """Proxy for objects built by generated code: missing attributes fall back to a similar name,
+    failing calls to similarly named methods.
+
+    Each wrapped type gets its own subclass. The first access to an instance method installs a
+    checked version of it on that subclass, so later accesses on any wrapper of the type are
+    ordinary method lookups and never reach ``__getattr__``.
+    """
+
+    __slots__ = ('_obj', '_type')
+
+    _MISSING = object()
+    _subclasses = {}  # wrapped type -> wrapper subclass
+    _similar = {}     # (type, name) -> similar attribute name or None
+    _methods = {}     # type -> public callable names
+
+    def __new__(cls, obj):
+        if cls is AutoVerifyWrapper:
+            obj_cls = type(obj)
+            cls = AutoVerifyWrapper._subclasses.get(obj_cls)
+            if cls is None:
+                cls = type(f"AutoVerifyWrapper_{obj_cls.__name__}", (AutoVerifyWrapper,), {'__slots__': ()})
+                AutoVerifyWrapper._subclasses[obj_cls] = cls
+        return object.__new__(cls)
+
     def __init__(self, obj):
         object.__setattr__(self, '_obj', obj)
         object.__setattr__(self, '_type', type(obj).__name__)
     
     def __getattr__(self, name):
         obj = object.__getattribute__(self, '_obj')
-        obj_type = object.__getattribute__(self, '_type')
         
-        if not hasattr(obj, name):
+        attr = getattr(obj, name, AutoVerifyWrapper._MISSING)
+        if attr is AutoVerifyWrapper._MISSING:
             return self._handle_missing(name)
         
-        attr = getattr(obj, name)
-        
-        if callable(attr):
-            def safe_wrapper(*args, **kwargs):
-                try:
-                    return attr(*args, **kwargs)
-                except (AttributeError, TypeError) as e:
-                    print(f"\n{obj_type}.{name}() failed: {e}")
-                    return self._try_alternatives(name, args, kwargs)
-            return safe_wrapper
-        
-        return attr
+        if not callable(attr):
+            return attr
+
+        unbound = getattr(type(obj), name, None)
+        if getattr(attr, '__self__', None) is obj and unbound is not None and not name.startswith('_'):
+            # A plain instance method: same for every object of this type
+            method = self._checked_method(object.__getattribute__(self, '_type'), name, unbound)
+            setattr(type(self), name, method)
+            return method.__get__(self)
+
+        obj_type = object.__getattribute__(self, '_type')
+
+        def safe_wrapper(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except (AttributeError, TypeError) as e:
+                print(f"\n{obj_type}.{name}() failed: {e}")
+                return AutoVerifyWrapper._try_alternatives(obj, obj_type, name, args, kwargs)
+        return safe_wrapper
+
+    @staticmethod
+    def _checked_method(obj_type, name, unbound):
+        def method(self, *args, **kwargs):
+            obj = self._obj
+            try:
+                return unbound(obj, *args, **kwargs)
+            except (AttributeError, TypeError) as e:
+                print(f"\n{obj_type}.{name}() failed: {e}")
+                return AutoVerifyWrapper._try_alternatives(obj, obj_type, name, args, kwargs)
+        method.__name__ = name
+        return method
+
+    @classmethod
+    def _public_methods(cls, obj):
+        methods = cls._methods.get(type(obj))
+        if methods is None:
+            methods = [m for m in dir(obj) if not m.startswith('_') and callable(getattr(obj, m, None))]
+            cls._methods[type(obj)] = methods
+        return methods
     
     def _handle_missing(self, name):
         obj = object.__getattribute__(self, '_obj')
@@ -86,27 +185,32 @@ class AutoVerifyWrapper:
         
         print(f"\n{obj_type}.{name} does not exist")
         
-        all_attrs = [a for a in dir(obj) if not a.startswith('_')]
-        name_lower = name.lower()
-        similar = [a for a in all_attrs if name_lower in a.lower() or a.lower() in name_lower]
-        
-        if similar:
-            print(f"Similar: {similar[:5]}")
-            print(f"Using: {similar[0]}")
-            return getattr(obj, similar[0])
+        key = (type(obj), name)
+        if key in AutoVerifyWrapper._similar:
+            similar = AutoVerifyWrapper._similar[key]
+        else:
+            all_attrs = [a for a in dir(obj) if not a.startswith('_')]
+            name_lower = name.lower()
+            matches = [a for a in all_attrs if name_lower in a.lower() or a.lower() in name_lower]
+            if matches:
+                print(f"Similar: {matches[:5]}")
+            else:
+                print(f"Available: {all_attrs[:20]}")
+            similar = matches[0] if matches else None
+            AutoVerifyWrapper._similar[key] = similar
         
-        print(f"Available: {all_attrs[:20]}")
+        if similar is not None:
+            print(f"Using: {similar}")
+            return getattr(obj, similar)
         
         def dummy(*args, **kwargs):
             print(f"Cannot execute {obj_type}.{name}")
             return None
         return dummy
     
-    def _try_alternatives(self, method_name, args, kwargs):
-        obj = object.__getattribute__(self, '_obj')
-        obj_type = object.__getattribute__(self, '_type')
-        
-        all_methods = [m for m in dir(obj) if not m.startswith('_') and callable(getattr(obj, m, None))]
+    @classmethod
+    def _try_alternatives(cls, obj, obj_type, method_name, args, kwargs):
+        all_methods = cls._public_methods(obj)
         keywords = method_name.lower().replace('_', ' ').split()
         
         candidates = [m for m in all_methods if all(kw in m.lower() for kw in keywords)]
@@ -136,65 +240,81 @@ class AutoVerifyWrapper:
         return f"<SafeWrapper({obj_type})>"
 
 
-def auto_wrap_scope(scope):
-    def make_safe_class(original_class):
-        def safe_constructor(*args, **kwargs):
-            obj = original_class(*args, **kwargs)
-            return AutoVerifyWrapper(obj)
-        safe_constructor.__name__ = original_class.__name__
-        return safe_constructor
-    
-    wrapped_scope = {}
-    for key, value in scope.items():
-        if isinstance(value, type) and key.startswith('Qgs'):
-            wrapped_scope[key] = make_safe_class(value)
-        else:
-            wrapped_scope[key] = value
-    
-    return wrapped_scope
+class _SafeClass:
+    """Stands in for a ``Qgs*`` class in the execution scope: instances come back wrapped in
+    AutoVerifyWrapper; attribute access, isinstance and issubclass go to the real class."""
 
-class SmartQgsImporter(dict):
-    def __init__(self, scope):
-        super().__init__(scope)
-        self._qgis_core = None
-    
-    def __getitem__(self, key):
+    __slots__ = ('_cls',)
+
+    def __init__(self, cls):
+        object.__setattr__(self, '_cls', cls)
+
+    def __call__(self, *args, **kwargs):
+        return AutoVerifyWrapper(self._cls(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._cls, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__name__} is read-only in the execution scope")
+
+    def __instancecheck__(self, obj):
+        if isinstance(obj, AutoVerifyWrapper):
+            obj = object.__getattribute__(obj, '_obj')
+        return isinstance(obj, self._cls)
+
+    def __subclasscheck__(self, cls):
+        return issubclass(cls, self._cls)
+
+    def __repr__(self):
+        return f"<SafeClass({self.__name__})>"
+
+
+SCOPE_MODULES = ("qgis.core", "qgis.analysis", "qgis.gui")
+
+
+def build_scope_template(modules=SCOPE_MODULES):
+    """Read-only base of every execution scope, built once per plugin load."""
+    base = {
+        '__run_steps__': run_processing_steps,
+        'qgis': sys.modules.get('qgis'),
+        'QVariant': QVariant,
+        'tempfile': tempfile,
+        'os': os,
+    }
+    for module_name in modules:
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        for name in dir(module):
+            if name.startswith('Qgs') and name not in base:
+                value = getattr(module, name, None)
+                if isinstance(value, type):
+                    base[name] = _SafeClass(value)
+    return types.MappingProxyType(base)
+
+
+class ExecutionScope(dict):
+    """Per-run globals for generated code: holds only what the run sets or assigns;
+    anything else is looked up in the shared template."""
+
+    def __init__(self, template, run_values):
+        super().__init__(run_values)
+        self.template = template
+
+    def __missing__(self, key):
+        # exec calls this for globals that are not dict-exact; KeyError falls through to builtins
+        return self.template[key]
+
+    def get(self, key, default=None):
         try:
-            return super().__getitem__(key)
+            return self[key]
         except KeyError:
-            pass
-        
-        if not key.startswith('Qgs'):
-            raise KeyError(f"'{key}' not found in scope")
-        
-        if self._qgis_core is None:
-            import sys
-            self._qgis_core = sys.modules.get('qgis.core')
-        
-        if self._qgis_core and hasattr(self._qgis_core, key):
-            real_class = getattr(self._qgis_core, key)
-            
-            def safe_constructor(*args, **kwargs):
-                obj = real_class(*args, **kwargs)
-                return AutoVerifyWrapper(obj)
-            
-            safe_constructor.__name__ = key
-            self[key] = safe_constructor 
-            
-            print(f"Auto-imported: {key}")
-            return safe_constructor
-        
-        raise KeyError(f"'{key}' not found in qgis.core")
-    
+            return default
+
     def __contains__(self, key):
-        if super().__contains__(key):
-            return True
-        if not key.startswith('Qgs'):
-            return False
-        if self._qgis_core is None:
-            import sys
-            self._qgis_core = sys.modules.get('qgis.core')
-        return self._qgis_core and hasattr(self._qgis_core, key)
+        return super().__contains__(key) or key in self.template
+
 
 def _mask_sensitive(s: str) -> str:
     if not s:
@@ -236,35 +356,9 @@ def _send_error_report(user_query: str,
     if not ENABLE_REMOTE_LOG:
         return
 
-    if query_gis_instance:
-        query_gis_instance._send_log_async(row)
-        print("[LOG dispatched to background worker]")
-        return
-
-    last_err = None
-    for attempt in range(1, REPORT_RETRIES + 2):
-        try:
-            r = requests.post(
-                REPORT_ENDPOINT,
-                json=row,
-                timeout=REPORT_TIMEOUT_SEC,
-                headers={"Content-Type": "application/json"},
-            )
-            if r.status_code < 300:
-                print(f"[LOG SENT] attempt={attempt} status={r.status_code}")
-                return
-            else:
-                last_err = f"HTTP {r.status_code}: {r.text[:200]}"
-        except Exception as e:
-            last_err = str(e)
-        time.sleep(0.2)
-
-    print(f"[LOG FAILED] endpoint={REPORT_ENDPOINT} error={last_err}")
-    try:
-        iface.messageBar().pushWarning("QueryGIS Log",
-            f"Failed to send log to server: {last_err}")
-    except Exception:
-        pass
+    # Never waits on the network: rows are queued, batched and spooled to disk when offline
+    _telemetry_dispatcher().enqueue(row)
+    print("[LOG queued for batch dispatch]")
 
 import random
 
@@ -337,44 +431,408 @@ class WaveProgressManager:
         display_text = f"{wave_chars[char_index]} {self.current_message}"
         self.update_callback(display_text, False)
 
-class LoggingWorker(QThread):
-    def __init__(self, endpoint, json_data, timeout):
+class TelemetrySpool:
+    """Append-only JSONL segments in the profile directory, capped in segment size and count."""
+
+    def __init__(self, directory, max_segment_bytes=TELEMETRY_SPOOL_SEGMENT_BYTES,
+                 max_segments=TELEMETRY_SPOOL_SEGMENTS):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.dropped_segments = 0
+        self._seq = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        try:
+            names = [n for n in os.listdir(self.directory) if n.startswith("spool-") and n.endswith(".jsonl")]
+        except OSError:
+            return []
+        return [os.path.join(self.directory, n) for n in sorted(names)]
+
+    def has_pending(self):
+        return bool(self.segments())
+
+    def append(self, rows):
+        segments = self.segments()
+        if segments and os.path.getsize(segments[-1]) < self.max_segment_bytes:
+            path = segments[-1]
+        else:
+            self._seq += 1
+            path = os.path.join(self.directory, f"spool-{int(time.time() * 1000):015d}-{self._seq:04d}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        # Oldest segments go first once the cap is reached
+        segments = self.segments()
+        for old in segments[:max(0, len(segments) - self.max_segments)]:
+            try:
+                os.remove(old)
+                self.dropped_segments += 1
+            except OSError:
+                pass
+
+    def replay(self, send, batch_rows):
+        """Send spooled rows oldest first; stops at the first failed batch. True when drained."""
+        for path in self.segments():
+            rows = []
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            rows.append(json.loads(line))
+                        except ValueError:
+                            pass  # torn write from an interrupted session
+            except OSError:
+                continue
+            sent = 0
+            while sent < len(rows):
+                chunk = rows[sent:sent + batch_rows]
+                size = len(chunk)
+                if not send(chunk):
+                    # send() leaves the undelivered part of the chunk in place
+                    self._rewrite(path, chunk + rows[sent + size:])
+                    return False
+                sent += size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return True
+
+    def _rewrite(self, path, rows):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, path)
+
+
+class TelemetryDispatcher(QThread):
+    """One long-lived log sender: bounded drop-oldest queue, batches every few seconds or rows.
+
+    Batches go to the batch endpoint, compressed only once the host has advertised a request
+    coding; a host without the batch route (404/415) gets per-row posts to ``row_endpoint``
+    for the rest of the session. Batches that cannot be delivered go to the on-disk spool
+    and are replayed, oldest first, once a send succeeds again; without a spool they stay
+    queued and a live send is retried with a growing wait. Batches the server refuses with
+    any other 4xx are dropped rather than retried. Callers only ever touch the in-memory queue.
+    """
+
+    RETRYABLE_4XX = (408, 425, 429)
+
+    def __init__(self, endpoint=REPORT_BATCH_ENDPOINT, max_queue=TELEMETRY_QUEUE_MAX,
+                 batch_rows=TELEMETRY_BATCH_ROWS, flush_interval=TELEMETRY_FLUSH_SEC,
+                 timeout=REPORT_TIMEOUT_SEC, spool=None, row_endpoint=REPORT_ENDPOINT):
         super().__init__()
         self.endpoint = endpoint
-        self.json_data = json_data
+        self.row_endpoint = row_endpoint
+        self.batch_route = True
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
         self.timeout = timeout
-        self.session = None
+        self.spool = spool
+        self.dropped = 0
+        self.rejected = 0
+        self._queue = collections.deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+        self._stopping = False
+
+    def enqueue(self, row):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(row)
+            if len(self._queue) >= self.batch_rows:
+                self._cond.notify()
+
+    def shutdown(self, wait_ms=5000):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        return self.wait(wait_ms)
 
     def run(self):
-        try:
-            self.session = requests.Session()
-            retry = Retry(total=1, connect=1, read=1, backoff_factor=0.1)
-            adapter = HTTPAdapter(max_retries=retry)
-            self.session.mount("https://", adapter)
-            self.session.mount("http://", adapter)
-            
-            self.session.post(
-                self.endpoint,
-                json=self.json_data,
-                timeout=self.timeout,
-                headers={"Content-Type": "application/json"}
-            )
-        except Exception as e:
-            pass
-        finally:
-            if self.session:
-                self.session.close()
+        offline = False
+        retry_wait = self.flush_interval
+        spool_pending = bool(self.spool and self.spool.has_pending())
+        while True:
+            with self._cond:
+                if not self._stopping and (offline or len(self._queue) < self.batch_rows):
+                    self._cond.wait(retry_wait if offline else self.flush_interval)
+                if self._stopping and not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_rows))]
+                stopping = self._stopping
+
+            # None: nothing was tried this round; otherwise whether the server took what was sent
+            delivered = None
+            if spool_pending and not stopping:
+                # Spooled rows are older than the queue; replay them first
+                spool_pending = not self.spool.replay(self._send, self.batch_rows)
+                delivered = not spool_pending
+            if batch and delivered is not False:
+                delivered = self._send(batch)
+                if delivered:
+                    batch = None
+            if delivered:
+                offline = False
+                retry_wait = self.flush_interval
+            elif delivered is False:
+                offline = True
+                retry_wait = min(retry_wait * 2, TELEMETRY_RETRY_MAX_SEC)
+            if not batch:
+                continue
+            if self.spool is not None:
+                try:
+                    self.spool.append(batch)
+                    spool_pending = True
+                    continue
+                except Exception:
+                    pass
+            if stopping:
+                return
+            self._requeue(batch)
+
+    def _requeue(self, batch):
+        with self._cond:
+            rows = batch + list(self._queue)
+            overflow = max(0, len(rows) - self._queue.maxlen)
+            self.dropped += overflow
+            self._queue = collections.deque(rows[overflow:], maxlen=self._queue.maxlen)
+
+    def _send(self, batch):
+        """True once the server has answered for every row of ``batch``, delivered or refused.
+        On failure ``batch`` is trimmed in place to the rows that still need sending."""
+        if self.batch_route:
+            try:
+                status = HTTP_POOL.post_json(self.endpoint, {"rows": batch}, timeout=self.timeout).status_code
+            except Exception:
+                return False
+            if status not in (404, 415):
+                return self._settled(status, len(batch))
+            logger.info(f"Batch telemetry route unavailable (HTTP {status}); sending rows one by one")
+            self.batch_route = False
+        return self._send_rows(batch)
+
+    def _send_rows(self, batch):
+        for sent, row in enumerate(batch):
+            try:
+                status = HTTP_POOL.post_json(self.row_endpoint, row, timeout=self.timeout).status_code
+            except Exception:
+                status = None
+            if status is None or not self._settled(status, 1):
+                del batch[:sent]
+                return False
+        return True
+
+    def _settled(self, status, rows):
+        if status < 300:
+            return True
+        if 400 <= status < 500 and status not in self.RETRYABLE_4XX:
+            # Resending the same rows cannot succeed; keep them from blocking the spool
+            self.rejected += rows
+            logger.warning(f"Telemetry server refused {rows} row(s) with HTTP {status}; dropped")
+            return True
+        return False
+
+
+_TELEMETRY = None
+_TELEMETRY_LOCK = threading.Lock()
+
+
+def _telemetry_dispatcher():
+    global _TELEMETRY
+    with _TELEMETRY_LOCK:
+        if _TELEMETRY is None:
+            spool = None
+            try:
+                spool = TelemetrySpool(os.path.join(QgsApplication.qgisSettingsDirPath(), "QueryGIS", "telemetry_spool"))
+            except Exception as e:
+                logger.warning(f"Telemetry spool unavailable: {e}")
+            _TELEMETRY = TelemetryDispatcher(spool=spool)
+            _TELEMETRY.start()
+        return _TELEMETRY
+
+
+def _shutdown_telemetry(wait_ms=5000):
+    """Flush queued rows; called from unload()."""
+    global _TELEMETRY
+    with _TELEMETRY_LOCK:
+        dispatcher = _TELEMETRY
+        if dispatcher is None:
+            return
+        if dispatcher.shutdown(wait_ms):
+            _TELEMETRY = None
+
+
+class HttpSessionPool:
+    """Plugin-lifetime keep-alive sessions, one per scheme://host, sharing one retry policy.
+
+    requests/urllib3 speak HTTP/1.1 only, so the saving comes from connection reuse:
+    every QueryGIS call to the same host after the first skips the TCP and TLS handshake.
+    """
+
+    def __init__(self, pool_maxsize=8, compress_min_bytes=REQUEST_COMPRESS_MIN_BYTES):
+        self._pool_maxsize = pool_maxsize
+        self._compress_min_bytes = compress_min_bytes
+        self._sessions = {}
+        # scheme://host -> request content-codings it advertised (RFC 7694 Accept-Encoding in responses)
+        self._request_codings = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def retry_policy():
+        return Retry(
+            total=2, connect=2, read=2,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504)
+        )
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_maxsize,
+                              max_retries=self.retry_policy())
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            "Content-Type": "application/json"
+        })
+        return session
+
+    @staticmethod
+    def _key(url):
+        parts = urlparse(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session_for(self, url):
+        key = self._key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session()
+                self._sessions[key] = session
+            return session
+
+    def post(self, url, **kwargs):
+        return self.session_for(url).post(url, **kwargs)
+
+    @staticmethod
+    def supported_codings():
+        return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+    @staticmethod
+    def encode_body(body, coding):
+        if coding == "zstd":
+            return zstandard.ZstdCompressor(level=3).compress(body)
+        return gzip.compress(body, compresslevel=6)
+
+    def _learn_codings(self, key, resp):
+        header = resp.headers.get("Accept-Encoding")
+        if header is None:
+            return
+        codings = set()
+        for item in header.split(","):
+            parts = [part.strip() for part in item.split(";")]
+            q = 1.0
+            for param in parts[1:]:
+                if param.lower().startswith("q="):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            if parts[0] and q > 0:
+                codings.add(parts[0].lower())
+        with self._lock:
+            self._request_codings[key] = codings
+
+    def request_coding(self, url):
+        with self._lock:
+            advertised = self._request_codings.get(self._key(url)) or ()
+        for coding in self.supported_codings():
+            if coding in advertised:
+                return coding
+        return None
+
+    def post_json(self, url, payload, headers=None, **kwargs):
+        """POST ``payload`` as JSON; bodies above the threshold are compressed once the host has
+        advertised a request coding it accepts, falling back to identity on 415."""
+        key = self._key(url)
+        session = self.session_for(url)
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        headers = dict(headers or {}, **{"Content-Type": "application/json"})
+        coding = self.request_coding(url) if len(body) >= self._compress_min_bytes else None
+        if coding:
+            resp = session.post(url, data=self.encode_body(body, coding),
+                                headers=dict(headers, **{"Content-Encoding": coding}), **kwargs)
+            self._learn_codings(key, resp)
+            if resp.status_code != 415:
+                return resp
+            resp.close()
+            with self._lock:
+                codings = self._request_codings.get(key) or set()
+                codings.discard(coding)
+                self._request_codings[key] = codings
+        resp = session.post(url, data=body, headers=headers, **kwargs)
+        self._learn_codings(key, resp)
+        return resp
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._request_codings.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
+HTTP_POOL = HttpSessionPool()
+
+
+def _iter_sse_events(lines):
+    """Yield (event, data) pairs from decoded text/event-stream lines."""
+    event, data = "message", []
+    for line in lines:
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value or "message"
+        elif field == "data":
+            data.append(value)
+    if data:
+        yield event, "\n".join(data)
+
 
 class BackendWorker(QThread):
-    finished = pyqtSignal(str)
+    # Parsed JSON (dict/list) when the body decodes, otherwise the raw text
+    finished = pyqtSignal(object)
     error = pyqtSignal(str)
     step_update = pyqtSignal(str)
+    token = pyqtSignal(str)
 
-    def __init__(self, payload, backend_url="https://querygis.com/chat", timeout_sec=180):
+    def __init__(self, payload, backend_url="https://querygis.com/chat", timeout_sec=180, phase="llm_call",
+                 stream=False):
         super().__init__()
         self.payload = payload
         self.backend_url = backend_url
         self.timeout_sec = timeout_sec
+        self.phase = phase
+        self.stream = stream
         self._is_cancelled = False
 
         self._user_input = payload.get("user_input", "")
@@ -385,22 +843,8 @@ class BackendWorker(QThread):
         self._is_cancelled = True
 
     def run(self):
-        session = None
         try:
-            session = requests.Session()
-            retry = Retry(
-                total=2, connect=2, read=2,
-                backoff_factor=0.2,
-                status_forcelist=(502, 503, 504)
-            )
-            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=5, max_retries=retry)
-            session.mount("https://", adapter)
-            session.mount("http://", adapter)
-            session.headers.update({
-                "Accept-Encoding": "gzip, deflate",
-                "Connection": "keep-alive",
-                "Content-Type": "application/json"
-            })
+            HTTP_POOL.session_for(self.backend_url)
         except Exception as e:
             self.error.emit(f"Failed to create request session: {e}")
             return
@@ -415,23 +859,40 @@ class BackendWorker(QThread):
 
             self.step_update.emit("Dispatched request to AI engine")
             try:
-                resp = session.post(
+                payload = self.payload
+                headers = None
+                if self.stream:
+                    # Servers without streaming support ignore the flag and answer with plain JSON
+                    payload = dict(self.payload, stream=True)
+                    headers = {"Accept": "text/event-stream, application/json;q=0.9"}
+                resp = HTTP_POOL.post_json(
                     self.backend_url,
-                    json=self.payload,
-                    timeout=self.timeout_sec
+                    payload,
+                    timeout=self.timeout_sec,
+                    headers=headers,
+                    stream=self.stream
                 )
+                if self._is_cancelled:
+                    resp.close()
+                    return
                 
-                if resp.status_code == 200:
+                if resp.status_code == 200 and resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    try:
+                        data = self._read_event_stream(resp)
+                    finally:
+                        resp.close()
+                    if data is not None:
+                        self.step_update.emit("Synthesizing response...")
+                        self.finished.emit(data)
+                elif resp.status_code == 200:
                     try:
                         data = resp.json()
-                        if isinstance(data, (dict, list)):
-                            text = json.dumps(data, ensure_ascii=False)
-                        else:
-                            text = str(data)
+                        if not isinstance(data, (dict, list)):
+                            data = str(data)
                     except Exception:
-                        text = resp.text
+                        data = resp.text
                     self.step_update.emit("Synthesizing response...")
-                    self.finished.emit(text)
+                    self.finished.emit(data)
                 else:
                     try:
                         ejson = resp.json()
@@ -446,32 +907,108 @@ class BackendWorker(QThread):
                         generated_code="",
                         error_message=f"Server error {resp.status_code}: {msg}",
                         model_name=self._model_name,
-                        phase="llm_call",
+                        phase=self.phase,
                         metadata={"plugin_version": "QueryGIS-Plugin/1.5"}
                     )
 
             except requests.exceptions.Timeout:
                 self.error.emit("Request timeout - server did not respond in time")
                 _send_error_report(self._user_input, self._context_text, "", "Timeout to backend",
-                                   self._model_name, "llm_call", {"plugin_version": "QueryGIS-Plugin/1.5"})
+                                   self._model_name, self.phase, {"plugin_version": "QueryGIS-Plugin/1.5"})
 
             except requests.exceptions.ConnectionError:
                 self.error.emit(f"Cannot connect to backend server at {self.backend_url}")
                 _send_error_report(self._user_input, self._context_text, "", "ConnectionError to backend",
-                                   self._model_name, "llm_call", {"plugin_version": "QueryGIS-Plugin/1.5"})
+                                   self._model_name, self.phase, {"plugin_version": "QueryGIS-Plugin/1.5"})
 
             except requests.exceptions.RequestException as e:
                 self.error.emit(f"Network error: {e}")
                 _send_error_report(self._user_input, self._context_text, "", f"RequestException: {e}",
-                                   self._model_name, "llm_call", {"plugin_version": "QueryGIS-Plugin/1.5"})
+                                   self._model_name, self.phase, {"plugin_version": "QueryGIS-Plugin/1.5"})
 
         except Exception as e:
             self.error.emit(f"Worker error: {e}\n{traceback.format_exc()}")
             _send_error_report(self._user_input, self._context_text, "", f"Worker error: {e}",
-                               self._model_name, "llm_call", {"plugin_version": "QueryGIS-Plugin/1.5"})
-        finally:
-            if session:
-                session.close()
+                               self._model_name, self.phase, {"plugin_version": "QueryGIS-Plugin/1.5"})
+
+    def _read_event_stream(self, resp):
+        """Emit token() per text delta; returns the final response dict, or None.
+
+        A stream that ends without a final event is an error: the text so far may be a
+        truncated script and must not be run or cached.
+        """
+        resp.encoding = "utf-8"  # requests assumes latin-1 for text/* without a charset
+        parts = []
+        final = None
+        complete = False
+        self.step_update.emit("Streaming response...")
+        for event, data in _iter_sse_events(resp.iter_lines(chunk_size=256, decode_unicode=True)):
+            if self._is_cancelled:
+                return None
+            if data == "[DONE]":
+                complete = True
+                break
+            try:
+                obj = json.loads(data)
+            except ValueError:
+                obj = data
+            if event in ("final", "done"):
+                final = obj if isinstance(obj, dict) else None
+                complete = True
+                break
+            if event == "error":
+                msg = (obj.get("error") or obj.get("message") or str(obj)) if isinstance(obj, dict) else str(obj)
+                self.error.emit(f"Server error: {msg}")
+                _send_error_report(self._user_input, self._context_text, "", f"Stream error: {msg}",
+                                   self._model_name, self.phase, {"plugin_version": "QueryGIS-Plugin/1.5"})
+                return None
+            if isinstance(obj, dict):
+                delta = obj.get("text") or obj.get("delta") or ""
+            else:
+                delta = str(obj)
+            if delta:
+                parts.append(delta)
+                self.token.emit(delta)
+        if not complete:
+            if self._is_cancelled:
+                return None
+            self.error.emit("Stream ended before final event")
+            _send_error_report(self._user_input, self._context_text, "", "Stream ended before final event",
+                               self._model_name, self.phase, {"plugin_version": "QueryGIS-Plugin/1.5",
+                                                              "streamed_chars": sum(map(len, parts))})
+            return None
+        # The final event carries token_count, tool_request, etc.; the text itself may be omitted
+        final = final or {}
+        if not any(k in final for k in ("output", "response", "text", "choices")):
+            final["response"] = "".join(parts)
+        return final
+
+class _StepFeedback(QgsProcessingFeedback):
+    """Feedback of one step in a parallel batch.
+
+    Each task gets its own progress and cancel state; messages go to the run's shared feedback,
+    progress goes to ``on_progress`` so the batch can report one combined value, and cancelling
+    the shared feedback cancels the step.
+    """
+    def __init__(self, shared, on_progress):
+        super().__init__()
+        self._shared = shared
+        self._on_progress = on_progress
+        shared.canceled.connect(self.cancel)
+        if shared.isCanceled():
+            self.cancel()
+    def setProgress(self, p):
+        super().setProgress(p)
+        self._on_progress(p)
+    def pushInfo(self, info):
+        super().pushInfo(info)
+        self._shared.pushInfo(info)
+    def pushWarning(self, warning):
+        super().pushWarning(warning)
+        self._shared.pushWarning(warning)
+    def reportError(self, error, fatalError=False):
+        super().reportError(error, fatalError)
+        self._shared.reportError(error, fatalError)
 
 class UiSafeBridge(QObject):
     requested = pyqtSignal(str, object) # message, progress
@@ -491,100 +1028,2112 @@ class _UIFeedback(QgsProcessingFeedback):
             self._bridge.requested.emit(str(info), None)
 
 class _RunProgressProxy:
-    def __init__(self, bridge, scope=None):
+    """Per-execution state for the processing.run hook: default feedback, step counters and
+    whether algorithms run on the task manager."""
+
+    def __init__(self, bridge, scope=None, background=False, max_parallel=1, checkpoints=None, stdout=None):
         self._bridge = bridge
         self._scope = scope or {}
+        self.background = background
+        self.max_parallel = max_parallel
+        self.checkpoints = checkpoints
+        self.cancelled = False
+        self._stdout = stdout
+        self._loops = []
+        self._tasks = set()
         self._calls_seen = 0
         self._calls_done = 0
         self._last_ui_ms = 0
+    def wait(self, loop):
+        """Spin ``loop`` until a background step quits it.
+
+        The rest of QGIS runs meanwhile, so its output goes to the real stdout and its own
+        processing.run calls (console, other plugins) are not taken for this run's steps.
+        """
+        redirected = sys.stdout
+        if self._stdout is not None:
+            sys.stdout = self._stdout
+        token = _ACTIVE_RUN.set(None)
+        self._loops.append(loop)
+        try:
+            if not self.cancelled:
+                loop.exec_()
+        finally:
+            self._loops.remove(loop)
+            _ACTIVE_RUN.reset(token)
+            sys.stdout = redirected
+    def track(self, task):
+        self._tasks.add(task)
+    def untrack(self, task):
+        self._tasks.discard(task)
+    def cancel(self):
+        """Cancel the run's queued algorithms and leave any loop the script is waiting in."""
+        self.cancelled = True
+        for task in list(self._tasks):
+            try:
+                task.cancel()
+            except RuntimeError:
+                pass  # Already finished and deleted by the task manager
+        self._tasks.clear()
+        for loop in list(self._loops):
+            loop.quit()
     def _maybe_update(self, text, progress=None):
+        if self.cancelled:
+            return
         now = int(time.time()*1000)
         # Throttled UI updates via signal
         if now - self._last_ui_ms >= 200: 
             self._last_ui_ms = now
             self._bridge.requested.emit(text, progress)
-    def wrap(self, real_run):
-        def _wrapped(alg_id, params, context=None, feedback=None, **kwargs):
-            # If AI code didn't provide feedback, inject our UI feedback if available in scope
-            if feedback is None and 'processing_feedback' in self._scope:
-                feedback = self._scope['processing_feedback']
-            
-            self._calls_seen += 1
-            self._maybe_update(f"Processing step {self._calls_seen}…")
-            try:
-                res = self._safe_run(real_run, alg_id, params, context=context, feedback=feedback)
-                self._calls_done += 1
-                self._maybe_update(f"Step {self._calls_done} complete")
-                if self._calls_done == self._calls_seen:
-                    self._maybe_update("Analysis complete", progress=100)
-                return res
-            except Exception:
-                self._maybe_update("Processing failed")
-                raise
-        return _wrapped
+    def default_feedback(self):
+        return self._scope.get('processing_feedback')
+    def started(self):
+        self._calls_seen += 1
+        self._maybe_update(f"Processing step {self._calls_seen}…")
+    def finished(self, ok):
+        if not ok:
+            self._maybe_update("Processing failed")
+            return
+        self._calls_done += 1
+        self._maybe_update(f"Step {self._calls_done} complete")
+        if self._calls_done == self._calls_seen:
+            self._maybe_update("Analysis complete", progress=100)
+
+
+_ACTIVE_RUN = contextvars.ContextVar("querygis_active_run", default=None)
+
+
+StepKey = collections.namedtuple("StepKey", "digest destinations sources")
+
+
+class StepCheckpointStore:
+    """Outputs of successful processing.run steps for one request and its fix rounds.
+
+    Keyed by (algorithm id, normalised input parameters, input fingerprints); destination
+    parameters are left out, so renaming an output between rounds still hits. Vector layer
+    outputs are written to GeoPackages under the processing temp folder, so a fixed script
+    that repeats a step with identical inputs gets the result back without running it. Layers
+    coming out of a step are fingerprinted by that step's key, which keeps keys of later
+    steps stable across rounds.
+
+    Algorithms without destination parameters (selections, indexes, edits in place) are never
+    checkpointed, and neither are results that hand back one of the step's own inputs.
+    """
+
+    TEMPORARY = ("memory:", "TEMPORARY_OUTPUT")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self._entries = {}
+        self._layer_keys = {}  # layer id -> "<step key>/<output name>"
+
+    @classmethod
+    def create(cls):
+        directory = os.path.join(QgsProcessingUtils.tempFolder(), "querygis_checkpoints", uuid.uuid4().hex[:12])
+        os.makedirs(directory, exist_ok=True)
+        return cls(directory)
+
+    def key_for(self, call):
+        """Checkpoint key for bound processing.run arguments, or None if the step can't be keyed."""
+        if call.get('onFinish'):
+            return None
+        alg = call.get('algOrName')
+        if isinstance(alg, str):
+            registry = QgsApplication.processingRegistry()
+            alg = registry.algorithmById(alg) if registry is not None else None
+        if not isinstance(alg, QgsProcessingAlgorithm):
+            return None
+        # Without a destination the algorithm works on its inputs: nothing to replay
+        outputs = {d.name() for d in alg.destinationParameterDefinitions()}
+        if not outputs:
+            return None
+        parameters = call.get('parameters') or {}
+        if not isinstance(parameters, dict):
+            return None
+        inputs = {k: v for k, v in parameters.items() if k not in outputs}
+        try:
+            params = self._normalize(inputs)
+        except ValueError:
+            return None
+        blob = json.dumps([alg.id(), params], sort_keys=True, ensure_ascii=False, default=str)
+        destinations = {k: v for k, v in parameters.items() if k in outputs}
+        return StepKey(hashlib.sha1(blob.encode("utf-8")).hexdigest(), destinations,
+                       frozenset(self._sources(inputs, set())))
+
+    def _sources(self, value, found):
+        """Layer ids, sources and strings an input parameter value can refer to."""
+        if isinstance(value, AutoVerifyWrapper):
+            value = object.__getattribute__(value, '_obj')
+        if isinstance(value, QgsProcessingFeatureSourceDefinition):
+            value = value.source.staticValue() if hasattr(value.source, 'staticValue') else value.source
+        if isinstance(value, str):
+            found.update((value, value.split("|", 1)[0]))
+            project = QgsProject.instance()
+            layer = project.mapLayer(value)
+            for lyr in ([layer] if layer is not None else project.mapLayersByName(value)):
+                self._sources(lyr, found)
+        elif isinstance(value, QgsMapLayer):
+            found.update((value.id(), value.source(), value.source().split("|", 1)[0]))
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                self._sources(v, found)
+        elif isinstance(value, dict):
+            for v in value.values():
+                self._sources(v, found)
+        return found
+
+    @staticmethod
+    def _aliases_input(key, value):
+        if isinstance(value, QgsMapLayer):
+            return value.id() in key.sources or value.source() in key.sources
+        return isinstance(value, str) and (value in key.sources or value.split("|", 1)[0] in key.sources)
+
+    def _normalize(self, value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, str):
+            return self._string_fingerprint(value)
+        if isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        if isinstance(value, dict):
+            return {str(k): self._normalize(v) for k, v in value.items()}
+        if isinstance(value, AutoVerifyWrapper):
+            return self._normalize(object.__getattribute__(value, '_obj'))
+        if isinstance(value, QgsMapLayer):
+            return self._layer_fingerprint(value)
+        if isinstance(value, QgsProcessingFeatureSourceDefinition):
+            source = value.source.staticValue() if hasattr(value.source, 'staticValue') else value.source
+            layer = source if isinstance(source, QgsMapLayer) else None
+            if layer is None and isinstance(source, str):
+                layer = QgsProject.instance().mapLayer(source)
+                if layer is None:
+                    matches = QgsProject.instance().mapLayersByName(source)
+                    layer = matches[0] if matches else None
+            fp = self._normalize(layer if layer is not None else source)
+            selected = sorted(layer.selectedFeatureIds()) if value.selectedFeaturesOnly and layer is not None else None
+            return ["source", fp, selected, value.featureLimit]
+        if isinstance(value, QgsCoordinateReferenceSystem):
+            return ["crs", value.authid() or value.toWkt()]
+        if isinstance(value, (QgsRectangle, QgsPointXY)):
+            return ["geom", value.toString()]
+        if isinstance(value, QgsGeometry):
+            return ["geom", value.asWkt()]
+        raise ValueError(f"cannot key {type(value).__name__}")
+
+    def _string_fingerprint(self, value):
+        project = QgsProject.instance()
+        layer = project.mapLayer(value)
+        if layer is None:
+            matches = project.mapLayersByName(value)
+            layer = matches[0] if matches else None
+        if layer is not None:
+            return self._layer_fingerprint(layer)
+        path = value.split("|", 1)[0]
+        if os.path.isfile(path):
+            st = os.stat(path)
+            return ["file", value, st.st_mtime_ns, st.st_size]
+        return value
+
+    def _layer_fingerprint(self, layer):
+        key = self._layer_keys.get(layer.id())
+        if key is not None:
+            return ["step", key]
+        provider = layer.providerType() if hasattr(layer, 'providerType') else ""
+        subset = layer.subsetString() if hasattr(layer, 'subsetString') else ""
+        if provider == "memory":
+            digest = hashlib.sha1()
+            for f in layer.getFeatures():
+                digest.update(f.geometry().asWkb() if f.hasGeometry() else b"")
+                digest.update(repr(f.attributes()).encode("utf-8"))
+            return ["memory", layer.crs().authid(), digest.hexdigest()]
+        path = layer.source().split("|", 1)[0]
+        if os.path.isfile(path):
+            st = os.stat(path)
+            return ["layer", layer.source(), subset, st.st_mtime_ns, st.st_size]
+        count = layer.featureCount() if hasattr(layer, 'featureCount') else None
+        return ["layer", layer.source(), subset, count]
+
+    def load(self, key):
+        """Results of the step ``key`` rebuilt from its checkpoint, or None."""
+        entry = self._entries.get(key.digest)
+        if entry is None:
+            return None
+        results = {}
+        for name, out in entry.items():
+            kind = out[0]
+            destination = key.destinations.get(name)
+            if not isinstance(destination, str) or destination in self.TEMPORARY:
+                destination = None
+            if kind == "vector":
+                _, path, layer_name = out
+                if destination is not None and destination.startswith("memory:"):
+                    layer_name = destination[len("memory:"):] or layer_name
+                elif destination is not None:
+                    return None  # This round writes the output to a file of its own
+                layer = QgsVectorLayer(path, layer_name, "ogr")
+                if not layer.isValid():
+                    return None
+                self._layer_keys[layer.id()] = f"{key.digest}/{name}"
+                results[name] = layer
+            elif kind == "file":
+                _, path, mtime, size = out
+                if destination is not None and destination != path:
+                    return None
+                if not os.path.isfile(path) or os.stat(path).st_mtime_ns != mtime or os.stat(path).st_size != size:
+                    return None
+                results[name] = path
+            else:
+                results[name] = out[1]
+        self.hits += 1
+        return results
+
+    def save(self, key, results):
+        entry = {}
+        for name, value in (results or {}).items():
+            if self._aliases_input(key, value):
+                return  # Replaying would hand back the input, not what the step made of it
+            if isinstance(value, QgsVectorLayer):
+                # A new file every time: a layer loaded from an earlier save may still read the old one
+                path = os.path.join(self.directory, f"{key.digest[:16]}_{uuid.uuid4().hex[:8]}.gpkg")
+                if not self._write_gpkg(value, path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    return
+                self._layer_keys[value.id()] = f"{key.digest}/{name}"
+                entry[name] = ("vector", path, value.name())
+            elif isinstance(value, QgsMapLayer):
+                # Raster and other layers: only file-backed ones can be reopened
+                path = value.source()
+                if not os.path.isfile(path):
+                    return
+                self._layer_keys[value.id()] = f"{key.digest}/{name}"
+                entry[name] = ("file", path, os.stat(path).st_mtime_ns, os.stat(path).st_size)
+            elif isinstance(value, str) and os.path.isfile(value.split("|", 1)[0]):
+                path = value.split("|", 1)[0]
+                entry[name] = ("file", value, os.stat(path).st_mtime_ns, os.stat(path).st_size)
+            elif value is None or isinstance(value, (bool, int, float, str)):
+                entry[name] = ("value", value)
+            else:
+                return
+        self._entries[key.digest] = entry
+
     @staticmethod
-    def _safe_run(real_run, alg_id, params, context=None, feedback=None):
+    def _write_gpkg(layer, path):
         try:
-            return real_run(alg_id, params, context=context, feedback=feedback, is_child_algorithm=False)
-        except TypeError:
-            pass
+            if hasattr(QgsVectorFileWriter, "writeAsVectorFormatV3"):
+                options = QgsVectorFileWriter.SaveVectorOptions()
+                options.driverName = "GPKG"
+                result = QgsVectorFileWriter.writeAsVectorFormatV3(
+                    layer, path, QgsProject.instance().transformContext(), options)
+            else:
+                result = QgsVectorFileWriter.writeAsVectorFormat(layer, path, "UTF-8", layer.crs(), "GPKG")
+            error = result[0] if isinstance(result, tuple) else result
+            return error == QgsVectorFileWriter.NoError
+        except Exception as e:
+            logger.warning(f"Checkpoint write failed: {e}")
+            return False
+
+    def close(self):
+        """Drop the index; keep files that layers in the project still read from."""
+        self._entries.clear()
+        self._layer_keys.clear()
+        in_use = {lyr.source().split("|", 1)[0] for lyr in QgsProject.instance().mapLayers().values()}
         try:
-            return real_run(alg_id, params, context=context, feedback=feedback, is_child=False)
-        except TypeError:
-            pass
-        return real_run(alg_id, params, context=context, feedback=feedback)
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path not in in_use:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if not any(os.path.join(self.directory, n) in in_use for n in names):
+            shutil.rmtree(self.directory, ignore_errors=True)
 
 
-class QgsMessageLogCapture(QObject):
-    def __init__(self):
-        super().__init__()
-        self.messages = []
-        self._connected = False
-    
-    def start(self):
-        if not self._connected:
-            QgsApplication.messageLog().messageReceived.connect(self._on_message)
-            self._connected = True
-        self.messages = []
-    
-    def stop(self):
-        if self._connected:
-            try:
-                QgsApplication.messageLog().messageReceived.disconnect(self._on_message)
-            except:
-                pass
-            self._connected = False
-    
-    def _on_message(self, message, tag, level):
-        level_str = ["INFO", "WARNING", "CRITICAL"][level] if level < 3 else "UNKNOWN"
-        self.messages.append(f"[{tag}:{level_str}] {message}")
-    
-    def get_messages(self, last_n=30):
-        return '\n'.join(self.messages[-last_n:])
-    
-    def get_errors_only(self):
-        return '\n'.join([m for m in self.messages if 'WARNING' in m or 'CRITICAL' in m])
+class BackgroundAlgorithmRunner:
+    """Runs one algorithm as a QgsProcessingAlgRunnerTask while the calling script waits in a
+    nested event loop, so the canvas, chat and progress bar keep updating.
 
+    Result layers are taken out of the processing context back on the main thread, as
+    processing.run does, so the script receives QgsMapLayer objects it can add to the project.
+    """
 
-class QueryGIS(QObject):
-    def __init__(self, iface_obj):
-        super().__init__()
-        self.iface = iface_obj
-        self.plugin_dir = os.path.dirname(__file__)
-        self.menu = self.tr(u'&QueryGIS')
-        self.actions = []
-        self.dockwidget = None
-        self.chat_history = []
+    LAYER_OUTPUTS = (QgsProcessingOutputVectorLayer, QgsProcessingOutputRasterLayer, QgsProcessingOutputMapLayer)
 
-        self.default_status_color = "#F0F0F0"
-        self.success_status_color = "#66FF66"
-        self.error_status_color = "#FF3333"
+    @staticmethod
+    def create(alg_or_name):
+        if isinstance(alg_or_name, QgsProcessingAlgorithm):
+            return alg_or_name.create()
+        registry = QgsApplication.processingRegistry()
+        return registry.createAlgorithmById(alg_or_name) if registry is not None else None
+
+    @staticmethod
+    def create_context(feedback):
+        # The same context processing.run builds: project, invalid geometry and transform settings
+        try:
+            from processing.tools import dataobjects
+        except ImportError:
+            context = QgsProcessingContext()
+            context.setProject(QgsProject.instance())
+            context.setFeedback(feedback)
+            return context
+        return dataobjects.createContext(feedback)
+
+    @classmethod
+    def can_run(cls, alg):
+        # Algorithms that touch the GUI or the project directly must stay on the main thread
+        return alg is not None and not (alg.flags() & QgsProcessingAlgorithm.FlagNoThreading)
+
+    @classmethod
+    def start(cls, alg, parameters, on_done, feedback=None, context=None):
+        """Queue ``alg`` on the task manager; ``on_done(results, error)`` is called on the main thread."""
+        if feedback is None:
+            feedback = QgsProcessingFeedback()
+        if context is None:
+            context = cls.create_context(feedback)
+        context.setFeedback(feedback)
+        ok, message = alg.checkParameterValues(parameters, context)
+        if not ok:
+            raise QgsProcessingException(f"Unable to execute algorithm\n{message}")
+
+        task = QgsProcessingAlgRunnerTask(alg, parameters, context, feedback)
+
+        def on_executed(ok, results):
+            if not ok:
+                if feedback.isCanceled():
+                    on_done(None, QgsProcessingException(f"{alg.id()} was cancelled"))
+                else:
+                    on_done(None, QgsProcessingException(f"There were errors executing the algorithm {alg.id()}"))
+                return
+            on_done(cls._take_result_layers(alg, context, dict(results or {})), None)
+
+        task.executed.connect(on_executed)
+        QgsApplication.taskManager().addTask(task)
+        return task
+
+    @classmethod
+    def run(cls, alg, parameters, feedback=None, context=None, proxy=None):
+        """Run ``alg`` on the task manager and wait for it in a nested event loop.
+
+        With the active run's ``proxy`` the wait goes through ``proxy.wait``, so the task can be
+        cancelled and the loop left when the plugin unloads or the dock closes.
+        """
+        loop = QEventLoop()
+        outcome = {}
+
+        def on_done(results, error):
+            outcome["results"] = results
+            outcome["error"] = error
+            loop.quit()
+
+        task = cls.start(alg, parameters, on_done, feedback=feedback, context=context)
+        if not outcome:
+            if proxy is None:
+                loop.exec_()
+            else:
+                proxy.track(task)
+                try:
+                    proxy.wait(loop)
+                finally:
+                    proxy.untrack(task)
+        if not outcome:
+            raise QgsProcessingException(f"{alg.id()} was cancelled")
+        if outcome["error"] is not None:
+            raise outcome["error"]
+        return outcome["results"]
+
+    @classmethod
+    def _take_result_layers(cls, alg, context, results):
+        for out in alg.outputDefinitions():
+            if isinstance(out, cls.LAYER_OUTPUTS):
+                value = results.get(out.name())
+                if isinstance(value, str):
+                    layer = context.takeResultLayer(value)
+                    if layer is not None:
+                        results[out.name()] = layer
+        return results
+
+
+class ProcessingRunHook:
+    """The one wrapper around ``processing.run``, installed once and removed on unload.
+
+    Outside a QueryGIS execution (no active _RunProgressProxy) calls pass straight through,
+    so the Python console and other plugins see the original behaviour.
+    """
+
+    MARKER = "__querygis_original__"
+
+    def __init__(self):
+        self._module = None
+        self._original = None
+        self._signature = None
+        self._feedback_pos = None
+        self._child_kwarg = None
+        self._child_pos = None
+
+    def install(self, proc_mod):
+        if proc_mod is None or not hasattr(proc_mod, 'run'):
+            return False
+        if self._module is proc_mod and getattr(proc_mod.run, self.MARKER, None) is self._original:
+            return True
+        # A hook left behind by an earlier load of the plugin is unwrapped, not wrapped again
+        original = getattr(proc_mod.run, self.MARKER, proc_mod.run)
+        self._inspect(original)
+        self._module = proc_mod
+        self._original = original
+        hooked = self._make_hooked(original)
+        setattr(hooked, self.MARKER, original)
+        proc_mod.run = hooked
+        return True
+
+    def uninstall(self):
+        proc_mod = self._module
+        if proc_mod is not None and getattr(proc_mod.run, self.MARKER, None) is self._original:
+            proc_mod.run = self._original
+        self._module = None
+        self._original = None
+
+    def _inspect(self, original):
+        self._signature = None
+        self._feedback_pos = None
+        self._child_kwarg = None
+        self._child_pos = None
+        try:
+            self._signature = inspect.signature(original)
+        except (TypeError, ValueError):
+            return
+        params = list(self._signature.parameters.values())
+        names = [p.name for p in params]
+        if 'feedback' in names:
+            self._feedback_pos = names.index('feedback')
+        for name in ('is_child_algorithm', 'is_child'):
+            if name in names:
+                self._child_kwarg = name
+                self._child_pos = names.index(name)
+                break
+
+    def _make_hooked(self, original):
+        hook = self
+
+        def run(*args, **kwargs):
+            proxy = _ACTIVE_RUN.get()
+            if proxy is None:
+                return original(*args, **kwargs)
+            kwargs = hook.complete_kwargs(proxy, args, kwargs)
+            key = hook.checkpoint_key(proxy, args, kwargs)
+            proxy.started()
+            if key is not None:
+                cached = proxy.checkpoints.load(key)
+                if cached is not None:
+                    proxy.finished(True)
+                    return cached
+            plan = hook.background_plan(proxy, args, kwargs)
+            try:
+                if plan is None:
+                    result = original(*args, **kwargs)
+                else:
+                    result = BackgroundAlgorithmRunner.run(*plan, proxy=proxy)
+            except Exception:
+                proxy.finished(False)
+                raise
+            if key is not None:
+                proxy.checkpoints.save(key, result)
+            proxy.finished(True)
+            return result
+        run.__name__ = getattr(original, '__name__', 'run')
+        run.__doc__ = getattr(original, '__doc__', None)
+        return run
+
+    def hooks(self, func):
+        return self._original is not None and getattr(func, self.MARKER, None) is self._original
+
+    def complete_kwargs(self, proxy, args, kwargs):
+        kwargs = dict(kwargs)
+        pos = self._feedback_pos
+        if pos is not None and len(args) <= pos and kwargs.get('feedback') is None:
+            kwargs['feedback'] = proxy.default_feedback()
+        # Only when the caller did not already pass it positionally
+        if self._child_kwarg is not None and len(args) <= self._child_pos:
+            kwargs.setdefault(self._child_kwarg, False)
+        return kwargs
+
+    def bind(self, args, kwargs):
+        if self._signature is None:
+            return None
+        try:
+            return dict(self._signature.bind(*args, **kwargs).arguments)
+        except TypeError:
+            return None
+
+    def checkpoint_key(self, proxy, args, kwargs):
+        if proxy.checkpoints is None:
+            return None
+        call = self.bind(args, kwargs)
+        return proxy.checkpoints.key_for(call) if call is not None else None
+
+    def background_plan(self, proxy, args, kwargs):
+        """``(alg, parameters, feedback, context)`` when the call can go to the task manager, else None."""
+        if not proxy.background:
+            return None
+        call = self.bind(args, kwargs)
+        if call is None:
+            return None
+        if call.get('onFinish') or call.get('is_child_algorithm') or call.get('is_child'):
+            return None
+        alg = BackgroundAlgorithmRunner.create(call.get('algOrName'))
+        if not BackgroundAlgorithmRunner.can_run(alg):
+            return None
+        return alg, call.get('parameters') or {}, call.get('feedback'), call.get('context')
+
+
+PROCESSING_RUN_HOOK = ProcessingRunHook()
+
+
+def run_processing_steps(namespace, steps, deps):
+    """Run consecutive ``processing.run`` statements as a dependency graph (see CodeRewriter).
+
+    ``steps`` are ``(target, thunk)``: the thunk evaluates the call's function, positional and
+    keyword arguments in the script's globals once the steps in ``deps[i]`` have finished and
+    assigned their targets. Independent steps run concurrently on the task manager, up to the
+    active run's ``max_parallel``; otherwise the steps run one by one in source order.
+    """
+    proxy = _ACTIVE_RUN.get()
+    max_parallel = proxy.max_parallel if proxy is not None and proxy.background else 1
+    if max_parallel <= 1:
+        for target, thunk in steps:
+            func, args, kwargs = thunk()
+            result = func(*args, **kwargs)
+            if target:
+                namespace[target] = result
+        return
+
+    pending = list(range(len(steps)))
+    running = set()
+    done = set()
+    errors = {}
+    tasks = {}
+    loop = QEventLoop()
+    waiting = [False]
+    progress = [0.0] * len(steps)
+    progress_lock = threading.Lock()
+
+    def step_progress(i, shared, p):
+        # Called from the task threads; the shared feedback shows the batch's mean progress
+        with progress_lock:
+            progress[i] = p
+            total = sum(progress) / len(progress)
+        shared.setProgress(total)
+
+    def finish(i, target, key, result, error):
+        proxy.untrack(tasks.pop(i, None))
+        running.discard(i)
+        if proxy.cancelled:
+            return
+        proxy.finished(error is None)
+        if error is not None:
+            errors[i] = error
+        else:
+            if key is not None:
+                proxy.checkpoints.save(key, result)
+            if target:
+                namespace[target] = result
+            done.add(i)
+        if waiting[0]:
+            loop.quit()
+
+    def launch_ready():
+        for i in list(pending):
+            if errors or len(running) >= max_parallel:
+                return
+            if not all(d in done for d in deps[i]):
+                continue
+            pending.remove(i)
+            target, thunk = steps[i]
+            func, args, kwargs = thunk()
+            plan = key = None
+            if PROCESSING_RUN_HOOK.hooks(func):
+                kwargs = PROCESSING_RUN_HOOK.complete_kwargs(proxy, args, kwargs)
+                key = PROCESSING_RUN_HOOK.checkpoint_key(proxy, args, kwargs)
+                cached = proxy.checkpoints.load(key) if key is not None else None
+                if cached is not None:
+                    proxy.started()
+                    proxy.finished(True)
+                    if target:
+                        namespace[target] = cached
+                    done.add(i)
+                    continue
+                plan = PROCESSING_RUN_HOOK.background_plan(proxy, args, kwargs)
+            if plan is None:
+                # Main-thread-only algorithm or not a plain processing.run: run it here, in order
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    errors[i] = e
+                    return
+                if target:
+                    namespace[target] = result
+                done.add(i)
+                continue
+            alg, parameters, feedback, context = plan
+            if feedback is not None:
+                feedback = _StepFeedback(feedback, lambda p, i=i, shared=feedback: step_progress(i, shared, p))
+            running.add(i)
+            proxy.started()
+            try:
+                tasks[i] = BackgroundAlgorithmRunner.start(
+                    alg, parameters, lambda res, err, i=i, target=target, key=key: finish(i, target, key, res, err),
+                    feedback=feedback, context=context)
+                proxy.track(tasks[i])
+            except Exception as e:
+                running.discard(i)
+                proxy.finished(False)
+                errors[i] = e
+                return
+
+    while True:
+        before = len(done)
+        launch_ready()
+        if not running:
+            if errors or not pending or len(done) == before:
+                break
+            continue
+        waiting[0] = True
+        proxy.wait(loop)
+        waiting[0] = False
+        if proxy.cancelled:
+            raise QgsProcessingException("Processing steps were cancelled")
+    if errors:
+        raise errors[min(errors)]
+
+
+class QgsMessageLogCapture(QObject):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self._connected = False
+    
+    def start(self):
+        if not self._connected:
+            QgsApplication.messageLog().messageReceived.connect(self._on_message)
+            self._connected = True
+        self.messages = []
+    
+    def stop(self):
+        if self._connected:
+            try:
+                QgsApplication.messageLog().messageReceived.disconnect(self._on_message)
+            except:
+                pass
+            self._connected = False
+    
+    def _on_message(self, message, tag, level):
+        level_str = ["INFO", "WARNING", "CRITICAL"][level] if level < 3 else "UNKNOWN"
+        self.messages.append(f"[{tag}:{level_str}] {message}")
+    
+    def get_messages(self, last_n=30):
+        return '\n'.join(self.messages[-last_n:])
+    
+    def get_errors_only(self):
+        return '\n'.join([m for m in self.messages if 'WARNING' in m or 'CRITICAL' in m])
+
+
+class LayerContextCache(QObject):
+    """Per-layer context entries, dropped when the project or the layer reports a change."""
+
+    LAYER_SIGNALS = ("dataChanged", "crsChanged", "nameChanged", "styleChanged")
+
+    invalidated = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._entries = {}
+        self._generations = {}
+        self._watched = {}
+        self._attached = False
+
+    def attach(self):
+        if self._attached:
+            return
+        project = QgsProject.instance()
+        project.layersAdded.connect(self._on_layers_added)
+        project.layersRemoved.connect(self._on_layers_removed)
+        self._attached = True
+        self._on_layers_added(list(project.mapLayers().values()))
+
+    def detach(self):
+        if not self._attached:
+            return
+        project = QgsProject.instance()
+        for signal, slot in ((project.layersAdded, self._on_layers_added),
+                             (project.layersRemoved, self._on_layers_removed)):
+            try:
+                signal.disconnect(slot)
+            except Exception:
+                pass
+        for layer, slot in self._watched.values():
+            for name in self.LAYER_SIGNALS:
+                try:
+                    getattr(layer, name).disconnect(slot)
+                except Exception:
+                    pass
+        self._watched.clear()
+        self._entries.clear()
+        self._generations.clear()
+        self._attached = False
+
+    def get(self, layer, max_rows, builder):
+        layer_id = layer.id()
+        if layer_id not in self._watched:
+            return builder(layer, max_rows)
+        info = self.peek(layer_id, max_rows)
+        if info is None:
+            info = builder(layer, max_rows)
+            self._entries.setdefault(layer_id, {})[max_rows] = info
+            info = dict(info)
+        return info
+
+    def peek(self, layer_id, max_rows):
+        variants = self._entries.get(layer_id, {})
+        info = variants.get(max_rows)
+        if info is not None:
+            return dict(info)
+        # The sample scan does not depend on max_rows: an entry with more head rows serves fewer
+        larger = [rows for rows in variants if rows > max_rows]
+        if not larger:
+            return None
+        info = dict(variants[min(larger)])
+        if "feature_samples" in info:
+            info["feature_samples"] = info["feature_samples"][:max_rows]
+        return info
+
+    def generation(self, layer_id):
+        return self._generations.get(layer_id, 0)
+
+    def put(self, layer_id, max_rows, info, generation):
+        # Entries built off the main thread are dropped if the layer changed meanwhile
+        if layer_id not in self._watched or self.generation(layer_id) != generation:
+            return
+        self._entries.setdefault(layer_id, {})[max_rows] = info
+
+    def invalidate(self, layer_id):
+        self.discard(layer_id)
+        self.invalidated.emit(layer_id)
+
+    def discard(self, layer_id):
+        self._entries.pop(layer_id, None)
+        self._generations[layer_id] = self._generations.get(layer_id, 0) + 1
+
+    def _on_layers_added(self, layers):
+        for layer in layers:
+            if not layer:
+                continue
+            layer_id = layer.id()
+            self.invalidate(layer_id)
+            if layer_id in self._watched:
+                continue
+            slot = partial(self.invalidate, layer_id)
+            for name in self.LAYER_SIGNALS:
+                signal = getattr(layer, name, None)
+                if signal is None:
+                    continue
+                try:
+                    signal.connect(slot)
+                except Exception:
+                    pass
+            self._watched[layer_id] = (layer, slot)
+
+    def _on_layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            self._watched.pop(layer_id, None)
+            self.invalidate(layer_id)
+            self._generations.pop(layer_id, None)
+
+
+class _ExactCountTask(QgsTask):
+    def __init__(self, layer_id, source, name, provider, on_done):
+        super().__init__(f"QueryGIS: counting features of {name}", QgsTask.CanCancel)
+        self.layer_id = layer_id
+        self.source = source
+        self.name = name
+        self.provider = provider
+        self.count = -1
+        self._on_done = on_done
+
+    def run(self):
+        # Independent provider connection; the project layer is never touched off the main thread
+        source = self.source
+        if self.provider == "postgres":
+            uri = QgsDataSourceUri(source)
+            uri.setUseEstimatedMetadata(False)
+            source = uri.uri(False)
+        try:
+            layer = QgsVectorLayer(source, self.name, self.provider)
+            if not layer.isValid():
+                return False
+            self.count = int(layer.featureCount())
+        except Exception:
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        self._on_done(self.layer_id, self.count if result else -1)
+
+
+class ContextCollectionTask(QgsTask):
+    contextReady = pyqtSignal(object)
+
+    def __init__(self, owner, project_meta, snapshots):
+        super().__init__("QueryGIS: collecting layer context", QgsTask.CanCancel)
+        self._owner = owner
+        self._project_meta = project_meta
+        self._snapshots = snapshots
+        self._layers = []
+        self.on_cancelled = None
+
+    def run(self):
+        for entry in self._snapshots:
+            if self.isCanceled():
+                return False
+            if entry.get("cached") is not None:
+                self._layers.append(entry["cached"])
+                continue
+            identity = dict(entry["info"])
+            try:
+                self._layers.append(self._owner._fill_layer_snapshot(entry))
+            except Exception as e:
+                # The layer exists: describe it by name, type and CRS and don't cache the entry
+                identity["error"] = f"Could not read layer details: {e}"
+                self._layers.append(identity)
+                entry["failed"] = True
+        return True
+
+    def finished(self, result):
+        self._owner._on_context_task_done(self, self._snapshots, result)
+        if result:
+            self.contextReady.emit({"project": self._project_meta, "layers": self._layers})
+
+
+class AlgorithmIndexTask(QgsTask):
+    def __init__(self, on_done):
+        super().__init__("QueryGIS: indexing processing algorithms", QgsTask.CanCancel)
+        self.index = None
+        self._on_done = on_done
+
+    def run(self):
+        registry = QgsApplication.processingRegistry()
+        if registry is None:
+            return False
+        self.index = AlgorithmIndex.from_registry(registry, AlgorithmIndex.load_catalogue(), self.isCanceled)
+        return self.index is not None and not self.isCanceled()
+
+    def finished(self, result):
+        self._on_done(self, self.index if result else None)
+
+
+class LayerStatistics(QObject):
+    """Feature counts and extents that avoid full scans on remote or unindexed providers."""
+
+    exactCountReady = pyqtSignal(str, int)
+
+    REMOTE_PROVIDERS = ("wfs", "oapif", "arcgisfeatureserver")
+    REMOTE_OGR_PREFIXES = ("/vsicurl", "/vsis3", "/vsiaz", "/vsigs", "http:", "https:", "wfs:", "pg:", "mssql:", "oci:")
+
+    def __init__(self):
+        super().__init__()
+        self._exact_counts = {}
+        self._estimates = {}  # layer id -> (source, count, extent) from the estimated-metadata connection
+        self._tasks = {}
+
+    def forget(self, layer_id):
+        self._exact_counts.pop(layer_id, None)
+        self._estimates.pop(layer_id, None)
+
+    def exact_count(self, lyr):
+        return self._exact_counts.get(lyr.id())
+
+    def is_counting(self, layer_id):
+        return layer_id in self._tasks
+
+    def feature_count(self, lyr, layer_id=None):
+        """Return ``(count, estimated)``; ``count`` is None when no cheap value exists.
+
+        ``layer_id`` names the project layer when ``lyr`` is an independent copy of it.
+        """
+        exact = self._exact_counts.get(layer_id or lyr.id())
+        if exact is not None and exact >= 0:
+            return exact, False
+        provider = (lyr.providerType() or "").lower()
+        if provider == "postgres":
+            count = self._postgres_estimate(lyr, layer_id)[0]
+            return (count if count is not None and count >= 0 else None), True
+        if provider in self.REMOTE_PROVIDERS:
+            return None, True
+        if provider == "delimitedtext":
+            return self._delimitedtext_estimate(lyr), True
+        if provider == "ogr" and lyr.source().lower().startswith(self.REMOTE_OGR_PREFIXES):
+            count = self._ogr_fast_count(lyr)
+            return (count, False) if count is not None else (None, True)
+        count = lyr.featureCount()
+        return (count if count >= 0 else None), False
+
+    def extent(self, lyr, layer_id=None):
+        """Return ``(QgsRectangle or None, estimated)``."""
+        provider = (lyr.providerType() or "").lower()
+        if provider == "postgres":
+            return self._postgres_estimate(lyr, layer_id)[1], True
+        if provider in self.REMOTE_PROVIDERS:
+            # Advertised by the service capabilities, no feature download
+            return lyr.extent(), True
+        return lyr.extent(), False
+
+    def request_exact_count(self, lyr):
+        layer_id = lyr.id()
+        if layer_id in self._tasks:
+            return
+        task = _ExactCountTask(layer_id, lyr.source(), lyr.name(), lyr.providerType(), self._on_count_done)
+        self._tasks[layer_id] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def cancel_all(self):
+        for task in list(self._tasks.values()):
+            try:
+                task.cancel()
+            except Exception:
+                pass
+        self._tasks.clear()
+
+    def _on_count_done(self, layer_id, count):
+        if self._tasks.pop(layer_id, None) is None:
+            return
+        # A failed count stays unset so the next request retries it
+        if count >= 0:
+            self._exact_counts[layer_id] = count
+        self.exactCountReady.emit(layer_id, count)
+
+    def _postgres_estimate(self, lyr, layer_id=None):
+        """``(count or None, extent or None)`` for a postgres layer, one estimated connection per source."""
+        layer_id = layer_id or lyr.id()
+        source = lyr.source()
+        cached = self._estimates.get(layer_id)
+        if cached is not None and cached[0] == source:
+            return cached[1:]
+        estimate_layer = self._estimated_postgres_layer(lyr)
+        if estimate_layer is None:
+            # Not cached: the connection may be back on the next context build
+            return None, None
+        try:
+            count = estimate_layer.featureCount()
+            extent = estimate_layer.extent()
+        except Exception:
+            return None, None
+        self._estimates[layer_id] = (source, count, extent)
+        return count, extent
+
+    def _estimated_postgres_layer(self, lyr):
+        uri = QgsDataSourceUri(lyr.source())
+        if uri.useEstimatedMetadata():
+            return lyr
+        # Same table with estimatedmetadata=true: pg_class/EXPLAIN row estimate and ST_EstimatedExtent
+        uri.setUseEstimatedMetadata(True)
+        try:
+            estimate_layer = QgsVectorLayer(uri.uri(False), lyr.name(), "postgres")
+        except Exception:
+            return None
+        return estimate_layer if estimate_layer.isValid() else None
+
+    def _delimitedtext_estimate(self, lyr, probe_bytes=65536):
+        try:
+            path = unquote(urlparse(lyr.source()).path)
+            if os.name == "nt" and re.match(r"^/[A-Za-z]:", path):
+                path = path[1:]
+            size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                head = f.read(probe_bytes)
+        except Exception:
+            return None
+        lines = head.count(b"\n")
+        if not lines:
+            return 0 if not head.strip() else 1
+        if len(head) >= size:
+            return max(lines - 1, 0)
+        return max(int(size / (len(head) / lines)) - 1, 0)
+
+    def _ogr_fast_count(self, lyr):
+        if ogr is None:
+            return None
+        try:
+            source = lyr.source()
+            parts = source.split("|")
+            ds = ogr.Open(parts[0], 0)
+            if ds is None:
+                return None
+            layer = None
+            for option in parts[1:]:
+                if option.startswith("layername="):
+                    layer = ds.GetLayerByName(option.split("=", 1)[1])
+                elif option.startswith("layerid="):
+                    layer = ds.GetLayer(int(option.split("=", 1)[1]))
+            if layer is None:
+                layer = ds.GetLayer(0)
+            if layer is None or not layer.TestCapability(ogr.OLCFastFeatureCount):
+                return None
+            count = layer.GetFeatureCount(0)
+            return count if count >= 0 else None
+        except Exception:
+            return None
+
+
+class ContextBudgeter:
+    """Fits a context dict into a token and/or byte budget, degrading the least relevant layers first.
+
+    Layers rank as selected > named in the query > the rest. Each step lowers one layer's
+    fidelity: samples, then metadata (and long source URIs), then field details, then
+    everything but its identity, then the layer itself. Selected layers are never removed.
+    """
+    LEVELS = ("full", "no_samples", "no_metadata", "few_fields", "identity_only", "dropped")
+    # (tier, level) in the order they are applied; tier 0 = selected, 1 = named in query, 2 = rest
+    SCHEDULE = ((2, 1), (2, 2), (2, 3), (1, 1), (1, 2), (2, 4), (1, 3), (0, 1),
+                (0, 2), (2, 5), (1, 4), (0, 3), (1, 5), (0, 4))
+    IDENTITY_KEYS = ("name", "type", "geometry", "crs", "provider", "feature_count", "feature_count_estimated")
+    SECRET_RE = re.compile(r"\b(password|passwd|pwd|user|username|token|apikey|api_key|authcfg)=('[^']*'|[^\s&']+)",
+                           re.IGNORECASE)
+
+    def __init__(self, max_tokens=None, max_bytes=None):
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def estimate_tokens(n_chars):
+        # ~4 characters per token for JSON text
+        return (n_chars + 3) // 4
+
+    def fits(self, n_chars, n_bytes):
+        if self.max_tokens and self.estimate_tokens(n_chars) > self.max_tokens:
+            return False
+        if self.max_bytes and n_bytes > self.max_bytes:
+            return False
+        return True
+
+    def short_source(self, source):
+        source = self.SECRET_RE.sub(lambda m: m.group(1) + "=***", str(source))
+        if len(source) > CONTEXT_SOURCE_MAX_CHARS:
+            source = source[:CONTEXT_SOURCE_MAX_CHARS] + "..."
+        return source
+
+    def degrade(self, info, level):
+        li = dict(info)
+        if level >= 1:
+            li.pop("feature_samples", None)
+            if isinstance(li.get("field_stats"), dict):
+                li["field_stats"] = {
+                    k: {kk: vv for kk, vv in v.items() if kk != "samples"}
+                    for k, v in li["field_stats"].items() if isinstance(v, dict)
+                }
+        if level >= 2:
+            li.pop("metadata", None)
+            li.pop("extent_corners", None)
+            if li.get("source"):
+                li["source"] = self.short_source(li["source"])
+        if level >= 3:
+            li.pop("field_stats", None)
+            li.pop("sampled_features", None)
+            fields = li.get("fields")
+            if isinstance(fields, list) and len(fields) > 10:
+                li["fields"] = fields[:10] + ["..."]
+        if level >= 4:
+            li = {k: li[k] for k in self.IDENTITY_KEYS if k in li}
+        return li
+
+    @staticmethod
+    def _measure(obj):
+        text = json.dumps(obj, ensure_ascii=False, default=str)
+        return len(text), len(text.encode("utf-8"))
+
+    def fit(self, ctx, selected_names=(), query=""):
+        """Returns (context, report); report lists the level each degraded layer ended at."""
+        layers = list(ctx.get("layers") or [])
+        base = dict(ctx, layers=[])
+        base_chars, base_bytes = self._measure(base)
+        sizes = [self._measure(li) for li in layers]
+        levels = [0] * len(layers)
+        report = {"layers": {}, "dropped_layers": []}
+
+        def total():
+            kept = [sz for sz, lv in zip(sizes, levels) if lv < 5]
+            sep = 2 * max(0, len(kept) - 1)
+            return (base_chars + sep + sum(c for c, _ in kept),
+                    base_bytes + sep + sum(b for _, b in kept))
+
+        before = total()
+        report["before"] = {"tokens": self.estimate_tokens(before[0]), "bytes": before[1]}
+        if not self.fits(*before):
+            selected = set(selected_names or ())
+            query_l = (query or "").lower()
+
+            def tier(li):
+                name = str(li.get("name") or "")
+                if name in selected:
+                    return 0
+                if name and name.lower() in query_l:
+                    return 1
+                return 2
+            tiers = [tier(li) for li in layers]
+            done = False
+            for step_tier, level in self.SCHEDULE:
+                # Within a tier, later (less prominent) layers go first
+                for i in reversed(range(len(layers))):
+                    if tiers[i] != step_tier or levels[i] >= level:
+                        continue
+                    levels[i] = level
+                    if level < 5:
+                        sizes[i] = self._measure(self.degrade(layers[i], level))
+                    if self.fits(*total()):
+                        done = True
+                        break
+                if done:
+                    break
+
+        out = []
+        for li, lv in zip(layers, levels):
+            name = str(li.get("name") or "")
+            if lv >= 5:
+                report["dropped_layers"].append(name)
+                continue
+            if lv:
+                report["layers"][name] = self.LEVELS[lv]
+            out.append(self.degrade(li, lv) if lv else li)
+        after = total()
+        report["after"] = {"tokens": self.estimate_tokens(after[0]), "bytes": after[1]}
+        return dict(ctx, layers=out), report
+
+
+class ContextDeltaEncoder:
+    """Per-session content hashes of layer entries; unchanged entries go out as references.
+
+    An entry is sent in full until the backend acknowledges a request that carried it
+    (``context_ack: <version>`` in the response); the backend keeps the entries of the
+    latest acknowledged version, so later requests send ``{"ref": <hash>}`` for them.
+    ``context_resync`` from the backend drops every acknowledgement.
+    """
+
+    def __init__(self):
+        self.session = uuid.uuid4().hex
+        self.version = 0
+        self._acked = set()
+        self._sent = {}
+
+    @staticmethod
+    def entry_hash(entry):
+        blob = json.dumps(entry, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+    def encode(self, context_text):
+        """Returns (context_text, version_info); version_info is None when the text has no layer list."""
+        ctx = json.loads(context_text)
+        if not isinstance(ctx, dict) or not isinstance(ctx.get("layers"), list):
+            return context_text, None
+        self.version += 1
+        hashes, layers, refs = [], [], 0
+        for entry in ctx["layers"]:
+            h = self.entry_hash(entry)
+            hashes.append(h)
+            if h in self._acked:
+                layers.append({"ref": h})
+                refs += 1
+            else:
+                layers.append(entry)
+        self._sent[self.version] = set(hashes)
+        info = {"session": self.session, "version": self.version, "layer_hashes": hashes, "refs": refs}
+        if not refs:
+            return context_text, info
+        ctx["layers"] = layers
+        return json.dumps(ctx, ensure_ascii=False, default=str), info
+
+    def ack(self, version):
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            return
+        hashes = self._sent.get(version)
+        if hashes is None:
+            return
+        self._acked = hashes
+        for v in [v for v in self._sent if v <= version]:
+            del self._sent[v]
+
+    def resync(self):
+        self._acked = set()
+        self._sent.clear()
+
+
+class ResponseCache:
+    """SQLite LRU + TTL cache of final /chat responses in the profile directory.
+
+    Keyed by the normalised query, the model and a structural fingerprint of the
+    project (layer names, types, geometry, CRS and fields; never feature values).
+    Entries whose code was never run are stored unverified and are only served to
+    lookups that will not run the code either.
+    """
+
+    NOCACHE_RE = re.compile(r"(?i)[ \t]*#nocache\b")
+
+    def __init__(self, path, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_sec=RESPONSE_CACHE_TTL_HOURS * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=2)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, "
+            "verified INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+        if "verified" not in columns:
+            # Caches written before the flag existed: nothing in them is known to have run
+            self._db.execute("ALTER TABLE responses ADD COLUMN verified INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.commit()
+
+    @classmethod
+    def opted_out(cls, user_input):
+        return bool(cls.NOCACHE_RE.search(user_input or ""))
+
+    @classmethod
+    def strip_directives(cls, user_input):
+        return cls.NOCACHE_RE.sub("", user_input or "").strip()
+
+    @staticmethod
+    def normalize_query(user_input):
+        text = unicodedata.normalize("NFKC", user_input or "").lower()
+        text = re.sub(r"\s+", " ", text).strip()
+        return text.rstrip(" .!?。")
+
+    @staticmethod
+    def make_key(user_input, fingerprint, model):
+        blob = json.dumps([ResponseCache.normalize_query(user_input), model, fingerprint],
+                          ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key, verified_only=False):
+        now = time.time()
+        row = self._db.execute("SELECT response, created, verified FROM responses WHERE key = ?",
+                               (key,)).fetchone()
+        if row is not None and now - row[1] > self.ttl_sec:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            row = None
+        if row is not None and verified_only and not row[2]:
+            row = None
+        if row is None:
+            self._bump("misses")
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self._bump("hits")
+        self._db.commit()
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            self.discard(key)
+            return None
+
+    def put(self, key, response, verified=True):
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created, last_used, hits, verified) "
+            "VALUES (?, ?, ?, ?, 0, ?)",
+            (key, json.dumps(response, ensure_ascii=False, default=str), now, now, int(bool(verified)))
+        )
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_sec,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key NOT IN "
+            "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)", (self.max_entries,)
+        )
+        self._db.commit()
+
+    def discard(self, key):
+        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._bump("evicted_failures")
+        self._db.commit()
+
+    def _bump(self, name):
+        self._db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def stats(self):
+        out = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+        out["entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return out
+
+    def close(self):
+        try:
+            self._db.close()
+        except Exception:
+            pass
+
+
+class TfidfIndex:
+    """In-memory TF-IDF cosine index over short texts.
+
+    Tokens are lower-cased words, with longer non-ASCII words replaced by their character
+    bigrams so Korean particles ("필지를" / "필지에") still share most of their weight.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._df = collections.Counter()
+        self._postings = collections.defaultdict(set)
+        self._norms = None
+
+    @staticmethod
+    def tokens(text):
+        # Numbers split from units ("50m" -> "50", "m")
+        words = re.findall(r"\d+(?:\.\d+)?|[^\W\d_]+", (text or "").lower())
+        out = []
+        for w in words:
+            if len(w) > 2 and not w.isascii():
+                out.extend("~" + w[i:i + 2] for i in range(len(w) - 1))
+            else:
+                out.append(w)
+        return out
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, text):
+        self.remove(doc_id)
+        tf = collections.Counter(self.tokens(text))
+        if not tf:
+            return
+        self._docs[doc_id] = tf
+        for tok in tf:
+            self._df[tok] += 1
+            self._postings[tok].add(doc_id)
+        self._norms = None
+
+    def remove(self, doc_id):
+        tf = self._docs.pop(doc_id, None)
+        if tf is None:
+            return
+        for tok in tf:
+            self._df[tok] -= 1
+            self._postings[tok].discard(doc_id)
+            if self._df[tok] <= 0:
+                del self._df[tok]
+                del self._postings[tok]
+        self._norms = None
+
+    def _idf(self, tok):
+        return math.log((len(self._docs) + 1) / (self._df.get(tok, 0) + 1)) + 1.0
+
+    def _doc_norms(self):
+        if self._norms is None:
+            self._norms = {
+                d: math.sqrt(sum((c * self._idf(t)) ** 2 for t, c in tf.items()))
+                for d, tf in self._docs.items()
+            }
+        return self._norms
+
+    def search(self, text, limit=5):
+        """[(doc_id, cosine)] best first."""
+        q = collections.Counter(self.tokens(text))
+        if not q or not self._docs:
+            return []
+        norms = self._doc_norms()
+        weights = {t: c * self._idf(t) for t, c in q.items()}
+        q_norm = math.sqrt(sum(w * w for w in weights.values()))
+        scores = collections.defaultdict(float)
+        for t, w in weights.items():
+            idf = self._idf(t)
+            for d in self._postings.get(t, ()):
+                scores[d] += w * self._docs[d][t] * idf
+        ranked = sorted(((score / (q_norm * norms[d]), d) for d, score in scores.items() if norms[d]),
+                        reverse=True)
+        return [(d, score) for score, d in ranked[:limit]]
+
+
+class VerifiedCodeLibrary:
+    """Code that ran successfully, per query, in SQLite, with a TF-IDF index over the queries.
+
+    Each entry keeps the signatures of the project layers the code names and of the
+    layers that were selected, so a match can be checked against the current project.
+    """
+
+    NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+    def __init__(self, path, max_entries=VERIFIED_CODE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=2)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS verified (id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT NOT NULL, "
+            "code TEXT NOT NULL, code_hash TEXT NOT NULL, layers TEXT NOT NULL, selected TEXT NOT NULL, "
+            "elapsed REAL, created REAL NOT NULL, last_used REAL NOT NULL, uses INTEGER NOT NULL DEFAULT 1, "
+            "UNIQUE (query, code_hash))"
+        )
+        self._db.commit()
+        self.index = TfidfIndex()
+        for entry_id, query in self._db.execute("SELECT id, query FROM verified"):
+            self.index.add(entry_id, ResponseCache.normalize_query(query))
+
+    def record(self, query, code, elapsed, layers, selected):
+        """``layers``: {name: signature} of project layers named in the code; ``selected``: signatures."""
+        code_hash = hashlib.sha1(code.encode("utf-8")).hexdigest()
+        now = time.time()
+        row = self._db.execute("SELECT id FROM verified WHERE query = ? AND code_hash = ?",
+                               (query, code_hash)).fetchone()
+        if row is not None:
+            entry_id = row[0]
+            self._db.execute("UPDATE verified SET last_used = ?, uses = uses + 1, elapsed = ? WHERE id = ?",
+                             (now, elapsed, entry_id))
+        else:
+            cur = self._db.execute(
+                "INSERT INTO verified (query, code, code_hash, layers, selected, elapsed, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (query, code, code_hash, json.dumps(layers, ensure_ascii=False),
+                 json.dumps(selected, ensure_ascii=False), elapsed, now, now)
+            )
+            entry_id = cur.lastrowid
+            self.index.add(entry_id, ResponseCache.normalize_query(query))
+        stale = [r[0] for r in self._db.execute(
+            "SELECT id FROM verified ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_entries,))]
+        for old_id in stale:
+            self._db.execute("DELETE FROM verified WHERE id = ?", (old_id,))
+            self.index.remove(old_id)
+        self._db.commit()
+        return entry_id
+
+    def discard(self, entry_id):
+        self._db.execute("DELETE FROM verified WHERE id = ?", (entry_id,))
+        self._db.commit()
+        self.index.remove(entry_id)
+
+    def best_match(self, query, is_compatible, threshold=VERIFIED_CODE_THRESHOLD):
+        """Best entry scoring >= threshold whose numbers equal the query's and that is_compatible accepts."""
+        norm = ResponseCache.normalize_query(query)
+        numbers = sorted(self.NUMBER_RE.findall(norm))
+        for entry_id, score in self.index.search(norm):
+            if score < threshold:
+                break
+            row = self._db.execute(
+                "SELECT id, query, code, layers, selected, elapsed, uses FROM verified WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is None:
+                continue
+            entry = {"id": row[0], "query": row[1], "code": row[2], "layers": json.loads(row[3]),
+                     "selected": json.loads(row[4]), "elapsed": row[5] or 0.0, "uses": row[6], "score": score}
+            # "buffer by 50m" must not reuse the code written for 100m
+            if sorted(self.NUMBER_RE.findall(ResponseCache.normalize_query(entry["query"]))) != numbers:
+                continue
+            if is_compatible(entry):
+                return entry
+        return None
+
+    def close(self):
+        try:
+            self._db.close()
+        except Exception:
+            pass
+
+
+PreparedCode = collections.namedtuple("PreparedCode", "source code algorithms wrapped facts runs")
+# Span is (lineno, col_offset, end_lineno, end_col_offset) of a string literal, offsets in UTF-8 bytes
+RunCall = collections.namedtuple("RunCall", "alg alg_span params")
+CodeFacts = collections.namedtuple(
+    "CodeFacts", "free_names layer_lookups first_loader_line star_modules catches_name_error literals"
+)
+
+RUNTIME_IMPORTS = (
+    ("qgis.core", "*"), ("qgis.gui", "*"), ("qgis.analysis", "*"), ("processing", None),
+    ("qgis.utils", "iface"), ("tempfile", None), ("os", None), ("random", None),
+)
+
+
+class CodeRewriter(ast.NodeTransformer):
+    """One parse of generated code: feedback= on processing calls (aliases included), the
+    missing runtime imports, a wrapper for top-level ``return`` and the algorithms called.
+
+    The tree is compiled directly, so line numbers in tracebacks match the source as given.
+    """
+
+    # Positional index of ``feedback`` in processing.run / processing.runAndLoadResults
+    RUN_FUNCS = {"run": 3, "runAndLoadResults": 2}
+
+    def __init__(self):
+        self.algorithms = []
+        self.runs = []
+        self._module_aliases = {"processing"}
+        self._func_aliases = {}
+
+    @classmethod
+    def prepare(cls, source, filename="<string>"):
+        tree = ast.parse(source, filename)
+        rewriter = cls()
+        rewriter._collect_aliases(tree)
+        tree = rewriter.visit(tree)
+        wrapped = rewriter._wrap_top_level_return(tree)
+        if not wrapped:
+            tree.body = rewriter._schedule_runs(tree.body)
+        rewriter._add_runtime_imports(tree)
+        ast.fix_missing_locations(tree)
+        facts = _FactCollector.collect(tree)
+        return PreparedCode(source, compile(tree, filename, "exec"), tuple(rewriter.algorithms), wrapped, facts,
+                            tuple(rewriter.runs))
+
+    def _collect_aliases(self, tree):
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name in ("processing", "qgis.processing") and alias.asname:
+                        self._module_aliases.add(alias.asname)
+            elif isinstance(node, ast.ImportFrom):
+                if node.module == "qgis":
+                    for alias in node.names:
+                        if alias.name == "processing":
+                            self._module_aliases.add(alias.asname or alias.name)
+                elif node.module in ("processing", "qgis.processing"):
+                    for alias in node.names:
+                        if alias.name in self.RUN_FUNCS:
+                            self._func_aliases[alias.asname or alias.name] = alias.name
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        name = None
+        if (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                and func.value.id in self._module_aliases and func.attr in self.RUN_FUNCS):
+            name = func.attr
+        elif isinstance(func, ast.Name) and func.id in self._func_aliases:
+            name = self._func_aliases[func.id]
+        if name is None:
+            return node
+
+        alg = node.args[0] if node.args else next((kw.value for kw in node.keywords if kw.arg == "algOrName"), None)
+        params = node.args[1] if len(node.args) > 1 else next((kw.value for kw in node.keywords if kw.arg == "parameters"), None)
+        keys = ()
+        if isinstance(params, ast.Dict):
+            keys = tuple((k.value, self._span(k)) for k in params.keys if self._is_str(k))
+        if self._is_str(alg):
+            self.algorithms.append(alg.value)
+            self.runs.append(RunCall(alg.value, self._span(alg), keys))
+        else:
+            self.runs.append(RunCall(None, None, keys))
+        # keyword arg None is **kwargs, which may already carry feedback
+        has_feedback = (len(node.args) > self.RUN_FUNCS[name]
+                        or any(kw.arg in ("feedback", None) for kw in node.keywords))
+        if not has_feedback:
+            node.keywords.append(ast.keyword(arg="feedback", value=ast.Name(id="processing_feedback", ctx=ast.Load())))
+        return node
+
+    # Strings that name a file
+    PATH_RE = re.compile(r"[/\\]|\.[A-Za-z0-9]{2,5}$")
+    # Names every step reads without sharing any data through them
+    STEP_GLOBALS = frozenset({"processing_feedback"})
+    # Destinations that give each step a new layer of its own
+    ANONYMOUS_OUTPUTS = frozenset({"memory:", "TEMPORARY_OUTPUT"})
+
+    def _run_step(self, stmt):
+        """``(target, call)`` if ``stmt`` is ``[name =] processing.run("alg", ...)``, else None."""
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+            target, value = stmt.targets[0].id, stmt.value
+        elif isinstance(stmt, ast.Expr):
+            target, value = None, stmt.value
+        else:
+            return None
+        if not (isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute)
+                and isinstance(value.func.value, ast.Name) and value.func.value.id in self._module_aliases
+                and value.func.attr == "run" and value.args and self._is_str(value.args[0])):
+            return None
+        return target, value
+
+    def _step_reads(self, call):
+        """Names and string values a step's arguments use, leaving out the algorithm id,
+        parameter keys and names that carry no data between steps."""
+        skip = {id(call.args[0])}
+        skip.update(id(key) for node in ast.walk(call) if isinstance(node, ast.Dict) for key in node.keys)
+        names, values = set(), set()
+        for node in ast.walk(call):
+            if isinstance(node, ast.Name):
+                if node.id not in self._module_aliases and node.id not in self.STEP_GLOBALS:
+                    names.add(node.id)
+            elif self._is_str(node) and id(node) not in skip and node.value not in self.ANONYMOUS_OUTPUTS:
+                values.add(node.value)
+        return names, values
+
+    def _step_dependencies(self, steps):
+        # Steps are independent only when provably disjoint: any shared variable, layer name,
+        # path or destination string orders them as written
+        info = [(target,) + self._step_reads(call) for target, call in steps]
+        deps = []
+        for j, (target_j, names_j, values_j) in enumerate(info):
+            deps.append([
+                i for i, (target_i, names_i, values_i) in enumerate(info[:j])
+                if (target_i and (target_i in names_j or target_i == target_j))
+                or (target_j and target_j in names_i)
+                or names_i & names_j
+                or values_i & values_j
+            ])
+        return deps
+
+    def _schedule_runs(self, body):
+        """Replace runs of consecutive top-level processing.run statements that are not a plain
+        chain with one run_processing_steps call over their dependency graph."""
+        out, block = [], []
+
+        def flush():
+            steps = [self._run_step(stmt) for stmt in block]
+            deps = self._step_dependencies(steps) if len(block) > 1 else []
+            if len(block) < 2 or all(j - 1 in d for j, d in enumerate(deps) if j):
+                out.extend(block)
+            else:
+                out.append(self._steps_call(block[0], steps, deps))
+            block.clear()
+
+        for stmt in body:
+            if self._run_step(stmt) is not None:
+                block.append(stmt)
+                continue
+            flush()
+            out.append(stmt)
+        flush()
+        return out
+
+    @staticmethod
+    def _steps_call(first, steps, deps):
+        thunks = []
+        for target, call in steps:
+            kw = ast.Dict(keys=[ast.Constant(k.arg) if k.arg else None for k in call.keywords],
+                          values=[k.value for k in call.keywords])
+            body = ast.Tuple(elts=[call.func, ast.Tuple(elts=list(call.args), ctx=ast.Load()), kw], ctx=ast.Load())
+            lam = ast.Lambda(args=ast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[],
+                                                kw_defaults=[], kwarg=None, defaults=[]), body=body)
+            thunks.append(ast.Tuple(elts=[ast.Constant(target), lam], ctx=ast.Load()))
+        dep_lists = ast.List(elts=[ast.List(elts=[ast.Constant(i) for i in d], ctx=ast.Load()) for d in deps],
+                             ctx=ast.Load())
+        node = ast.Expr(ast.Call(
+            func=ast.Name(id="__run_steps__", ctx=ast.Load()),
+            args=[ast.Call(func=ast.Name(id="globals", ctx=ast.Load()), args=[], keywords=[]),
+                  ast.List(elts=thunks, ctx=ast.Load()), dep_lists],
+            keywords=[]))
+        return ast.copy_location(node, first)
+
+    @staticmethod
+    def _is_str(node):
+        return isinstance(node, ast.Constant) and isinstance(node.value, str)
+
+    @staticmethod
+    def _span(node):
+        return (node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)
+
+    @staticmethod
+    def _has_top_level_return(nodes):
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ast.Return):
+                return True
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+                continue
+            stack.extend(ast.iter_child_nodes(node))
+        return False
+
+    def _wrap_top_level_return(self, tree):
+        if not self._has_top_level_return(tree.body):
+            return False
+        header = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+        body = [n for n in tree.body if not isinstance(n, (ast.Import, ast.ImportFrom))]
+        main = ast.parse("def __auto_main__():\n    pass\n").body[0]
+        main.body = body or main.body
+        tail = ast.parse("__auto_ret__ = __auto_main__()\nif __auto_ret__ is not None:\n    print(__auto_ret__)\n").body
+        tree.body = header + [main] + tail
+        return True
+
+    def _add_runtime_imports(self, tree):
+        present = set()
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                present.update((a.name, None) for a in node.names if a.asname is None)
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                present.update((node.module, a.name) for a in node.names if a.asname is None)
+        missing = []
+        for module, name in RUNTIME_IMPORTS:
+            if (module, name) in present:
+                continue
+            if name is None:
+                missing.append(ast.Import(names=[ast.alias(name=module, asname=None)]))
+            else:
+                missing.append(ast.ImportFrom(module=module, names=[ast.alias(name=name, asname=None)], level=0))
+        tree.body[:0] = missing
+
+
+class _FactCollector(ast.NodeVisitor):
+    """Names, layer lookups and layer-loading calls of the rewritten tree, for the pre-flight check."""
+
+    LAYER_LOOKUPS = ("get_layer_safe", "find_layer_by_keyword")
+    LAYER_LOADERS = ("addMapLayer", "addMapLayers", "runAndLoadResults", "addVectorLayer", "addRasterLayer")
+
+    def __init__(self):
+        self.bound = set()
+        self.loaded = {}
+        self.layer_lookups = []
+        self.first_loader_line = None
+        self.star_modules = []
+        self.catches_name_error = False
+        self.literals = set()
+        self._lookup_args = set()
+
+    @classmethod
+    def collect(cls, tree):
+        collector = cls()
+        collector.visit(tree)
+        # Flat over all scopes: a name bound anywhere is not reported
+        free = tuple((name, line) for name, line in collector.loaded.items() if name not in collector.bound)
+        return CodeFacts(free, tuple(collector.layer_lookups), collector.first_loader_line,
+                         tuple(collector.star_modules), collector.catches_name_error,
+                         frozenset(collector.literals))
+
+    def visit_Constant(self, node):
+        # Every other string literal: a layer name found here may be created by the script itself
+        if isinstance(node.value, str) and id(node) not in self._lookup_args:
+            self.literals.add(node.value)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.loaded.setdefault(node.id, getattr(node, "lineno", 0))
+        else:
+            self.bound.add(node.id)
+
+    def visit_arg(self, node):
+        self.bound.add(node.arg)
+        self.generic_visit(node)
+
+    def _visit_def(self, node):
+        self.bound.add(node.name)
+        self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_def
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.bound.add(alias.asname or alias.name.split(".")[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name == "*":
+                self.star_modules.append(node.module)
+            else:
+                self.bound.add(alias.asname or alias.name)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.bound.add(node.name)
+        if node.type is not None and "NameError" in ast.dump(node.type):
+            self.catches_name_error = True
+        self.generic_visit(node)
+
+    def visit_Global(self, node):
+        self.bound.update(node.names)
+
+    visit_Nonlocal = visit_Global
+
+    def visit_MatchAs(self, node):
+        if node.name:
+            self.bound.add(node.name)
+        self.generic_visit(node)
+
+    visit_MatchStar = visit_MatchAs
+
+    def visit_MatchMapping(self, node):
+        if node.rest:
+            self.bound.add(node.rest)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+        if name in self.LAYER_LOOKUPS and node.args:
+            arg = node.args[0]
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                self.layer_lookups.append((name, arg.value, node.lineno))
+                self._lookup_args.add(id(arg))
+        elif name in self.LAYER_LOADERS:
+            if self.first_loader_line is None or node.lineno < self.first_loader_line:
+                self.first_loader_line = node.lineno
+        self.generic_visit(node)
+
+
+def _match_layer_name(name, layer_names):
+    """The layer name get_layer_safe would resolve ``name`` to, or None."""
+    base = os.path.splitext(name)[0]
+    for candidate in (name, base):
+        if candidate in layer_names:
+            return candidate
+    lowered = name.lower()
+    for layer_name in layer_names:
+        if lowered in layer_name.lower():
+            return layer_name
+    keywords = [kw.lower() for kw in name.replace('_', ' ').split()]
+    for layer_name in layer_names:
+        if any(kw in layer_name.lower() for kw in keywords):
+            return layer_name
+    return None
+
+
+def _could_be_path(text):
+    """True for strings that may name a file, URI or provider source rather than a layer."""
+    return ":" in text or bool(CodeRewriter.PATH_RE.search(text))
+
+
+def preflight_issues(prepared, algorithm_exists=None, layer_names=None, known_names=None, suggest=None):
+    """``(issues, warnings)`` for ``prepared`` before it runs; an argument left as None skips that check.
+
+    ``issues`` are failures certain before running. A layer lookup is only one when its
+    literal cannot be a path and the script cannot have created the layer: the name appears
+    in no other string literal and no call adding layers to the project comes first.
+    Other unmatched lookups are ``warnings``.
+    """
+    issues, warnings = [], []
+    facts = prepared.facts
+    if algorithm_exists is not None:
+        for alg_id in dict.fromkeys(prepared.algorithms):
+            if not algorithm_exists(alg_id):
+                close = suggest(alg_id) if suggest is not None else []
+                hint = f" (did you mean {', '.join(close)}?)" if close else ""
+                issues.append(f"Unknown processing algorithm '{alg_id}'{hint}")
+    if layer_names is not None:
+        for func, name, line in facts.layer_lookups:
+            if _match_layer_name(name, layer_names) is not None:
+                continue
+            message = f"Line {line}: {func}('{name}') matches no layer in the project"
+            created = ((facts.first_loader_line is not None and facts.first_loader_line < line)
+                       or any(name in literal for literal in facts.literals))
+            if created or _could_be_path(name):
+                warnings.append(message)
+            else:
+                issues.append(message)
+    if known_names is not None and not facts.catches_name_error:
+        for name, line in facts.free_names:
+            if name not in known_names:
+                issues.append(f"Line {line}: name '{name}' is not defined")
+    return issues, warnings
+
+
+AlgorithmEntry = collections.namedtuple("AlgorithmEntry", "id name name_ko params")
+
+
+class AlgorithmIndex:
+    """Processing algorithms by id and display name (QGIS locale and the Korean catalogue),
+    with their parameter names and types, for resolving ids and keys the model got slightly wrong.
+
+    Exact and case-insensitive lookups are dict hits; difflib only runs on a miss.
+    """
+
+    ID_CUTOFF = 0.8
+    PARAM_CUTOFF = 0.75
+
+    def __init__(self, entries):
+        self.entries = {e.id: e for e in entries}
+        self._by_lower = {alg_id.lower(): alg_id for alg_id in self.entries}
+        self._by_name = {}
+        self._by_provider = collections.defaultdict(list)
+        for e in self.entries.values():
+            for name in (e.name, e.name_ko):
+                if name:
+                    self._by_name.setdefault(name.strip().lower(), e.id)
+            self._by_provider[e.id.split(":", 1)[0]].append(e.id.lower())
+        self._all_lower = list(self._by_lower)
+
+    @staticmethod
+    def load_catalogue(path=ALGORITHM_CATALOGUE):
+        names = {}
+        try:
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    if not line.startswith("ID:") or "| Name:" not in line:
+                        continue
+                    alg_id, name = line[3:].split("| Name:", 1)
+                    names[alg_id.strip()] = name.strip()
+        except OSError:
+            pass
+        return names
+
+    @classmethod
+    def from_registry(cls, registry, catalogue, is_canceled=lambda: False):
+        entries = []
+        for alg in registry.algorithms():
+            if is_canceled():
+                return None
+            try:
+                params = tuple((p.name(), p.type()) for p in alg.parameterDefinitions())
+                entries.append(AlgorithmEntry(alg.id(), alg.displayName(), catalogue.get(alg.id(), ""), params))
+            except Exception:
+                continue
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, alg_id):
+        return alg_id in self.entries
+
+    def _candidates(self, alg_id):
+        provider = alg_id.split(":", 1)[0].lower() if ":" in alg_id else None
+        return self._by_provider.get(provider) if provider in self._by_provider else self._all_lower
+
+    def suggest(self, alg_id, limit=3):
+        lowered = alg_id.strip().lower()
+        # Above the cutoff the lengths are close anyway; skipping the rest keeps a miss cheap
+        slack = max(3, len(lowered) // 4)
+        candidates = [a for a in self._candidates(lowered) if abs(len(a) - len(lowered)) <= slack]
+        matches = difflib.get_close_matches(lowered, candidates, n=limit, cutoff=self.ID_CUTOFF)
+        if not matches and ":" in lowered:
+            # Right algorithm under another provider (qgis: vs native:)
+            tail = lowered.split(":", 1)[1]
+            matches = [a for a in self._all_lower if a.split(":", 1)[1] == tail][:limit]
+        return [self._by_lower[m] for m in matches]
+
+    def resolve(self, alg_id):
+        """The registered id ``alg_id`` most likely means, or None when unsure."""
+        if alg_id in self.entries:
+            return alg_id
+        lowered = alg_id.strip().lower()
+        if lowered in self._by_lower:
+            return self._by_lower[lowered]
+        if lowered in self._by_name:
+            return self._by_name[lowered]
+        matches = self.suggest(alg_id, limit=2)
+        if len(matches) == 1:
+            return matches[0]
+        if len(matches) == 2:
+            scores = [difflib.SequenceMatcher(None, lowered, m.lower()).ratio() for m in matches]
+            if scores[0] - scores[1] >= 0.05:
+                return matches[0]
+        return None
+
+    def correct_param(self, alg_id, key):
+        """The parameter of ``alg_id`` that ``key`` most likely means, or None when unsure."""
+        entry = self.entries.get(alg_id)
+        if entry is None or not entry.params:
+            return None
+        names = [name for name, _ in entry.params]
+        if key in names:
+            return key
+        by_upper = {name.upper(): name for name in names}
+        if key.upper() in by_upper:
+            return by_upper[key.upper()]
+        matches = difflib.get_close_matches(key.upper(), list(by_upper), n=1, cutoff=self.PARAM_CUTOFF)
+        return by_upper[matches[0]] if matches else None
+
+
+def _replace_literals(source, replacements):
+    """Replace single-line string literals given as (span, new_value), keeping their quotes."""
+    lines = source.splitlines(keepends=True)
+    # Last first, so earlier byte offsets on a line stay valid
+    for (lineno, col, end_lineno, end_col), value in sorted(replacements, key=lambda r: r[0], reverse=True):
+        if lineno != end_lineno:
+            continue
+        raw = lines[lineno - 1].encode("utf-8")
+        literal = raw[col:end_col].decode("utf-8")
+        quote = literal[:1]
+        if quote in ("'", '"') and literal.endswith(quote) and quote not in value and "\\" not in value:
+            new_literal = quote + value + quote
+        else:
+            new_literal = repr(value)
+        lines[lineno - 1] = (raw[:col] + new_literal.encode("utf-8") + raw[end_col:]).decode("utf-8")
+    return "".join(lines)
+
+
+def correct_processing_calls(prepared, index, algorithm_exists=None):
+    """Fix algorithm ids and parameter keys of literal processing.run calls against ``index``.
+
+    Ids ``algorithm_exists`` accepts (e.g. legacy aliases) are kept as written.
+    Returns ``(source, notes)``; the source is unchanged when there is nothing to correct.
+    """
+    replacements, notes = [], []
+    for run in prepared.runs:
+        if run.alg is None:
+            continue
+        alg_id = run.alg if run.alg in index else index.resolve(run.alg)
+        if alg_id is None:
+            continue
+        if alg_id != run.alg and not (algorithm_exists is not None and algorithm_exists(run.alg)):
+            replacements.append((run.alg_span, alg_id))
+            notes.append(f"{run.alg} -> {alg_id}")
+        for key, span in run.params:
+            fixed = index.correct_param(alg_id, key)
+            if fixed is not None and fixed != key:
+                replacements.append((span, fixed))
+                notes.append(f"{alg_id}: {key} -> {fixed}")
+    if not replacements:
+        return prepared.source, []
+    return _replace_literals(prepared.source, replacements), notes
+
+
+class CompiledCodeCache:
+    """Bounded LRU of source hash -> PreparedCode.
+
+    Snippets come back verbatim from the chat "Run" button and from fix retries;
+    each distinct source is parsed, rewritten and compiled once.
+    """
+
+    def __init__(self, max_entries=COMPILED_CODE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def prepare(self, source, transform=CodeRewriter.prepare):
+        """``transform(source)``, memoised; exceptions (e.g. SyntaxError) propagate and are not cached."""
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        prepared = self._entries.get(key)
+        if prepared is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prepared
+        self.misses += 1
+        prepared = transform(source)
+        self._entries[key] = prepared
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return prepared
+
+    def clear(self):
+        self._entries.clear()
+
+
+class QueryGIS(QObject):
+    FIX_URL = "https://querygis.com/fix-code"
+    MAX_FIX_RETRIES = 2
+
+    def __init__(self, iface_obj):
+        super().__init__()
+        self.iface = iface_obj
+        self.plugin_dir = os.path.dirname(__file__)
+        self.menu = self.tr(u'&QueryGIS')
+        self.actions = []
+        self.dockwidget = None
+        self.chat_history = []
+
+        self.default_status_color = "#F0F0F0"
+        self.success_status_color = "#66FF66"
+        self.error_status_color = "#FF3333"
         self.warning_status_color = "#FFA500" # Orange for retries
 
         self.ui = None
         self.worker = None
         self.wave_manager = None
-        self.logging_workers = []
         self._last_status_update_ms = 0
         self._last_context_text = ""
         self._last_generated_code = ""
@@ -607,6 +3156,37 @@ class QueryGIS(QObject):
         self._last_cache_used = None
         self._execution_advance_triggered = False
         self._pending_attempt_start = False
+        self._layer_context_cache = LayerContextCache()
+        self._layer_stats = LayerStatistics()
+        self._layer_context_cache.invalidated.connect(self._layer_stats.forget)
+        self._layer_stats.exactCountReady.connect(self._on_exact_count_ready)
+        self._awaiting_exact_counts = set()
+        self._pending_tool_request = None
+        self._context_task = None
+        self._fix_worker = None
+        self._retired_fix_workers = []
+        self._correction = {}
+        self._active_run = None
+        self._stream_bubble = None
+        self._stream_text = ""
+        self._stream_fences = 0
+        self._stream_flush_pending = False
+        self._context_delta = ContextDeltaEncoder()
+        self._last_attempt_args = None
+        self._last_context_refs = 0
+        self._response_cache = None
+        self._request_cache_key = None
+        self._cache_hit_key = None
+        self._cacheable_response = None
+        self._cacheable_verified = False
+        self._verified_library = None
+        self._library_hit_id = None
+        # code -> the query that produced it, for scripts run again from the chat "Run" button
+        self._code_queries = collections.OrderedDict()
+        self._compiled_code = CompiledCodeCache()
+        self._algorithm_index = None
+        self._algorithm_index_task = None
+        self._scope_template = None
 
         # UI Bridge for thread-safe/re-entrancy-safe updates
         self.ui_bridge = UiSafeBridge()
@@ -614,19 +3194,7 @@ class QueryGIS(QObject):
     def _send_log_async(self, row_data):
         if not ENABLE_REMOTE_LOG:
             return
-        worker = LoggingWorker(REPORT_ENDPOINT, row_data, REPORT_TIMEOUT_SEC)
-        
-        worker.finished.connect(lambda w=worker: self._on_logging_worker_finished(w))
-        
-        self.logging_workers.append(worker)
-        worker.start()
-
-    def _on_logging_worker_finished(self, worker_instance):
-        try:
-            if worker_instance in self.logging_workers:
-                self.logging_workers.remove(worker_instance)
-        except Exception:
-            pass
+        _telemetry_dispatcher().enqueue(row_data)
 
     def _extract_error_summary(self, stdout_output, qgis_errors, qgis_log, original_error=""):
         for line in (stdout_output or "").split('\n'):
@@ -654,8 +3222,15 @@ class QueryGIS(QObject):
         return "An error occurred during code execution"
 
     def execute_with_self_correction(self, code, scope, user_input, context, retry_count=0):
-        MAX_RETRIES = 2
-        FIX_URL = "https://querygis.com/fix-code"
+        """Run ``code`` once on the main thread; on failure request a fix in the background.
+
+        Returns True/False once the run is settled, or None while a fix request is in flight.
+        The in-flight run is settled from the fix worker's signals. A run cancelled by unload
+        or closing the dock also returns None and is never settled.
+        """
+        state = self._correction
+        state["code"] = code
+        state["retry_count"] = retry_count
 
         log_capture = QgsMessageLogCapture()
         log_capture.start()
@@ -671,36 +3246,51 @@ class QueryGIS(QObject):
         except:
             pass 
 
+        run_buffer = io.StringIO()
+        original_stdout = sys.stdout
+        failure = None
+        settings = QSettings()
+        background = settings.value("QueryGIS/background_processing", True, type=bool)
+        max_parallel = settings.value("QueryGIS/max_parallel_steps", max(1, QThread.idealThreadCount() - 1), type=int)
+        self._active_run = _RunProgressProxy(self.ui_bridge, scope=scope, background=background,
+                                             max_parallel=max_parallel, checkpoints=state.get("checkpoints"),
+                                             stdout=original_stdout)
+        active_run = _ACTIVE_RUN.set(self._active_run)
         try:
-            if retry_count > 0 and isinstance(sys.stdout, io.StringIO):
-                sys.stdout.truncate(0)
-                sys.stdout.seek(0)
-
-            start_log_pos = 0
-            if isinstance(sys.stdout, io.StringIO):
-                start_log_pos = sys.stdout.tell()
-
-            exec(code, scope)
-            
-            current_output = ""
-            if isinstance(sys.stdout, io.StringIO):
-                sys.stdout.seek(start_log_pos)
-                current_output = sys.stdout.read()
-                sys.stdout.seek(0, io.SEEK_END)
+            sys.stdout = run_buffer
+            state["preflight_warnings"] = []
+            prepared = self._compiled_code.prepare(code)
+            index = self._get_algorithm_index()
+            if index is not None and QSettings().value("QueryGIS/autocorrect_algorithms", True, type=bool):
+                registry = QgsApplication.processingRegistry()
+                corrected, notes = correct_processing_calls(
+                    prepared, index, lambda alg_id: registry.algorithmById(alg_id) is not None)
+                if notes:
+                    print("Corrected before running: " + "; ".join(notes))
+                    code = corrected
+                    state["code"] = code
+                    prepared = self._compiled_code.prepare(code)
+            state["algorithms"] = list(prepared.algorithms)
+            if QSettings().value("QueryGIS/preflight", True, type=bool):
+                issues, warnings = self._preflight_issues(prepared, scope)
+                if issues:
+                    # Straight to the fix path; nothing has run yet
+                    raise _PreflightError("Pre-flight check failed:\n" + "\n".join(issues))
+                for warning in warnings:
+                    logger.warning(f"Pre-flight: {warning}")
+                state["preflight_warnings"] = warnings
+            exec(prepared.code, scope)
+            current_output = run_buffer.getvalue()
 
             output_lines = [l.strip() for l in current_output.split('\n') if l.strip()]
             last_meaningful_line = output_lines[-1] if output_lines else ""
             
             success_keywords = ["✓", "Done!", "Success", "Complete", "finished", "successfully"]
-            if any(s in last_meaningful_line for s in success_keywords):
-                self._last_soft_error_info = None
-                return 
-            
             fail_keywords = ["❌", "Fail", "Error:", "Exception", "Not found", "Error", "Traceback"]
             has_failure_sign = any(f in last_meaningful_line for f in fail_keywords)
             has_traceback = "Traceback (most recent" in current_output
 
-            if has_failure_sign or has_traceback:
+            if not any(s in last_meaningful_line for s in success_keywords) and (has_failure_sign or has_traceback):
                 if newly_added_layers:
                     QgsProject.instance().removeMapLayers(newly_added_layers)
                     newly_added_layers.clear()
@@ -711,164 +3301,325 @@ class QueryGIS(QObject):
                     "qgis_log": log_capture.get_messages()
                 }
                 
-                print(f"[SOFT ERROR DETECTED] Retry {retry_count + 1}/{MAX_RETRIES}")
+                print(f"[SOFT ERROR DETECTED] Retry {retry_count + 1}/{self.MAX_FIX_RETRIES}", file=original_stdout)
                 raise _SoftErrorSignal("Error detected in output")
             
             self._last_soft_error_info = None
+        except (_SoftErrorSignal, Exception) as e:
+            failure = e
+        finally:
+            _ACTIVE_RUN.reset(active_run)
+            cancelled = self._active_run.cancelled
+            self._active_run = None
+            sys.stdout = original_stdout
+            log_capture.stop()
+            try:
+                QgsProject.instance().layersAdded.disconnect(on_layers_added)
+            except:
+                pass
+
+        stdout_output = run_buffer.getvalue()
+        state["output"] = stdout_output.strip()
+        if cancelled:
+            self._abandon_execution(newly_added_layers)
+            return None
+        if failure is None:
+            return self._settle_execution(True)
+
+        if newly_added_layers:
+            QgsProject.instance().removeMapLayers(newly_added_layers)
+
+        qgis_log = log_capture.get_messages()
+        qgis_errors = log_capture.get_errors_only()
+
+        if retry_count >= self.MAX_FIX_RETRIES:
+            if self._last_soft_error_info:
+                stdout_output = self._last_soft_error_info.get("stdout", stdout_output)
+                qgis_errors = self._last_soft_error_info.get("qgis_errors", qgis_errors)
+            
+            error_summary = self._extract_error_summary(stdout_output, qgis_errors, qgis_log, str(failure))
+            
+            if self._request_attempt == 1:
+                if self._advance_attempt(error_summary):
+                    self._execution_advance_triggered = True
+                    return self._settle_execution(False, "Moving to Attempt 2 after fix failure")
+            return self._settle_execution(False, error_summary)
+
+        # Limit stdout and qgis log size for the prompt
+        limited_stdout = (stdout_output or "")[-500:] if stdout_output and len(stdout_output) > 500 else (stdout_output or "")
+        limited_qgis = (qgis_errors or "")[-500:] if qgis_errors and len(qgis_errors) > 500 else (qgis_errors or "")
+
+        full_error_for_ai = f"""=== ERROR DETECTED ===
+Error Type: {type(failure).__name__}
+Message: {str(failure)}
+
+=== EXECUTION OUTPUT (Last 500 chars) ===
+{limited_stdout}
+
+=== QGIS LOG (Last 500 chars) ===
+{limited_qgis}
+"""
+        if state.get("preflight_warnings"):
+            full_error_for_ai += "\n=== PRE-FLIGHT WARNINGS ===\n" + "\n".join(state["preflight_warnings"]) + "\n"
+        # Report the failure that triggered self-correction
+        try:
+            _send_error_report(
+                user_query=user_input,
+                context_text="",
+                generated_code=code,
+                error_message=full_error_for_ai,
+                model_name="gemini-3-flash-preview",
+                phase="execution_failure",
+                metadata={
+                    "plugin_version": "QueryGIS-Plugin/1.5",
+                    "run_id": self._current_run_id,
+                    "attempt": self._request_attempt or None,
+                    "fix_round": retry_count + 1,
+                    "is_retry_trigger": True,
+                    "preflight": isinstance(failure, _PreflightError)
+                },
+                query_gis_instance=self
+            )
+        except Exception:
+            pass
+
+        broken_lines = code.splitlines()
+        if len(broken_lines) > 500:
+            broken_code_for_fix = "\n".join(broken_lines[:500])
+        else:
+            broken_code_for_fix = code
+        self.update_wave_message(f"Auto-correcting logic... ({retry_count + 1}/{self.MAX_FIX_RETRIES})")
+
+        thinking_strategy = "LOW" if retry_count == 0 else "HIGH"
+        
+        api_key = self.load_api_key()
+        payload = {
+            "api_key": api_key,
+            "context": context,
+            "user_input": user_input,
+            "broken_code": broken_code_for_fix,
+            "error_message": full_error_for_ai,
+            "model": "gemini-3-flash-preview",
+            "thinking_level": thinking_strategy
+        }
+        state["async"] = True
+        # Fresh context for the fix comes from the same task/cache path as the query's;
+        # the query's context is kept if collection is cancelled
+        run_id = self._current_run_id
+        try:
+            self._collect_context_async(
+                self._context_targets("active", max_rows=3),
+                lambda ctx, run_id=run_id, payload=payload: self._on_fix_context_ready(run_id, payload, ctx),
+                on_cancelled=lambda run_id=run_id, payload=payload: self._on_fix_context_ready(run_id, payload, None)
+            )
+        except Exception:
+            self._on_fix_context_ready(run_id, payload, None)
+        return None
+
+    def _on_fix_context_ready(self, run_id, payload, context_dict):
+        if run_id != self._current_run_id:
+            return
+        if context_dict is not None:
+            try:
+                payload["context"] = self._build_context_text(context_dict)
+            except Exception:
+                pass
+        self._start_fix_worker(payload, timeout_sec=150,
+                               on_result=self._on_fix_code_ready,
+                               on_error=self._on_fix_code_failed)
+
+    def _start_fix_worker(self, payload, timeout_sec, on_result, on_error):
+        self._cancel_fix_worker()
+        worker = BackendWorker(payload, backend_url=self.FIX_URL, timeout_sec=timeout_sec, phase="fix_code")
+        worker.step_update.connect(self.update_wave_message)
+        worker.finished.connect(lambda data, w=worker: self._dispatch_fix_result(w, data, on_result, on_error))
+        worker.error.connect(lambda msg, w=worker: self._dispatch_fix_result(w, None, on_result, on_error, msg))
+        self._fix_worker = worker
+        worker.start()
+
+    def _cancel_fix_worker(self):
+        worker = self._fix_worker
+        if worker is None:
             return
+        worker.cancel()
+        for signal in (worker.finished, worker.error, worker.step_update):
+            try:
+                signal.disconnect()
+            except Exception:
+                pass
+        self._retire_fix_worker(worker)
 
-        except (_SoftErrorSignal, Exception) as e:
-            if newly_added_layers:
-                QgsProject.instance().removeMapLayers(newly_added_layers)
+    def _retire_fix_worker(self, worker):
+        # The thread may still be unwinding; keep it referenced until it has stopped
+        if worker is self._fix_worker:
+            self._fix_worker = None
+        self._retired_fix_workers = [w for w in self._retired_fix_workers if w.isRunning()]
+        self._retired_fix_workers.append(worker)
+
+    def _dispatch_fix_result(self, worker, data, on_result, on_error, error_message=""):
+        if worker is not self._fix_worker:
+            return
+        self._retire_fix_worker(worker)
+        fixed_code, token_count = None, None
+        if data is not None:
+            try:
+                if "output" in data and "text" in data["output"]:
+                    fixed_code = data["output"]["text"]
+                    token_count = data.get("token_count")
+            except Exception:
+                fixed_code = None
+        if fixed_code is None:
+            on_error(error_message or "Fix server request failed")
+            return
+        on_result(fixed_code, token_count)
+
+    def _on_fix_code_ready(self, fixed_code, token_count):
+        state = self._correction
+        retry_count = state.get("retry_count", 0)
+        try:
+            _send_error_report(
+                user_query=state.get("user_input", ""),
+                context_text="",
+                generated_code=fixed_code,
+                error_message="[FIX_CODE] Code fixed.",
+                model_name="gemini-3-flash-preview",
+                phase="fix_code",
+                metadata={
+                    "plugin_version": "QueryGIS-Plugin/1.5",
+                    "run_id": self._current_run_id,
+                    "attempt": self._request_attempt or None,
+                    "fix_round": retry_count + 1,
+                    "token_count": token_count
+                },
+                query_gis_instance=self
+            )
+        except Exception:
+            pass
+        self.execute_with_self_correction(
+            fixed_code, state["scope"], state.get("user_input", ""), state.get("context", ""), retry_count + 1
+        )
+
+    def _on_fix_code_failed(self, reason):
+        if self._request_attempt == 1:
+            if self._advance_attempt(f"Fix request failed: {reason}"):
+                self._execution_advance_triggered = True
+                self._settle_execution(False, "Fix failed; moving to Attempt 2")
+                return
+        self._settle_execution(False, f"Recovery failed: {reason}")
+
+    def _release_checkpoints(self):
+        checkpoints = self._correction.get("checkpoints")
+        if checkpoints is not None:
+            self._correction["checkpoints"] = None
+            self._correction["checkpoint_hits"] = checkpoints.hits
+            checkpoints.close()
+
+    def _abandon_execution(self, newly_added_layers):
+        # The plugin is unloading or its dock was closed: nothing to report, fix or retry
+        self._release_checkpoints()
+        if newly_added_layers:
+            QgsProject.instance().removeMapLayers(newly_added_layers)
+        self._correction = {}
+        self._cacheable_response = None
+        self._cache_hit_key = None
+        self._library_hit_id = None
+        self._current_run_id = None
+        try:
+            self.stop_wave_progress("Cancelled")
+        except Exception:
+            pass  # The dock may already be gone
+
+    def _settle_execution(self, success, error_message=""):
+        state = self._correction
+        self._release_checkpoints()
+        code_string = state.get("code", "")
+        last_user_input = state.get("user_input", "")
+        elapsed = time.time() - state.get("start_time", time.time())
+        output = state.get("output", "")
+
+        if success:
+            if self.ui:
+                self.ui.status_label.setText("Success!")
+                self.ui.status_label.setStyleSheet(
+                    f"background-color: {self.success_status_color}; color: black;"
+                )
+            
+            _send_error_report(
+                user_query=last_user_input,
+                context_text="",
+                generated_code=code_string,
+                error_message=("SUCCESS" + (f"\nPRINT:\n{output}" if output else "")),
+                model_name="gemini-3-flash-preview",
+                phase="execution_result",
+                metadata={
+                    "plugin_version": "QueryGIS-Plugin/1.5",
+                    "run_id": self._current_run_id,
+                    "elapsed_sec": elapsed,
+                    "attempt": self._request_attempt or None,
+                    "mode": self._last_response_mode or None,
+                    "token_count": self._last_token_count,
+                    "algorithms": state.get("algorithms"),
+                    "checkpoint_hits": state.get("checkpoint_hits")
+                },
+                query_gis_instance=self
+            )
+            
+            if output:
+                self.append_chat_message("assistant-print", f"Output:\n{output}")
             
-            if retry_count >= MAX_RETRIES:
-                qgis_log = log_capture.get_messages()
-                qgis_errors = log_capture.get_errors_only()
+            self.stop_wave_progress("Task Complete")
+            self._add_execution_result_to_chat(True, elapsed)
+            self._remember_verified_code(state.get("verified_query"), code_string, elapsed)
+        else:
+            self._last_execution_error_message = f"Exception: {error_message}"
+
+            # If we just triggered a major attempt advance, don't show error UI yet
+            if self._execution_advance_triggered:
+                if self.ui:
+                    self.ui.status_label.setText("Scaling context & Retrying...")
+                    self.ui.status_label.setStyleSheet(f"background-color: {self.warning_status_color}; color: black;")
+            else:
+                if self.ui:
+                    self.ui.status_label.setText("Execution failed")
+                    self.ui.status_label.setStyleSheet(
+                        f"background-color: {self.error_status_color}; color: white;"
+                    )
                 
-                stdout_output = ""
-                if isinstance(sys.stdout, io.StringIO):
-                    sys.stdout.seek(0)
-                    stdout_output = sys.stdout.read()
-
-                if self._last_soft_error_info:
-                    stdout_output = self._last_soft_error_info.get("stdout", stdout_output)
-                    qgis_errors = self._last_soft_error_info.get("qgis_errors", qgis_errors)
+                error_display = f"Error:\n{self._last_execution_error_message}"
+                if output:
+                    error_display += f"\n\nPartial output:\n{output}"
                 
-                error_summary = self._extract_error_summary(stdout_output, qgis_errors, qgis_log, str(e))
+                self.append_chat_message("assistant-print", error_display)
                 
-                current_attempt = self._request_attempt
-                if current_attempt == 1:
-                    if self._advance_attempt(error_summary):
-                        self._execution_advance_triggered = True
-                        raise Exception("Moving to Attempt 2 after fix failure") from None
-                raise Exception(error_summary) from None
-
-            qgis_log = log_capture.get_messages()
-            qgis_errors = log_capture.get_errors_only()
-            stdout_output = ""
-            if isinstance(sys.stdout, io.StringIO):
-                sys.stdout.seek(0)
-                stdout_output = sys.stdout.read()
-
-            # Limit stdout and qgis log size for the prompt
-            limited_stdout = (stdout_output or "")[-500:] if stdout_output and len(stdout_output) > 500 else (stdout_output or "")
-            limited_qgis = (qgis_errors or "")[-500:] if qgis_errors and len(qgis_errors) > 500 else (qgis_errors or "")
-
-            full_error_for_ai = f"""=== ERROR DETECTED ===
-Error Type: {type(e).__name__}
-Message: {str(e)}
-
-=== EXECUTION OUTPUT (Last 500 chars) ===
-{limited_stdout}
-
-=== QGIS LOG (Last 500 chars) ===
-{limited_qgis}
-"""
-            error_for_fix = full_error_for_ai
-
-            # Report the failure that triggered self-correction
-            try:
                 _send_error_report(
-                    user_query=user_input,
+                    user_query=last_user_input,
                     context_text="",
-                    generated_code=code,
-                    error_message=full_error_for_ai,
+                    generated_code=code_string,
+                    error_message=self._last_execution_error_message,
                     model_name="gemini-3-flash-preview",
-                    phase="execution_failure",
+                    phase="execution_result",
                     metadata={
                         "plugin_version": "QueryGIS-Plugin/1.5",
                         "run_id": self._current_run_id,
+                        "elapsed_sec": elapsed,
+                        "final_error": True,
+                        "partial_output": output[:500] if output else None,
                         "attempt": self._request_attempt or None,
-                        "fix_round": retry_count + 1,
-                        "is_retry_trigger": True
+                        "mode": self._last_response_mode or None,
+                        "token_count": self._last_token_count,
+                        "algorithms": state.get("algorithms"),
+                        "checkpoint_hits": state.get("checkpoint_hits")
                     },
                     query_gis_instance=self
                 )
-            except Exception:
-                pass
-
-            broken_lines = code.splitlines()
-            if len(broken_lines) > 500:
-                broken_code_for_fix = "\n".join(broken_lines[:500])
-            else:
-                broken_code_for_fix = code
-            try:
-                fix_ctx = self._collect_qgis_context_active(max_rows=3)
-                context_for_fix = self._build_context_text(fix_ctx)
-            except Exception:
-                context_for_fix = context
-            self.update_wave_message(f"Auto-correcting logic... ({retry_count + 1}/{MAX_RETRIES})")
-
-            thinking_strategy = "LOW" if retry_count == 0 else "HIGH"
-            
-            api_key = self.load_api_key()
-            payload = {
-                "api_key": api_key,
-                "context": context_for_fix,
-                "user_input": user_input,
-                "broken_code": broken_code_for_fix,
-                "error_message": error_for_fix,
-                "model": "gemini-3-flash-preview",
-                "thinking_level": thinking_strategy
-            }
-
-            try:
-                response = requests.post(FIX_URL, json=payload, timeout=150)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if "output" in data and "text" in data["output"]:
-                        fixed_code = data["output"]["text"]
-                        token_count = None
-                        try:
-                            token_count = data.get("token_count")
-                        except Exception:
-                            token_count = None
-                        
-                        if "from qgis.core import" not in fixed_code:
-                            fixed_code = self._prepend_runtime_imports(fixed_code)
-
-                        try:
-                            _send_error_report(
-                                user_query=user_input,
-                                context_text="",
-                                generated_code=fixed_code,
-                                error_message="[FIX_CODE] Code fixed.",
-                                model_name="gemini-3-flash-preview",
-                                phase="fix_code",
-                                metadata={
-                                    "plugin_version": "QueryGIS-Plugin/1.5",
-                                    "run_id": self._current_run_id,
-                                    "attempt": self._request_attempt or None,
-                                    "fix_round": retry_count + 1,
-                                    "token_count": token_count
-                                },
-                                query_gis_instance=self
-                            )
-                        except Exception:
-                            pass
-                        
-                        return self.execute_with_self_correction(
-                            fixed_code, scope, user_input, context, retry_count + 1
-                        )
-                
-                raise Exception("Fix server request failed")
                 
-            except Exception as req_err:
-                current_attempt = self._request_attempt
-                if current_attempt == 1:
-                    if self._advance_attempt(f"Fix request failed: {str(req_err)}"):
-                        self._execution_advance_triggered = True
-                        raise Exception("Fix failed; moving to Attempt 2") from None
-                
-                raise Exception(f"Recovery failed: {str(req_err)}") from None
+                self.stop_wave_progress("Analysis failed")
+                self._add_execution_result_to_chat(False, elapsed)
 
-        finally:
-            log_capture.stop()
-            try:
-                QgsProject.instance().layersAdded.disconnect(on_layers_added)
-            except:
-                pass
+        on_settled = state.get("on_settled")
+        if state.get("async") and on_settled:
+            on_settled(success)
+        return success
 
     def start_wave_progress(self, message="Processing"):
         if not self.ui:
@@ -977,12 +3728,60 @@ Message: {str(e)}
             callback=self.run,
             parent=self.iface.mainWindow()
         )
+        self._layer_context_cache.attach()
+        if ENABLE_REMOTE_LOG:
+            # Created here so the dispatcher belongs to the main thread, not to the first worker that logs
+            _telemetry_dispatcher()
+        registry = QgsApplication.processingRegistry()
+        if registry is not None:
+            registry.providerAdded.connect(self._invalidate_algorithm_index)
+            registry.providerRemoved.connect(self._invalidate_algorithm_index)
+        # After startup, so the processing providers are loaded and QGIS is responsive
+        QTimer.singleShot(ALGORITHM_INDEX_DELAY_MS, self._get_algorithm_index)
+
+    def _cancel_active_run(self):
+        if self._active_run is not None:
+            self._active_run.cancel()
 
     def unload(self):
+        self._cancel_active_run()
         if self.worker and self.worker.isRunning():
             self.worker.cancel()
             self.worker.quit()
             self.worker.wait(5000)
+
+        self._cancel_fix_worker()
+        for fix_worker in self._retired_fix_workers:
+            if fix_worker.isRunning():
+                fix_worker.wait(5000)
+        self._retired_fix_workers = []
+        _shutdown_telemetry()
+        HTTP_POOL.close_all()
+        PROCESSING_RUN_HOOK.uninstall()
+        self._release_checkpoints()
+        if self._response_cache is not None:
+            self._response_cache.close()
+            self._response_cache = None
+        if self._verified_library is not None:
+            self._verified_library.close()
+            self._verified_library = None
+
+        if self._context_task is not None:
+            self._context_task.cancel()
+            self._context_task = None
+        registry = QgsApplication.processingRegistry()
+        if registry is not None:
+            for signal in (registry.providerAdded, registry.providerRemoved):
+                try:
+                    signal.disconnect(self._invalidate_algorithm_index)
+                except Exception:
+                    pass
+        if self._algorithm_index_task is not None:
+            self._algorithm_index_task.cancel()
+            self._algorithm_index_task = None
+        self._algorithm_index = None
+        self._layer_context_cache.detach()
+        self._layer_stats.cancel_all()
         
         if self.dockwidget:
             self.iface.removeDockWidget(self.dockwidget)
@@ -1033,6 +3832,7 @@ Message: {str(e)}
         self.dockwidget.show()
 
     def _on_dockwidget_destroyed(self):
+        self._cancel_active_run()
         self.dockwidget = None
         self.ui = None
 
@@ -1049,35 +3849,6 @@ Message: {str(e)}
         elif self.ui:
             self.ui.btn_ask.setText("Ask\n(Ctrl+Enter)")
 
-    def _collect_field_samples(self, vlayer, max_samples=3, scan_limit=50):
-        fields_info = []
-        
-        field_samples = {}
-        for field in vlayer.fields():
-            field_samples[field.name()] = {
-                "name": field.name(),
-                "type": field.typeName(),
-                "samples": set()
-            }
-        
-        scan_count = 0
-        for feature in vlayer.getFeatures():
-            if scan_count >= scan_limit:
-                break
-            
-            for field_name, field_info in field_samples.items():
-                if len(field_info["samples"]) < max_samples:
-                    value = feature[field_name]
-                    if value is not None and value != '':
-                        field_info["samples"].add(str(value)[:100])
-            
-            scan_count += 1
-    
-        for field_name in field_samples:
-            field_samples[field_name]["samples"] = list(field_samples[field_name]["samples"])
-        
-        return list(field_samples.values())
-
     def add_chat_message(self, role, message):
         msg_widget = QWidget()
         layout = QHBoxLayout(msg_widget)
@@ -1257,30 +4028,99 @@ Message: {str(e)}
     def copy_to_clipboard(self, text):
         QApplication.clipboard().setText(text)
 
+    def _refuse_while_running(self):
+        # A script waiting on background algorithms keeps the event loop alive; don't start another
+        if self._active_run is None:
+            return False
+        if self.ui:
+            self.ui.status_label.setText("Analysis still running...")
+            self.ui.status_label.setStyleSheet(f"background-color: {self.warning_status_color}; color: black;")
+        return True
+
     def run_message_from_chat(self, code):
+        if self._refuse_while_running():
+            return
         self.start_wave_progress("Preparing to execute code")
-        final_code = self._prepend_runtime_imports(code)
-        self.run_code_string(final_code)
-
-    def _prepend_runtime_imports(self, raw_code: str) -> str:
-        pre = [
-            "from qgis.core import *",
-            "from qgis.gui import *",
-            "from qgis.analysis import *",
-            "import processing",
-            "from qgis.utils import iface",
-            "import tempfile, os, random",
-            ""
-        ]
-        return "\n".join(pre) + raw_code
+        # Edited or unknown code is run but never stored as verified for an unrelated query
+        self.run_code_string(code, query=self._code_queries.get(code.strip()))
+
+    def _note_code_query(self, code, query):
+        self._code_queries[code.strip()] = query
+        self._code_queries.move_to_end(code.strip())
+        while len(self._code_queries) > 50:
+            self._code_queries.popitem(last=False)
+
+    def _on_stream_token(self, worker, text):
+        if worker is not self.worker or not self.ui:
+            return
+        self._stream_text += text
+        if not self._stream_flush_pending:
+            # Coalesce bursts of tokens into one relayout
+            self._stream_flush_pending = True
+            QTimer.singleShot(50, self._flush_stream_bubble)
+
+    def _flush_stream_bubble(self):
+        self._stream_flush_pending = False
+        if not self.ui or not self._stream_text:
+            return
+        if self._stream_bubble is None:
+            msg_widget = QWidget()
+            layout = QHBoxLayout(msg_widget)
+            layout.setContentsMargins(10, 5, 10, 5)
+            label = QLabel()
+            label.setTextFormat(Qt.PlainText)
+            label.setWordWrap(True)
+            label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+            label.setStyleSheet(
+                "background-color: #D9D9D9; color: black; border: none; border-radius: 10px; padding: 8px;"
+            )
+            layout.addWidget(label, 1)
+            self.ui.chatLayout.insertWidget(self.ui.chatLayout.count() - 1, msg_widget)
+            self._stream_bubble = (msg_widget, label)
+        self._stream_bubble[1].setText(self._stream_text)
+
+        closed = self._stream_text.count("```") // 2
+        if closed > self._stream_fences:
+            self._stream_fences = closed
+            complete = self._stream_text[:self._stream_text.rfind("```") + 3]
+            blocks = self._extract_code_blocks(complete)
+            if blocks:
+                self.update_wave_message(f"Code received ({len(blocks[-1].splitlines())} lines), waiting for the rest")
+        QTimer.singleShot(0, self.scroll_to_bottom)
+
+    def _discard_stream_bubble(self):
+        # The streamed preview is replaced by the regular messages once the response is complete
+        if self._stream_bubble is not None:
+            msg_widget = self._stream_bubble[0]
+            if self.ui:
+                self.ui.chatLayout.removeWidget(msg_widget)
+            msg_widget.deleteLater()
+        self._stream_bubble = None
+        self._stream_text = ""
+        self._stream_fences = 0
+
+    def _on_context_delta_reply(self, data):
+        """Apply context_ack / context_resync; True when the request was resent with full context."""
+        if not isinstance(data, dict):
+            return False
+        if data.get("context_resync") and self._last_context_refs and self._last_attempt_args:
+            # The backend no longer has the referenced entries: send everything again
+            self._context_delta.resync()
+            self._start_backend_attempt(**self._last_attempt_args)
+            return True
+        if "context_ack" in data:
+            self._context_delta.ack(data.get("context_ack"))
+        return False
 
-    def handle_response(self, response_text: str):
+    def handle_response(self, data):
+        self._discard_stream_bubble()
+        if self._on_context_delta_reply(data):
+            return
         self._last_token_count = None
         self._last_response_mode = ""
         self._last_prompt_full = ""
         tool_request = None
         try:
-            data = json.loads(response_text)
             if isinstance(data, dict):
                 if "cache_used" in data:
                     try:
@@ -1327,7 +4167,15 @@ Message: {str(e)}
                 pass
             return
 
-        display_text, code_blocks = self._parse_backend_response(response_text)
+        if self._request_cache_key and self._cache_hit_key is None:
+            # Stored in _finish_response unless the code fails; verified once it has run
+            if isinstance(data, dict):
+                self._cacheable_response = {k: v for k, v in data.items()
+                                            if k not in ("context_ack", "context_resync", "prompt_full")}
+            else:
+                self._cacheable_response = data
+        display_text, code_blocks = self._parse_backend_response(data)
+        self._cacheable_verified = not any(b and b.strip() for b in code_blocks or ())
         should_run = self._request_should_run if self._request_attempt else (bool(self.ui.chk_ask_run.isChecked()) if self.ui else False)
 
         chosen = None
@@ -1363,17 +4211,17 @@ Message: {str(e)}
                 except Exception:
                     pass
 
+                self._note_code_query(chosen, last_user)
                 self.append_chat_message("assistant", chosen)
                 if should_run:
                     self.start_wave_progress("Executing code")
-                    final_code = self._prepend_runtime_imports(chosen)
-                    success = self.run_code_string(final_code)
-                    if (not success) and self._retry_on_execution_failure:
-                        if self._execution_advance_triggered:
-                            self._execution_advance_triggered = False
-                            return
-                        if self._advance_attempt(self._last_execution_error_message or "Execution failed"):
-                            return
+                    success = self.run_code_string(chosen, on_settled=self._on_response_execution_settled,
+                                                   query=last_user)
+                    if success is None:
+                        # Self-correction continues in the background
+                        return
+                    if self._after_response_execution(success):
+                        return
             else:
                 if (not display_text.strip()) and self._retry_on_empty_response:
                     if self._advance_attempt("Empty response from server"):
@@ -1385,6 +4233,44 @@ Message: {str(e)}
                     return
             self.append_chat_message("assistant-print", display_text.strip())
 
+        self._finish_response()
+
+    def _after_response_execution(self, success):
+        if success and not self._correction.get("retry_count"):
+            # Verified only if the answer's own code ran, not a fixed version of it
+            self._cacheable_verified = True
+        if not success:
+            self._cacheable_response = None
+            if self._cache_hit_key and self._response_cache is not None:
+                # A cached answer that no longer works is dropped; the backend's retry answer replaces it
+                self._response_cache.discard(self._cache_hit_key)
+                self._request_cache_key = self._cache_hit_key
+            self._cache_hit_key = None
+            if self._library_hit_id is not None and self._verified_library is not None:
+                self._verified_library.discard(self._library_hit_id)
+            self._library_hit_id = None
+        if (not success) and self._retry_on_execution_failure:
+            if self._execution_advance_triggered:
+                self._execution_advance_triggered = False
+                return True
+            if self._advance_attempt(self._last_execution_error_message or "Execution failed"):
+                return True
+        return False
+
+    def _on_response_execution_settled(self, success):
+        if not self._after_response_execution(success):
+            self._finish_response()
+
+    def _finish_response(self):
+        if self._cacheable_response is not None and self._request_cache_key and self._response_cache is not None:
+            try:
+                self._response_cache.put(self._request_cache_key, self._cacheable_response,
+                                         verified=self._cacheable_verified)
+            except Exception as e:
+                logger.warning(f"Response cache store failed: {e}")
+        self._cacheable_response = None
+        self._cacheable_verified = False
+        self._request_cache_key = None
         if self.ui:
             self.ui.status_label.setText("Intelligence received")
             self.ui.status_label.setStyleSheet(f"background-color: {self.success_status_color}; color: black;")
@@ -1398,6 +4284,8 @@ Message: {str(e)}
         self._request_attempt = 0
 
     def handle_error(self, error_message: str):
+        self._discard_stream_bubble()
+        self._cacheable_response = None
         if not self.ui:
             return
         msg = str(error_message).strip() or "Unknown error"
@@ -1408,6 +4296,27 @@ Message: {str(e)}
         self.ui.btn_ask.setEnabled(True)
         self._request_attempt = 0
 
+    def _context_budgeter(self):
+        settings = QSettings()
+        max_tokens = settings.value("QueryGIS/context_budget_tokens", CONTEXT_BUDGET_TOKENS, type=int)
+        max_bytes = settings.value("QueryGIS/context_budget_bytes", 0, type=int)
+        return ContextBudgeter(max_tokens=max_tokens or None, max_bytes=max_bytes or None)
+
+    def _selected_layers(self):
+        layers = []
+        try:
+            if self.iface:
+                layers = [lyr for lyr in self.iface.layerTreeView().selectedLayers() if lyr]
+                active = self.iface.activeLayer()
+                if active and active not in layers:
+                    layers.append(active)
+        except Exception:
+            pass
+        return layers
+
+    def _selected_layer_names(self):
+        return {lyr.name() for lyr in self._selected_layers()}
+
     def _build_context_text(self, ctx: dict) -> str:
         try:
             trimmed = {"project": ctx.get("project", {}), "layers": []}
@@ -1417,6 +4326,17 @@ Message: {str(e)}
                     if not isinstance(li2["fields"][0], dict) and len(li2["fields"]) > 20:
                         li2["fields"] = li2["fields"][:20] + ["..."]
                 trimmed["layers"].append(li2)
+            trimmed, report = self._context_budgeter().fit(
+                trimmed, self._selected_layer_names(), self._request_user_input
+            )
+            if report["layers"] or report["dropped_layers"]:
+                # Tell the model what it is not seeing so it can ask for it via a tool request
+                trimmed["context_trimmed"] = {
+                    "degraded": report["layers"],
+                    "dropped_layers": report["dropped_layers"]
+                }
+                print(f"[DEBUG] context budget: {report['before']} -> {report['after']}, "
+                      f"degraded={len(report['layers'])}, dropped={len(report['dropped_layers'])}")
             return json.dumps(trimmed, ensure_ascii=False, default=str)
         except Exception:
             try:
@@ -1426,6 +4346,13 @@ Message: {str(e)}
                 return ""
 
     def _build_backend_payload(self, mode, context_text="", tool_info="", error_message="", tool_request=None, tool_data=None):
+        context_version = None
+        if context_text and QSettings().value("QueryGIS/context_delta", True, type=bool):
+            try:
+                context_text, context_version = self._context_delta.encode(context_text)
+            except Exception:
+                context_version = None
+        self._last_context_refs = context_version["refs"] if context_version else 0
         payload = {
             "api_key": self._request_api_key,
             "context": context_text or "",
@@ -1442,9 +4369,13 @@ Message: {str(e)}
             payload["tool_request"] = tool_request
         if tool_data:
             payload["tool_data"] = tool_data
+        if context_version:
+            payload["context_version"] = {k: context_version[k] for k in ("session", "version", "layer_hashes")}
         return payload
 
     def _start_backend_attempt(self, mode, context_text="", tool_info="", error_message="", tool_request=None, tool_data=None):
+        self._last_attempt_args = dict(mode=mode, context_text=context_text, tool_info=tool_info,
+                                       error_message=error_message, tool_request=tool_request, tool_data=tool_data)
         payload = self._build_backend_payload(
             mode=mode,
             context_text=context_text,
@@ -1459,8 +4390,11 @@ Message: {str(e)}
             self.worker.quit()
             self.worker.wait(3000)
 
-        self.worker = BackendWorker(payload, backend_url="https://querygis.com/chat", timeout_sec=120)
+        self._discard_stream_bubble()
+        stream = QSettings().value("QueryGIS/stream_responses", True, type=bool)
+        self.worker = BackendWorker(payload, backend_url="https://querygis.com/chat", timeout_sec=120, stream=stream)
         self.worker.step_update.connect(self.update_wave_message)
+        self.worker.token.connect(lambda text, w=self.worker: self._on_stream_token(w, text))
         self.worker.finished.connect(self.handle_response)
         self.worker.error.connect(self.handle_error)
         self.worker.start()
@@ -1478,10 +4412,6 @@ Message: {str(e)}
         if self._request_attempt == 2:
             self.update_wave_message("Retrying with full context + RAG (2/2)")
             
-            context_dict = self._collect_qgis_context()
-            context_text = self._build_context_text(context_dict)
-            self._last_context_text = context_text
-            
             if not self._request_tool_info:
                 self._request_tool_info = self._collect_tool_info()
             
@@ -1506,20 +4436,29 @@ Message: {str(e)}
             except Exception:
                 pass
             
-            self._start_backend_attempt(
-                mode="rag_full",
-                context_text=context_text,
-                tool_info=self._request_tool_info,
-                error_message=self._request_error_message
+            run_id = self._current_run_id
+            self._collect_context_async(
+                self._context_targets("full"),
+                lambda ctx, run_id=run_id: self._on_full_context_ready(run_id, ctx)
             )
             return True
 
         return False
+
+    def _on_full_context_ready(self, run_id, context_dict):
+        if run_id != self._current_run_id or self._request_attempt != 2:
+            return
+        context_text = self._build_context_text(context_dict)
+        self._last_context_text = context_text
+        self._start_backend_attempt(
+            mode="rag_full",
+            context_text=context_text,
+            tool_info=self._request_tool_info,
+            error_message=self._request_error_message
+        )
     
-    def _call_syntax_fixer(self, broken_code, error_message, user_input, context):
-        """Syntax Error 전용 Fix 서버 호출"""
-        FIX_URL = "https://querygis.com/fix-code"
-        
+    def _call_syntax_fixer(self, broken_code, error_message, user_input, context, on_settled=None, query=None):
+        """Syntax Error 전용 Fix 서버 호출 (백그라운드, 결과는 run_code_string 으로 재실행)"""
         api_key = self.load_api_key()
         payload = {
             "api_key": api_key,
@@ -1530,339 +4469,184 @@ Message: {str(e)}
             "model": "gemini-3-flash-preview",
             "thinking_level": "HIGH"
         }
-        
-        try:
-            self.update_wave_message("Fixing syntax error...")
-            response = requests.post(FIX_URL, json=payload, timeout=60)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if "output" in data and "text" in data["output"]:
-                    fixed_code = data["output"]["text"]
-                    
-                    # Import 추가
-                    if "from qgis.core import" not in fixed_code:
-                        fixed_code = self._prepend_runtime_imports(fixed_code)
-                    
-                    # 로그 전송
-                    try:
-                        _send_error_report(
-                            user_query=user_input,
-                            context_text="",
-                            generated_code=fixed_code,
-                            error_message="[SYNTAX_FIX] Code fixed.",
-                            model_name="gemini-3-flash-preview",
-                            phase="syntax_fix",
-                            metadata={
-                                "plugin_version": "QueryGIS-Plugin/1.5",
-                                "run_id": self._current_run_id,
-                                "attempt": self._request_attempt or None,
-                                "token_count": data.get("token_count")
-                            },
-                            query_gis_instance=self
-                        )
-                    except Exception:
-                        pass
-                    
-                    return fixed_code
-            
-            return None
-        
-        except Exception as e:
-            print(f"[SYNTAX FIX ERROR] {e}")
-            return None
-
-    def _wrap_return_if_needed(self, code_string: str):
-        try:
-            compile(code_string, "<string>", "exec")
-            return code_string, False
-        except SyntaxError as e:
-            if "'return' outside function" not in str(e):
-                raise
-
-            lines = code_string.splitlines()
-            import_re = re.compile(r"^(from\s+[\w\.]+\s+import\b.*|import\s+.+)")
-
-            header = []
-            body = []
-
-            paren_depth = 0
-            in_import_block = False
-            for line in lines:
-                stripped = line.lstrip()
-
-                if in_import_block:
-                    header.append(line.lstrip())
-                    paren_depth += line.count("(") - line.count(")")
-                    if paren_depth <= 0:
-                        in_import_block = False
-                    continue
 
-                if import_re.match(stripped):
-                    header.append(line.lstrip())
-                    paren_depth = line.count("(") - line.count(")")
-                    in_import_block = paren_depth > 0
-                    continue
-
-                body.append(line)
-
-            if not body:
-                body = [line for line in lines if not import_re.match(line.strip())]
-                header = [line for line in lines if import_re.match(line.strip())]
-
-            indented = []
-            for line in body:
-                if line.strip():
-                    indented.append("    " + line)
-                else:
-                    indented.append("")
-
-            wrapped = (
-                "\n".join(header)
-                + ("\n" if header else "")
-                + "def __auto_main__():\n"
-                + "\n".join(indented)
-                + "\n__auto_ret__ = __auto_main__()\n"
-                + "if __auto_ret__ is not None:\n"
-                + "    print(__auto_ret__)\n"
+        def on_result(fixed_code, token_count):
+            # 로그 전송
+            try:
+                _send_error_report(
+                    user_query=user_input,
+                    context_text="",
+                    generated_code=fixed_code,
+                    error_message="[SYNTAX_FIX] Code fixed.",
+                    model_name="gemini-3-flash-preview",
+                    phase="syntax_fix",
+                    metadata={
+                        "plugin_version": "QueryGIS-Plugin/1.5",
+                        "run_id": self._current_run_id,
+                        "attempt": self._request_attempt or None,
+                        "token_count": token_count
+                    },
+                    query_gis_instance=self
+                )
+            except Exception:
+                pass
+            print(f"[SYNTAX FIX] Retrying with fixed code")
+            result = self.run_code_string(fixed_code, on_settled=on_settled, query=query)
+            if result is not None and on_settled:
+                on_settled(result)
+
+        def on_error(reason):
+            print(f"[SYNTAX FIX ERROR] {reason}")
+            self._show_syntax_failure(error_message)
+            if on_settled:
+                on_settled(False)
+
+        self.update_wave_message("Fixing syntax error...")
+        self._start_fix_worker(payload, timeout_sec=60, on_result=on_result, on_error=on_error)
+
+    def _show_syntax_failure(self, err_msg):
+        self.append_chat_message("assistant-print", err_msg)
+        if self.ui:
+            self.ui.status_label.setText("Execution failed")
+            self.ui.status_label.setStyleSheet(
+                f"background-color: {self.error_status_color}; color: white;"
             )
+        self.stop_wave_progress("Analysis failed")
 
-            compile(wrapped, "<string>", "exec")
-            return wrapped, True
+    def run_code_string(self, code_string, on_settled=None, query=None):
+        """Execute generated code on the main thread.
 
-    def run_code_string(self, code_string):
+        Returns True/False when the run settles immediately. Returns None when a
+        fix request went to the background; ``on_settled(success)`` is called later.
+        ``query`` is the request the code was generated for; only then is a successful
+        run recorded in the verified code library.
+        """
         if not self.ui:
             return False
 
         self.start_wave_progress("Preparing code execution")
-        self._last_execution_error_message = ""
-        
-        if "processing.run" in code_string:
-            code_string = self._inject_processing_feedback(code_string)
-        
-            try:
-                code_string, _ = self._wrap_return_if_needed(code_string)
-            except SyntaxError as e:
-                err_msg = f"Syntax error before execution: {e}"
-                self._last_execution_error_message = err_msg
-                
-                if self._retry_on_execution_failure:
-                    if self._request_attempt == 1:
-                        if self._advance_attempt(err_msg):
-                            self._execution_advance_triggered = True
-                            if self.ui:
-                                self.ui.status_label.setStyleSheet(f"background-color: {self.warning_status_color}; color: black;")
-                            return False
-                    if self._request_attempt <= 2:
-                        try:
-                            fixed_code = self._call_syntax_fixer(
-                                code_string, 
-                                err_msg,
-                                self._request_user_input,
-                                self._last_context_text
-                            )
-                            if fixed_code:
-                                print(f"[SYNTAX FIX] Retrying with fixed code")
-                                return self.run_code_string(fixed_code)
-                        except Exception as fix_err:
-                            print(f"[SYNTAX FIX FAILED] {fix_err}")
-                
-                self.append_chat_message("assistant-print", err_msg)
-                if self.ui:
-                    self.ui.status_label.setText("Execution failed")
-                    self.ui.status_label.setStyleSheet(
-                        f"background-color: {self.error_status_color}; color: white;"
-                    )
-                self.stop_wave_progress("Analysis failed")
-                return False
-        
-        main_buffer = io.StringIO()
-        original_stdout = sys.stdout
-        start_time = time.time()
-        
-        try:
-            sys.stdout = main_buffer
-            scope = self.get_execution_scope()
-            
-            last_user_input = ""
-            for m in reversed(self.chat_history):
-                if m.get("role") == "user":
-                    last_user_input = m.get("content", "")
-                    break
-            
-            current_context = self._last_context_text or "{}"
-            
-            self.execute_with_self_correction(
-                code_string, scope, last_user_input, current_context
-            )
-            
-            final_output = main_buffer.getvalue().strip()
-            elapsed = time.time() - start_time
-            
-            self.ui.status_label.setText("Success!")
-            self.ui.status_label.setStyleSheet(
-                f"background-color: {self.success_status_color}; color: black;"
-            )
-            
-            _send_error_report(
-                user_query=last_user_input,
-                context_text="",
-                generated_code=code_string,
-                error_message=("SUCCESS" + (f"\nPRINT:\n{final_output}" if final_output else "")),
-                model_name="gemini-3-flash-preview",
-                phase="execution_result",
-                metadata={
-                    "plugin_version": "QueryGIS-Plugin/1.5",
-                    "run_id": self._current_run_id,
-                    "elapsed_sec": elapsed,
-                    "attempt": self._request_attempt or None,
-                    "mode": self._last_response_mode or None,
-                    "token_count": self._last_token_count
-                },
-                query_gis_instance=self
-            )
-            
-            if final_output:
-                self.append_chat_message("assistant-print", f"Output:\n{final_output}")
-            
-            self.stop_wave_progress("Task Complete")
-            self._add_execution_result_to_chat(True, elapsed)
-            return True
-        
-        except Exception as e:
-            elapsed = time.time() - start_time
-            tb_text = traceback.format_exc()
-            partial_output = main_buffer.getvalue().strip()
-            self._last_execution_error_message = tb_text
-            
-            # If we just triggered a major attempt advance, don't show error UI yet
-            if self._execution_advance_triggered:
-                if self.ui:
-                    self.ui.status_label.setText("Scaling context & Retrying...")
-                    self.ui.status_label.setStyleSheet(f"background-color: {self.warning_status_color}; color: black;")
-                return False
-
-            if self.ui:
-                self.ui.status_label.setText("Execution failed")
-                self.ui.status_label.setStyleSheet(
-                    f"background-color: {self.error_status_color}; color: white;"
-                )
-            
-            error_display = f"Error:\n{tb_text}"
-            if partial_output:
-                error_display += f"\n\nPartial output:\n{partial_output}"
-            
-            self.append_chat_message("assistant-print", error_display)
-            
-            _send_error_report(
-                user_query=last_user_input,
-                context_text="",
-                generated_code=code_string,
-                error_message=tb_text,
-                model_name="gemini-3-flash-preview",
-                phase="execution_result",
-                metadata={
-                    "plugin_version": "QueryGIS-Plugin/1.5",
-                    "run_id": self._current_run_id,
-                    "elapsed_sec": elapsed,
-                    "final_error": True,
-                    "partial_output": partial_output[:500] if partial_output else None,
-                    "attempt": self._request_attempt or None,
-                    "mode": self._last_response_mode or None,
-                    "token_count": self._last_token_count
-                },
-                query_gis_instance=self
-            )
-            
-            self.stop_wave_progress("Analysis failed")
-            self._add_execution_result_to_chat(False, elapsed)
-            return False
+        self._last_execution_error_message = ""
         
-        finally:
-            sys.stdout = original_stdout
-            main_buffer.close()
+        # Parsed, rewritten and compiled once here; execute_with_self_correction reuses the cached result
+        try:
+            self._compiled_code.prepare(code_string)
+        except SyntaxError as e:
+            # Other code reaches the fix path through the failed run, as before
+            if "processing.run" in code_string:
+                err_msg = f"Syntax error before execution: {e}"
+                self._last_execution_error_message = err_msg
+                
+                if self._retry_on_execution_failure:
+                    if self._request_attempt == 1:
+                        if self._advance_attempt(err_msg):
+                            self._execution_advance_triggered = True
+                            if self.ui:
+                                self.ui.status_label.setStyleSheet(f"background-color: {self.warning_status_color}; color: black;")
+                            return False
+                    if self._request_attempt <= 2:
+                        self._call_syntax_fixer(
+                            code_string, 
+                            err_msg,
+                            self._request_user_input,
+                            self._last_context_text,
+                            on_settled=on_settled,
+                            query=query
+                        )
+                        return None
+                
+                self._show_syntax_failure(err_msg)
+                return False
+        
+        last_user_input = ""
+        for m in reversed(self.chat_history):
+            if m.get("role") == "user":
+                last_user_input = m.get("content", "")
+                break
+
+        self._release_checkpoints()
+        checkpoints = None
+        if QSettings().value("QueryGIS/step_checkpoints", True, type=bool):
+            try:
+                checkpoints = StepCheckpointStore.create()
+            except Exception as e:
+                logger.warning(f"Step checkpoints unavailable: {e}")
+        self._correction = {
+            "checkpoints": checkpoints,
+            "scope": self.get_execution_scope(),
+            "user_input": last_user_input,
+            "context": self._last_context_text or "{}",
+            "verified_query": query,
+            "start_time": time.time(),
+            "on_settled": on_settled,
+            "async": False
+        }
+        return self.execute_with_self_correction(
+            code_string, self._correction["scope"], last_user_input, self._correction["context"]
+        )
 
     def get_execution_scope(self):
-        scope = {
+        if self._scope_template is None:
+            self._scope_template = build_scope_template()
+        scope = ExecutionScope(self._scope_template, {
+            '__builtins__': builtins,
             'iface': self.iface,
-            'qgis': sys.modules['qgis'],
-            'QgsProject': QgsProject,
-            'QgsMapLayer': QgsMapLayer,
-            'QgsVectorLayer': QgsVectorLayer,
-            'QgsRasterLayer': QgsRasterLayer,
-            'QgsApplication': QgsApplication,
-            'QgsProcessingFeatureSourceDefinition': QgsProcessingFeatureSourceDefinition,
-            'QgsFeatureSink': QgsFeatureSink,
-            'QgsFeatureRequest': QgsFeatureRequest,
-            'QgsGeometry': QgsGeometry,
-            'QgsPointXY': QgsPointXY,
-            'QgsRectangle': QgsRectangle,
-            'QgsCoordinateReferenceSystem': QgsCoordinateReferenceSystem,
-            'QgsVectorFileWriter': QgsVectorFileWriter,
-            'QgsField': QgsField,
-            'QgsFeature': QgsFeature,
-            'QgsFillSymbol': QgsFillSymbol,
-            'QgsSymbol': QgsSymbol,
-            'QgsSingleSymbolRenderer': QgsSingleSymbolRenderer,
-            'QgsCategorizedSymbolRenderer': QgsCategorizedSymbolRenderer,
-            'QgsRendererCategory': QgsRendererCategory,
-            'QgsPalLayerSettings': QgsPalLayerSettings,
-            'QgsTextFormat': QgsTextFormat,
-            'QgsTextBufferSettings': QgsTextBufferSettings,
-            'QgsVectorLayerSimpleLabeling': QgsVectorLayerSimpleLabeling,
-            'QgsProperty': QgsProperty,
-            'QgsWkbTypes': QgsWkbTypes,
-            'QVariant': QVariant,
-            'tempfile': tempfile,
-            'os': os,
             'processing': sys.modules.get('processing'),
-            '__builtins__': builtins,
+            'processing_feedback': _UIFeedback(self.ui_bridge, label="Processing..."),
             'find_layer_by_keyword': self.find_layer_by_keyword,
             'get_layer_safe': self.get_layer_safe,
             'shorten_layer_name': self.shorten_layer_name
-        }
-        
-        # Prepare safely-wrapped processing environment
-        scope['processing_feedback'] = _UIFeedback(self.ui_bridge, label="Processing...")
-        proc_mod = scope['processing']
-        if proc_mod and hasattr(proc_mod, 'run'):
-            proxy = _RunProgressProxy(self.ui_bridge, scope=scope)
-            try:
-                scope['_orig_processing_run'] = proc_mod.run
-                proc_mod.run = proxy.wrap(proc_mod.run)
-            except Exception as e:
-                logger.warning(f"Failed to wrap processing.run: {e}")
+        })
         
-        wrapped_scope = auto_wrap_scope(scope)
-
-        return SmartQgsImporter(wrapped_scope)
-
-    def _inject_processing_feedback(self, code_string: str) -> str:
-        out_lines = []
-        for line in code_string.splitlines():
-            tmp, in_s, q = [], False, ''
-            for ch in line:
-                if ch in ('"', "'"):
-                    if not in_s:
-                        in_s, q = True, ch
-                    elif q == ch:
-                        in_s = False
-                tmp.append(ch)
-            safe_line = ''.join(tmp)
-            if 'processing.run(' in safe_line and 'feedback=' not in safe_line:
-                i = safe_line.index('processing.run(') + len('processing.run(')
-                depth, j = 1, i
-                while j < len(safe_line) and depth > 0:
-                    if safe_line[j] == '(':
-                        depth += 1
-                    elif safe_line[j] == ')':
-                        depth -= 1
-                    j += 1
-                insert_at = line.rfind(')', 0, j)
-                if insert_at != -1:
-                    line = line[:insert_at] + (', feedback=processing_feedback') + line[insert_at:]
-            out_lines.append(line)
-        return '\n'.join(out_lines)
+        # processing.run reports progress through the session-wide hook while a run is active
+        try:
+            PROCESSING_RUN_HOOK.install(scope['processing'])
+        except Exception as e:
+            logger.warning(f"Failed to hook processing.run: {e}")
+
+        return scope
+
+    def _get_algorithm_index(self):
+        """The algorithm index if built; otherwise starts building it and returns None."""
+        if self._algorithm_index is not None or self._algorithm_index_task is not None:
+            return self._algorithm_index
+        registry = QgsApplication.processingRegistry()
+        if registry is None or not registry.providers():
+            return None
+        task = AlgorithmIndexTask(self._on_algorithm_index_ready)
+        self._algorithm_index_task = task
+        QgsApplication.taskManager().addTask(task)
+        return None
+
+    def _on_algorithm_index_ready(self, task, index):
+        if task is not self._algorithm_index_task:
+            return
+        self._algorithm_index_task = None
+        self._algorithm_index = index
+
+    def _invalidate_algorithm_index(self, *args):
+        if self._algorithm_index_task is not None:
+            self._algorithm_index_task.cancel()
+            self._algorithm_index_task = None
+        self._algorithm_index = None
+
+    def _preflight_issues(self, prepared, scope):
+        registry = QgsApplication.processingRegistry()
+        algorithm_exists = None
+        if registry is not None and registry.providers():
+            algorithm_exists = lambda alg_id: registry.algorithmById(alg_id) is not None
+        layer_names = [lyr.name() for lyr in QgsProject.instance().mapLayers().values()]
+
+        known_names = set(scope) | set(getattr(scope, "template", ())) | set(dir(builtins))
+        for module_name in prepared.facts.star_modules:
+            module = sys.modules.get(module_name)
+            if module is None:
+                # Cannot tell what the star import brings in
+                known_names = None
+                break
+            known_names.update(getattr(module, "__all__", None) or dir(module))
+        index = self._algorithm_index
+        return preflight_issues(prepared, algorithm_exists, layer_names, known_names,
+                                suggest=index.suggest if index is not None else None)
 
     def find_layer_by_keyword(self, keyword):
         project = QgsProject.instance()
@@ -1941,36 +4725,33 @@ Message: {str(e)}
             code_blocks.append(text.strip())
         return code_blocks
 
-    def _parse_backend_response(self, response_text: str):
-        display_text = response_text
-        code_blocks = []
-        try:
-            data = json.loads(response_text)
-            if isinstance(data, dict):
-                candidate = None
-                if "output" in data:
-                    out = data["output"]
-                    if isinstance(out, dict) and "text" in out:
-                        candidate = out["text"]
-                if candidate is None and "response" in data:
-                    candidate = data["response"]
-                if candidate is None and "text" in data:
-                    candidate = data["text"]
-                if candidate is None and "choices" in data and isinstance(data["choices"], list) and data["choices"]:
-                    ch = data["choices"][0]
-                    if isinstance(ch, dict):
-                        if "message" in ch and isinstance(ch["message"], dict) and "content" in ch["message"]:
-                            candidate = ch["message"]["content"]
-                        elif "text" in ch:
-                            candidate = ch["text"]
-                if candidate is not None:
-                    display_text = str(candidate)
-                else:
-                    display_text = json.dumps(data, ensure_ascii=False, indent=2)
+    def _parse_backend_response(self, data):
+        # data is what BackendWorker.finished carried: decoded JSON, or the raw body text
+        if isinstance(data, str):
+            display_text = data
+        elif isinstance(data, dict):
+            candidate = None
+            if "output" in data:
+                out = data["output"]
+                if isinstance(out, dict) and "text" in out:
+                    candidate = out["text"]
+            if candidate is None and "response" in data:
+                candidate = data["response"]
+            if candidate is None and "text" in data:
+                candidate = data["text"]
+            if candidate is None and "choices" in data and isinstance(data["choices"], list) and data["choices"]:
+                ch = data["choices"][0]
+                if isinstance(ch, dict):
+                    if "message" in ch and isinstance(ch["message"], dict) and "content" in ch["message"]:
+                        candidate = ch["message"]["content"]
+                    elif "text" in ch:
+                        candidate = ch["text"]
+            if candidate is not None:
+                display_text = str(candidate)
             else:
-                display_text = json.dumps(data, ensure_ascii=False, indent=2)
-        except Exception:
-            display_text = response_text
+                display_text = json.dumps(data, ensure_ascii=False, indent=2, default=str)
+        else:
+            display_text = json.dumps(data, ensure_ascii=False, indent=2, default=str)
         code_blocks = self._extract_code_blocks(display_text)
         return display_text, code_blocks
 
@@ -2043,153 +4824,162 @@ Message: {str(e)}
             pass
         return meta
 
-    def _collect_vector_feature_rows(self, vlayer, max_rows=5, max_value_len=120):
-        rows = []
-        try:
-            fields = [f.name() for f in vlayer.fields()]
-        except Exception:
-            fields = []
-        for i, feat in enumerate(vlayer.getFeatures()):
-            if i >= max_rows:
+    @staticmethod
+    def _is_null_value(value):
+        return value is None or (isinstance(value, QVariant) and value.isNull())
+
+    def _sample_vector_layer(self, vlayer, max_rows=5, max_samples=3, scan_limit=CONTEXT_SAMPLE_SCAN,
+                             max_fields=CONTEXT_SAMPLE_FIELDS, max_value_len=120, fields=None):
+        """One attribute-only pass giving head rows plus per-field samples, cardinality and null ratio.
+
+        Only the first ``max_fields`` non-binary fields are read; the layer's ``fields`` list still
+        names all of them. ``vlayer`` may also be a QgsVectorLayerFeatureSource, in which case
+        ``fields`` is required.
+        """
+        if fields is None:
+            fields = vlayer.fields()
+        indices = []
+        for idx, field in enumerate(fields):
+            if len(indices) >= max_fields:
                 break
-            row = {}
-            for fname in fields:
-                try:
-                    val = feat[fname]
-                except Exception:
-                    val = None
-                if val is None:
-                    row[fname] = None
-                else:
-                    sval = str(val)
-                    row[fname] = sval[:max_value_len]
-            rows.append(row)
-        return rows
+            if field.type() == QVariant.ByteArray:
+                continue
+            indices.append(idx)
 
-    def _collect_qgis_context(self):
-        p = QgsProject.instance()
-        layers_info = []
-        active_id = None
-        try:
-            active = self.iface.activeLayer() if self.iface else None
-            if active:
-                active_id = active.id()
-        except Exception:
-            active_id = None
-        
-        for lyr in p.mapLayers().values():
+        stats = {}
+        for idx in indices:
+            field = fields.at(idx)
+            stats[field.name()] = {"idx": idx, "type": field.typeName(), "samples": [],
+                                   "distinct": set(), "nulls": 0}
+
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(indices)
+        request.setLimit(scan_limit)
+
+        rows = []
+        scanned = 0
+        for feature in vlayer.getFeatures(request):
+            attrs = feature.attributes()
+            row = {}
+            for name, st in stats.items():
+                value = attrs[st["idx"]] if st["idx"] < len(attrs) else None
+                if self._is_null_value(value) or value == '':
+                    st["nulls"] += 1
+                    row[name] = None
+                    continue
+                text = str(value)[:max_value_len]
+                row[name] = text
+                if text not in st["distinct"]:
+                    st["distinct"].add(text)
+                    if len(st["samples"]) < max_samples:
+                        st["samples"].append(text[:100])
+            if len(rows) < max_rows:
+                rows.append(row)
+            scanned += 1
+
+        field_stats = {}
+        for name, st in stats.items():
+            field_stats[name] = {
+                "type": st["type"],
+                "samples": st["samples"],
+                "distinct": len(st["distinct"]),
+                "null_ratio": round(st["nulls"] / scanned, 3) if scanned else None
+            }
+        return {"rows": rows, "field_stats": field_stats, "scanned": scanned}
+
+    def _layer_type_name(self, lyr):
+        return ("vector" if lyr.type() == QgsMapLayer.VectorLayer
+                else "raster" if lyr.type() == QgsMapLayer.RasterLayer
+                else "pointcloud" if getattr(QgsMapLayer, 'PointCloudLayer', 3) == lyr.type()
+                else "unknown")
+
+    def _layer_identity(self, lyr):
+        info = {
+            "name": lyr.name(),
+            "type": self._layer_type_name(lyr),
+            "crs": lyr.crs().authid() if hasattr(lyr, "crs") else None,
+            "provider": getattr(lyr, "providerType", lambda: None)(),
+            "source": getattr(lyr, "source", lambda: None)(),
+            "metadata": self._collect_layer_metadata(lyr)
+        }
+        if isinstance(lyr, QgsVectorLayer):
+            info["geometry"] = QgsWkbTypes.displayString(lyr.wkbType())
+            info["is_csv"] = (str(info.get("provider") or "").lower() == "delimitedtext")
+            info["fields"] = [f.name() for f in lyr.fields()]
+        elif isinstance(lyr, QgsRasterLayer):
             try:
-                info = {
-                    "name": lyr.name(),
-                    "type": ("vector" if lyr.type() == QgsMapLayer.VectorLayer
-                            else "raster" if lyr.type() == QgsMapLayer.RasterLayer
-                            else "pointcloud" if getattr(QgsMapLayer, 'PointCloudLayer', 3) == lyr.type()
-                            else "unknown"),
-                    "crs": lyr.crs().authid() if hasattr(lyr, "crs") else None,
-                    "provider": getattr(lyr, "providerType", lambda: None)(),
-                    "source": getattr(lyr, "source", lambda: None)(),
-                    "metadata": self._collect_layer_metadata(lyr)
+                ext = lyr.extent()
+                info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
+                info["extent_corners"] = {
+                    "top_left": [ext.xMinimum(), ext.yMaximum()],
+                    "top_right": [ext.xMaximum(), ext.yMaximum()],
+                    "bottom_left": [ext.xMinimum(), ext.yMinimum()],
+                    "bottom_right": [ext.xMaximum(), ext.yMinimum()]
                 }
-                
-                if isinstance(lyr, QgsVectorLayer):
-                    info["geometry"] = QgsWkbTypes.displayString(lyr.wkbType())
-                    info["feature_count"] = lyr.featureCount()
-                    info["fields"] = [f.name() for f in lyr.fields()]
-                    info["is_csv"] = (str(info.get("provider") or "").lower() == "delimitedtext")
-                    max_rows = 5 if (active_id and lyr.id() == active_id) else 3
-                    info["feature_samples"] = self._collect_vector_feature_rows(lyr, max_rows=max_rows)
-                    try:
-                        ext = lyr.extent()
-                        info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
-                    except Exception:
-                        pass
-                elif isinstance(lyr, QgsRasterLayer):
-                    try:
-                        ext = lyr.extent()
-                        info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
-                        info["extent_corners"] = {
-                            "top_left": [ext.xMinimum(), ext.yMaximum()],
-                            "top_right": [ext.xMaximum(), ext.yMaximum()],
-                            "bottom_left": [ext.xMinimum(), ext.yMinimum()],
-                            "bottom_right": [ext.xMaximum(), ext.yMinimum()]
-                        }
-                    except Exception:
-                        pass
-                    try:
-                        info["band_count"] = lyr.bandCount()
-                        info["width"] = lyr.width()
-                        info["height"] = lyr.height()
-                    except Exception:
-                        pass
-                    
-                layers_info.append(info)
             except Exception:
                 pass
-
-        return {
-            "project": self._collect_project_metadata(),
-            "layers": layers_info
-        }
-
-    def _collect_qgis_context_light(self):
-        p = QgsProject.instance()
-        layers_info = []
-
-        for lyr in p.mapLayers().values():
             try:
-                info = {
-                    "name": lyr.name(),
-                    "type": ("vector" if lyr.type() == QgsMapLayer.VectorLayer
-                            else "raster" if lyr.type() == QgsMapLayer.RasterLayer
-                            else "pointcloud" if getattr(QgsMapLayer, 'PointCloudLayer', 3) == lyr.type()
-                            else "unknown"),
-                    "crs": lyr.crs().authid() if hasattr(lyr, "crs") else None,
-                    "provider": getattr(lyr, "providerType", lambda: None)(),
-                    "source": getattr(lyr, "source", lambda: None)(),
-                    "metadata": self._collect_layer_metadata(lyr)
-                }
-                if isinstance(lyr, QgsVectorLayer):
-                    info["geometry"] = QgsWkbTypes.displayString(lyr.wkbType())
-                    info["feature_count"] = lyr.featureCount()
-                    info["is_csv"] = (str(info.get("provider") or "").lower() == "delimitedtext")
-                    info["fields"] = [f.name() for f in lyr.fields()]
-                    info["feature_samples"] = self._collect_vector_feature_rows(lyr, max_rows=3)
-                    try:
-                        ext = lyr.extent()
-                        info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
-                    except Exception:
-                        pass
-                elif isinstance(lyr, QgsRasterLayer):
-                    try:
-                        ext = lyr.extent()
-                        info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
-                        info["extent_corners"] = {
-                            "top_left": [ext.xMinimum(), ext.yMaximum()],
-                            "top_right": [ext.xMaximum(), ext.yMaximum()],
-                            "bottom_left": [ext.xMinimum(), ext.yMinimum()],
-                            "bottom_right": [ext.xMaximum(), ext.yMinimum()]
-                        }
-                    except Exception:
-                        pass
-                    try:
-                        info["band_count"] = lyr.bandCount()
-                        info["width"] = lyr.width()
-                        info["height"] = lyr.height()
-                    except Exception:
-                        pass
-                layers_info.append(info)
+                info["band_count"] = lyr.bandCount()
+                info["width"] = lyr.width()
+                info["height"] = lyr.height()
             except Exception:
                 pass
+        return info
 
-        return {
-            "project": self._collect_project_metadata(),
-            "layers": layers_info
-        }
+    def _add_vector_stats(self, info, stats_layer, layer_id=None):
+        self._add_feature_count(info, stats_layer, layer_id)
+        try:
+            ext, estimated = self._layer_stats.extent(stats_layer, layer_id)
+            if ext is not None:
+                info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
+                if estimated:
+                    info["extent_estimated"] = True
+        except Exception:
+            pass
 
-    def _collect_qgis_context_active(self, max_rows=5):
+    def _add_vector_samples(self, info, feature_source, fields, max_rows):
+        try:
+            sample = self._sample_vector_layer(feature_source, max_rows=max_rows, fields=fields)
+            info["feature_samples"] = sample["rows"]
+            info["field_stats"] = sample["field_stats"]
+            info["sampled_features"] = sample["scanned"]
+        except Exception:
+            info["feature_samples"] = []
+
+    def _build_layer_info(self, lyr, max_rows=3):
+        info = self._layer_identity(lyr)
+        if isinstance(lyr, QgsVectorLayer):
+            self._add_vector_stats(info, lyr)
+            self._add_vector_samples(info, lyr, lyr.fields(), max_rows)
+        return info
+
+    def _add_feature_count(self, info, lyr, layer_id=None):
+        count, estimated = self._layer_stats.feature_count(lyr, layer_id)
+        info["feature_count"] = count
+        if estimated:
+            info["feature_count_estimated"] = True
+
+    def _layer_context(self, lyr, max_rows=3):
+        # Rebuilt only after one of the layer's change signals fired
+        return self._layer_context_cache.get(lyr, max_rows, self._build_layer_info)
+
+    def _context_targets(self, scope, max_rows=5):
+        """(layer, sample rows) pairs for the "full", "light" or "active" context."""
         p = QgsProject.instance()
-        layers_info = []
-        
+        if scope == "full":
+            active_id = None
+            try:
+                active = self.iface.activeLayer() if self.iface else None
+                if active:
+                    active_id = active.id()
+            except Exception:
+                active_id = None
+            return [(lyr, 5 if (active_id and lyr.id() == active_id) else 3)
+                    for lyr in p.mapLayers().values()]
+        if scope == "light":
+            return [(lyr, 3) for lyr in p.mapLayers().values()]
+
         selected_layers = []
         try:
             if self.iface:
@@ -2216,60 +5006,96 @@ Message: {str(e)}
             except Exception:
                 pass
 
-        for lyr in selected_layers:
-            if not lyr:
-                continue
-            
+        return [(lyr, max_rows) for lyr in selected_layers if lyr]
+
+    def _collect_context_for(self, targets):
+        layers_info = []
+        for lyr, max_rows in targets:
             try:
-                info = {
-                    "name": lyr.name(),
-                    "type": ("vector" if lyr.type() == QgsMapLayer.VectorLayer
-                            else "raster" if lyr.type() == QgsMapLayer.RasterLayer
-                            else "pointcloud" if getattr(QgsMapLayer, 'PointCloudLayer', 3) == lyr.type()
-                            else "unknown"),
-                    "crs": lyr.crs().authid() if hasattr(lyr, "crs") else None,
-                    "provider": getattr(lyr, "providerType", lambda: None)(),
-                    "source": getattr(lyr, "source", lambda: None)(),
-                    "metadata": self._collect_layer_metadata(lyr)
-                }
-                if isinstance(lyr, QgsVectorLayer):
-                    info["geometry"] = QgsWkbTypes.displayString(lyr.wkbType())
-                    info["feature_count"] = lyr.featureCount()
-                    info["is_csv"] = (str(info.get("provider") or "").lower() == "delimitedtext")
-                    info["fields"] = [f.name() for f in lyr.fields()]
-                    info["feature_samples"] = self._collect_vector_feature_rows(lyr, max_rows=max_rows)
-                    try:
-                        ext = lyr.extent()
-                        info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
-                    except Exception:
-                        pass
-                elif isinstance(lyr, QgsRasterLayer):
-                    try:
-                        ext = lyr.extent()
-                        info["extent"] = [ext.xMinimum(), ext.yMinimum(), ext.xMaximum(), ext.yMaximum()]
-                        info["extent_corners"] = {
-                            "top_left": [ext.xMinimum(), ext.yMaximum()],
-                            "top_right": [ext.xMaximum(), ext.yMaximum()],
-                            "bottom_left": [ext.xMinimum(), ext.yMinimum()],
-                            "bottom_right": [ext.xMaximum(), ext.yMinimum()]
-                        }
-                    except Exception:
-                        pass
-                    try:
-                        info["band_count"] = lyr.bandCount()
-                        info["width"] = lyr.width()
-                        info["height"] = lyr.height()
-                    except Exception:
-                        pass
-                layers_info.append(info)
+                layers_info.append(self._layer_context(lyr, max_rows=max_rows))
             except Exception:
                 pass
-
         return {
             "project": self._collect_project_metadata(),
             "layers": layers_info
         }
 
+    def _collect_qgis_context(self):
+        return self._collect_context_for(self._context_targets("full"))
+
+    def _collect_qgis_context_light(self):
+        return self._collect_context_for(self._context_targets("light"))
+
+    def _collect_qgis_context_active(self, max_rows=5):
+        return self._collect_context_for(self._context_targets("active", max_rows))
+
+    def _snapshot_layer(self, lyr, max_rows):
+        """Main-thread part of a layer entry: identity only, plus what the worker needs to read features."""
+        entry = {
+            "layer_id": lyr.id(),
+            "max_rows": max_rows,
+            "generation": self._layer_context_cache.generation(lyr.id()),
+            "cached": self._layer_context_cache.peek(lyr.id(), max_rows),
+        }
+        if entry["cached"] is not None:
+            return entry
+        entry["info"] = self._layer_identity(lyr)
+        if isinstance(lyr, QgsVectorLayer):
+            entry["fields"] = QgsFields(lyr.fields())
+            entry["feature_source"] = QgsVectorLayerFeatureSource(lyr)
+            if lyr.providerType() == "memory":
+                # Nothing to reopen; memory counts and extents are free anyway
+                self._add_vector_stats(entry["info"], lyr)
+            else:
+                entry["reopen"] = (lyr.source(), lyr.name(), lyr.providerType())
+        return entry
+
+    def _fill_layer_snapshot(self, entry):
+        """Worker-thread part: statistics on an independent provider connection, then the sample pass."""
+        info = entry["info"]
+        if "feature_source" not in entry:
+            return info
+        if "reopen" in entry:
+            source, name, provider = entry["reopen"]
+            stats_layer = QgsVectorLayer(source, name, provider)
+            if stats_layer.isValid():
+                self._add_vector_stats(info, stats_layer, entry["layer_id"])
+        self._add_vector_samples(info, entry["feature_source"], entry["fields"], entry["max_rows"])
+        return info
+
+    def _collect_context_async(self, targets, on_ready, on_cancelled=None):
+        if self._context_task is not None:
+            try:
+                self._context_task.cancel()
+            except Exception:
+                pass
+        snapshots = []
+        for lyr, max_rows in targets:
+            try:
+                snapshots.append(self._snapshot_layer(lyr, max_rows))
+            except Exception:
+                pass
+        task = ContextCollectionTask(self, self._collect_project_metadata(), snapshots)
+        task.contextReady.connect(on_ready)
+        task.on_cancelled = on_cancelled
+        self._context_task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _on_context_task_done(self, task, entries, result):
+        if task is not self._context_task:
+            return
+        self._context_task = None
+        if not result:
+            if task.on_cancelled is not None:
+                task.on_cancelled()
+            else:
+                self.handle_error("Layer context collection was cancelled")
+            return
+        for entry in entries:
+            if entry.get("cached") is None and not entry.get("failed"):
+                self._layer_context_cache.put(entry["layer_id"], entry["max_rows"],
+                                              entry["info"], entry["generation"])
+
     def _collect_tool_info(self):
         info = {}
         try:
@@ -2312,7 +5138,7 @@ Message: {str(e)}
         except Exception:
             return ""
 
-    def _collect_tool_data(self, tools):
+    def _collect_tool_data(self, tools, request_counts=True):
         data = {}
         for tool in tools or []:
             try:
@@ -2359,9 +5185,9 @@ Message: {str(e)}
                             data[name] = {
                                 "name": layer.name(),
                                 "geometry": QgsWkbTypes.displayString(layer.wkbType()),
-                                "fields": [f.name() for f in layer.fields()],
-                                "feature_count": layer.featureCount()
+                                "fields": [f.name() for f in layer.fields()]
                             }
+                            self._add_feature_count(data[name], layer)
                         elif layer:
                             data[name] = {
                                 "name": layer.name(),
@@ -2369,6 +5195,24 @@ Message: {str(e)}
                             }
                 except Exception:
                     pass
+            elif name == "exact_feature_count":
+                # Exact counts may need a full scan; they run as tasks and the follow-up waits for them
+                try:
+                    targets = params.get("names") or [params.get("name")]
+                    counts = {}
+                    for target in targets:
+                        layer = self.find_layer_by_keyword(target) if target else None
+                        if not layer or not isinstance(layer, QgsVectorLayer):
+                            continue
+                        exact = self._layer_stats.exact_count(layer)
+                        if exact is None and request_counts:
+                            self._awaiting_exact_counts.add(layer.id())
+                            self._layer_stats.request_exact_count(layer)
+                        counts[layer.name()] = exact if (exact is not None and exact >= 0) else None
+                    if counts:
+                        data[name] = counts
+                except Exception:
+                    pass
         return data
 
     def _handle_tool_request(self, tool_request):
@@ -2377,10 +5221,31 @@ Message: {str(e)}
         tools = tool_request.get("tools") if isinstance(tool_request, dict) else None
         if not tools:
             return False
+        self._awaiting_exact_counts.clear()
         tool_data = self._collect_tool_data(tools)
         if not tool_data:
             return False
         self._tool_request_rounds += 1
+        if self._awaiting_exact_counts:
+            self._pending_tool_request = tool_request
+            self.update_wave_message("Counting features")
+            return True
+        self._start_tool_followup(tool_request, tool_data)
+        return True
+
+    def _on_exact_count_ready(self, layer_id, count):
+        self._layer_context_cache.discard(layer_id)
+        self._awaiting_exact_counts.discard(layer_id)
+        if self._awaiting_exact_counts or not self._pending_tool_request:
+            return
+        tool_request = self._pending_tool_request
+        self._pending_tool_request = None
+        # Counts that just failed are reported as unknown here and retried on the next request
+        tool_data = self._collect_tool_data(tool_request.get("tools"), request_counts=False)
+        self._awaiting_exact_counts.clear()
+        self._start_tool_followup(tool_request, tool_data)
+
+    def _start_tool_followup(self, tool_request, tool_data):
         self.update_wave_message("Collecting requested info")
         self._start_backend_attempt(
             mode="tool_followup",
@@ -2390,7 +5255,6 @@ Message: {str(e)}
             tool_request=tool_request,
             tool_data=tool_data
         )
-        return True
 
     def _add_execution_result_to_chat(self, execution_success, seconds):
         if not self.ui:
@@ -2409,10 +5273,197 @@ Message: {str(e)}
         else:
             self.append_chat_message("assistant-print", f"Failed after {time_str}")
 
+    def _get_response_cache(self):
+        if not QSettings().value("QueryGIS/response_cache", True, type=bool):
+            return None
+        if self._response_cache is None:
+            try:
+                settings = QSettings()
+                ttl_hours = settings.value("QueryGIS/response_cache_ttl_hours", RESPONSE_CACHE_TTL_HOURS, type=int)
+                self._response_cache = ResponseCache(
+                    os.path.join(QgsApplication.qgisSettingsDirPath(), "QueryGIS", "response_cache.sqlite"),
+                    max_entries=settings.value("QueryGIS/response_cache_max_entries",
+                                               RESPONSE_CACHE_MAX_ENTRIES, type=int),
+                    ttl_sec=ttl_hours * 3600
+                )
+            except Exception as e:
+                logger.warning(f"Response cache unavailable: {e}")
+                return None
+        return self._response_cache
+
+    def _structure_fingerprint(self):
+        """Project shape the answer depends on: selection, layer names, types, CRS and fields, no values."""
+        p = QgsProject.instance()
+        layers = [[lyr.name(), self._layer_signature(lyr)] for lyr in p.mapLayers().values()]
+        return {
+            "crs": p.crs().authid(),
+            "selected": sorted(self._selected_layer_names()),
+            "layers": sorted(layers, key=lambda e: (e[0], e[1]["type"]))
+        }
+
+    def _layer_signature(self, lyr):
+        sig = {"type": self._layer_type_name(lyr), "crs": lyr.crs().authid()}
+        if isinstance(lyr, QgsVectorLayer):
+            sig["geometry"] = QgsWkbTypes.displayString(lyr.wkbType())
+            sig["fields"] = [[f.name(), f.typeName()] for f in lyr.fields()]
+        return sig
+
+    @staticmethod
+    def _signature_compatible(saved, current):
+        if any(saved.get(k) != current.get(k) for k in ("type", "crs", "geometry")):
+            return False
+        current_fields = {tuple(f) for f in current.get("fields") or []}
+        return all(tuple(f) in current_fields for f in saved.get("fields") or [])
+
+    def _get_verified_library(self):
+        if not QSettings().value("QueryGIS/verified_code_library", True, type=bool):
+            return None
+        if self._verified_library is None:
+            try:
+                self._verified_library = VerifiedCodeLibrary(
+                    os.path.join(QgsApplication.qgisSettingsDirPath(), "QueryGIS", "verified_code.sqlite")
+                )
+            except Exception as e:
+                logger.warning(f"Verified code library unavailable: {e}")
+                return None
+        return self._verified_library
+
+    def _remember_verified_code(self, user_input, code, elapsed):
+        user_input = ResponseCache.strip_directives(user_input)
+        if not user_input or not code:
+            return
+        library = self._get_verified_library()
+        if library is None:
+            return
+        try:
+            layers = {}
+            for lyr in QgsProject.instance().mapLayers().values():
+                name = lyr.name()
+                if f"'{name}'" in code or f'"{name}"' in code:
+                    layers[name] = self._layer_signature(lyr)
+            selected = [self._layer_signature(lyr) for lyr in self._selected_layers()]
+            library.record(user_input, code, elapsed, layers, selected)
+        except Exception as e:
+            logger.warning(f"Verified code library store failed: {e}")
+
+    def _verified_code_compatible(self, entry):
+        project = QgsProject.instance()
+        for name, saved in entry["layers"].items():
+            if not any(self._signature_compatible(saved, self._layer_signature(lyr))
+                       for lyr in project.mapLayersByName(name)):
+                return False
+        if any(k in entry["code"] for k in ("activeLayer", "selectedLayers", "selectedFeature")):
+            current = [self._layer_signature(lyr) for lyr in self._selected_layers()]
+            if len(current) != len(entry["selected"]):
+                return False
+            if not all(self._signature_compatible(saved, cur) for saved, cur in zip(entry["selected"], current)):
+                return False
+        return True
+
+    def _offer_verified_code(self, user_input):
+        """Offer to rerun code that already succeeded for a similar query; True if it was run."""
+        if ResponseCache.opted_out(user_input):
+            return False
+        library = self._get_verified_library()
+        if library is None or not len(library.index):
+            return False
+        try:
+            threshold = QSettings().value("QueryGIS/verified_code_threshold", VERIFIED_CODE_THRESHOLD, type=float)
+            entry = library.best_match(user_input, self._verified_code_compatible, threshold)
+        except Exception as e:
+            logger.warning(f"Verified code lookup failed: {e}")
+            return False
+        if entry is None:
+            return False
+        answer = QMessageBox.question(
+            self.iface.mainWindow(),
+            "QueryGIS",
+            f"Code that already ran successfully in this project matches your request "
+            f"(similarity {entry['score']:.2f}, took {entry['elapsed']:.1f}s):\n\n{entry['query']}\n\n"
+            f"Run it now instead of asking the server?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+        if answer != QMessageBox.Yes:
+            return False
+
+        self._library_hit_id = entry["id"]
+        try:
+            _send_error_report(
+                user_query=user_input,
+                context_text="",
+                generated_code=entry["code"],
+                error_message="Reused verified code from the local library.",
+                model_name=self._request_model,
+                phase="verified_code_reuse",
+                metadata={
+                    "plugin_version": "QueryGIS-Plugin/1.5",
+                    "run_id": self._current_run_id,
+                    "similarity": round(entry["score"], 3),
+                    "matched_query": entry["query"],
+                    "uses": entry["uses"]
+                },
+                query_gis_instance=self
+            )
+        except Exception:
+            pass
+        self._note_code_query(entry["code"], user_input)
+        self.append_chat_message("assistant", entry["code"])
+        self.start_wave_progress("Running verified code")
+        success = self.run_code_string(entry["code"], on_settled=self._on_response_execution_settled,
+                                       query=user_input)
+        if success is not None and not self._after_response_execution(success):
+            self._finish_response()
+        return True
+
+    def _try_cached_response(self, user_input):
+        """Serve the query from the local response cache; True on a hit."""
+        self._request_cache_key = None
+        self._cache_hit_key = None
+        if ResponseCache.opted_out(user_input):
+            return False
+        cache = self._get_response_cache()
+        if cache is None:
+            return False
+        try:
+            key = ResponseCache.make_key(user_input, self._structure_fingerprint(), self._request_model)
+            # Code that will be run must have run successfully before
+            cached = cache.get(key, verified_only=self._request_should_run)
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return False
+        if cached is None:
+            self._request_cache_key = key
+            return False
+        self._cache_hit_key = key
+        print(f"[DEBUG] response cache hit: {cache.stats()}")
+        try:
+            _send_error_report(
+                user_query=user_input,
+                context_text="",
+                generated_code="",
+                error_message="Answered from local response cache.",
+                model_name=self._request_model,
+                phase="cache_hit",
+                metadata={
+                    "plugin_version": "QueryGIS-Plugin/1.5",
+                    "run_id": self._current_run_id,
+                    "cache_stats": cache.stats()
+                },
+                query_gis_instance=self
+            )
+        except Exception:
+            pass
+        self.update_wave_message("Answered from local cache")
+        self.handle_response(cached)
+        return True
+
     def process_query(self):
         if not self.ui:
             self.iface.messageBar().pushMessage("Error", "UI not initialized.", level=Qgis.Critical)
             return
+        if self._refuse_while_running():
+            return
 
         self.start_wave_progress("Processing query")
         user_input = self.ui.text_query.toPlainText().strip()
@@ -2434,6 +5485,7 @@ Message: {str(e)}
             self.save_api_key(api_key)
 
         self._current_run_id = uuid.uuid4().hex[:12]
+        self._cancel_fix_worker()
 
         self.append_chat_message("user", user_input)
         self.ui.text_query.clear()
@@ -2449,15 +5501,43 @@ Message: {str(e)}
             self._request_tool_info = self._collect_tool_info()
             self._request_error_message = ""
             self._last_execution_error_message = ""
-            
-            context_dict = self._collect_qgis_context_active()
+            self._last_context_text = ""
+            self._tool_request_rounds = 0
+            self._pending_tool_request = None
+            self._last_prompt_full = ""
+            self._execution_advance_triggered = False
+            self._cacheable_response = None
+            self._library_hit_id = None
+
+            # "#nocache" is a client directive; the backend never sees it
+            if ResponseCache.opted_out(user_input):
+                self._request_user_input = ResponseCache.strip_directives(user_input)
+            if self._try_cached_response(user_input):
+                return
+            if self._offer_verified_code(user_input):
+                return
+
+            # Layer sampling runs on a QgsTask; the backend call starts from contextReady
+            self.update_wave_message("Collecting layer context")
+            run_id = self._current_run_id
+            self._collect_context_async(
+                self._context_targets("active"),
+                lambda ctx, run_id=run_id: self._on_query_context_ready(run_id, ctx)
+            )
+        except Exception as e:
+            logger.error(f"Query processing error: {e}")
+            self.handle_error(f"Query processing failed: {str(e)}")
+
+    def _on_query_context_ready(self, run_id, context_dict):
+        if run_id != self._current_run_id:
+            return
+        user_input = self._request_user_input
+        model_name = self._request_model
+        try:
             context_text = self._build_context_text(context_dict)
             print("[DEBUG] context_text_len:", len(context_text or ""))
             print("[DEBUG] context_text_preview:\n", (context_text or "")[:2000])
             self._last_context_text = context_text
-            self._tool_request_rounds = 0
-            self._last_prompt_full = ""
-            self._execution_advance_triggered = False
 
             _send_error_report(
                 user_query=user_input,
@@ -0,0 +1,61 @@
+# coding=utf-8
+"""Per-call overhead of AutoVerifyWrapper in feature loops.
+
+Builds ``--features`` QgsFeature objects with point geometries and runs the
+kind of loop generated code writes, over plain objects and over objects
+wrapped the way the execution scope wraps ``Qgs*`` constructors.
+
+    python scripts/bench_auto_verify.py [--features 100000]
+"""
+
+import argparse
+
+from bench_common import load_plugin_module, timed
+
+
+def make_features(n, wrap):
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY
+
+    features = []
+    for i in range(n):
+        f = QgsFeature()
+        f.setId(i)
+        f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(i % 1000, i // 1000)))
+        features.append(wrap(f) if wrap else f)
+    return features
+
+
+def loop(features):
+    total = 0.0
+    for f in features:
+        geom = f.geometry()
+        if f.hasGeometry() and f.id() % 2 == 0:
+            total += geom.asPoint().x()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--features", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    plugin = load_plugin_module()
+    plain = make_features(args.features, None)
+    wrapped = make_features(args.features, plugin.AutoVerifyWrapper)
+
+    # The first pass installs the checked methods on the per-type wrapper class
+    cold = timed(lambda: loop(wrapped), repeat=1)
+    plain_t = timed(lambda: loop(plain), repeat=args.repeat)
+    assert loop(plain) == loop(wrapped)
+    wrapped_t = timed(lambda: loop(wrapped), repeat=args.repeat)
+    calls = args.features * 3
+    print(f"{args.features} features, ~{calls} method calls per loop")
+    print(f"  unwrapped:             {plain_t * 1000:8.1f} ms")
+    print(f"  wrapped, first pass:   {cold * 1000:8.1f} ms")
+    print(f"  wrapped, later passes: {wrapped_t * 1000:8.1f} ms  "
+          f"(+{(wrapped_t - plain_t) / calls * 1e9:.0f} ns per call)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""Shared helpers for the QueryGIS benchmark scripts.
+
+Run the benchmarks with the Python interpreter that ships with QGIS
+(e.g. ``python-qgis`` or the OSGeo4W shell) so that ``qgis.core`` and
+``qgis.PyQt`` are importable; the plugin module is imported as a package
+from its parent directory, the same way QGIS loads it.
+"""
+
+import gzip
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_plugin_module(name="query_gis"):
+    """Import ``<plugin package>.<name>`` without a running QGIS instance."""
+    parent = os.path.dirname(PLUGIN_DIR)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    package = os.path.basename(PLUGIN_DIR)
+    return importlib.import_module(f"{package}.{name}")
+
+
+def timed(fn, repeat=5):
+    """Best wall time of ``repeat`` calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            self.server.stats["bytes_in"] += len(body)
+        codings = self.server.request_codings
+        coding = (self.headers.get("Content-Encoding") or "identity").lower()
+        if coding != "identity":
+            if coding not in codings:
+                self._send(415, {"Accept-Encoding": ", ".join(codings) or "identity"}, b"")
+                return
+            body = decode_body(body, coding)
+        route = self.server.routes.get(self.path, self.server.default_route)
+        status, headers, payload = route(self, body)
+        if codings:
+            # RFC 7694: advertise the request codings this server accepts
+            headers = dict(headers, **{"Accept-Encoding": ", ".join(codings)})
+        self._send(status, headers, payload)
+
+    def _send(self, status, headers, payload):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if isinstance(payload, (bytes, bytearray)):
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        # Iterable payload: chunked transfer, one chunk per item
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in payload:
+            self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def decode_body(body, coding):
+    if coding == "gzip":
+        return gzip.decompress(body)
+    if coding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    raise ValueError(f"unsupported content-coding {coding}")
+
+
+def json_route(data, status=200):
+    encoded = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    def route(handler, body):
+        return status, {"Content-Type": "application/json"}, encoded
+    return route
+
+
+class StubServer:
+    """Local HTTP/1.1 keep-alive server counting connections, requests and request bytes.
+
+    ``request_codings`` lists the request content-codings the server accepts and advertises;
+    ``bytes_in`` counts bytes on the wire, before decoding.
+    """
+
+    def __init__(self, routes=None, default_route=None, request_codings=()):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.routes = routes or {}
+        self.httpd.default_route = default_route or json_route({"ok": True})
+        self.httpd.request_codings = tuple(request_codings)
+        self.httpd.stats_lock = threading.Lock()
+        self.reset()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self):
+        with self.httpd.stats_lock:
+            return dict(self.httpd.stats)
+
+    def reset(self):
+        self.httpd.stats = {"connections": 0, "requests": 0, "bytes_in": 0}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
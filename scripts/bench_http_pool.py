@@ -0,0 +1,65 @@
+# coding=utf-8
+"""Connections opened per query: one session per request vs. HttpSessionPool.
+
+A QueryGIS query posts roughly six times (user_query, /chat, ai_answer,
+execution_result, ...). Every new connection to querygis.com is a TCP+TLS
+handshake; against the local stub each new connection is counted instead.
+
+    python scripts/bench_http_pool.py [--queries 20]
+"""
+
+import argparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bench_common import StubServer, load_plugin_module, timed
+
+PHASES = ("/report-error", "/chat", "/report-error", "/report-error", "/fix-code", "/report-error")
+
+
+def per_request_sessions(base_url, queries):
+    # What BackendWorker and LoggingWorker did before: a fresh session per call
+    for _ in range(queries):
+        for path in PHASES:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter())
+            try:
+                session.post(base_url + path, json={"phase": path}, timeout=5)
+            finally:
+                session.close()
+
+
+def pooled_sessions(pool, base_url, queries):
+    for _ in range(queries):
+        for path in PHASES:
+            pool.post(base_url + path, json={"phase": path}, timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    plugin = load_plugin_module()
+    with StubServer() as server:
+        results = {}
+        server.reset()
+        elapsed = timed(lambda: per_request_sessions(server.url, args.queries), repeat=1)
+        results["session per request"] = (server.stats, elapsed)
+
+        pool = plugin.HttpSessionPool()
+        server.reset()
+        elapsed = timed(lambda: pooled_sessions(pool, server.url, args.queries), repeat=1)
+        pool.close_all()
+        results["HttpSessionPool"] = (server.stats, elapsed)
+
+    print(f"{args.queries} queries x {len(PHASES)} requests")
+    for label, (stats, elapsed) in results.items():
+        per_query = stats["connections"] / float(args.queries)
+        print(f"{label:>20}: {stats['connections']:4d} connections "
+              f"({per_query:.2f}/query), {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
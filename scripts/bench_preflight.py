@@ -0,0 +1,119 @@
+# coding=utf-8
+"""Executions wasted on code that was certain to fail, with and without the pre-flight check.
+
+A corpus is JSONL, one query per line:
+
+    {"query": "...", "layers": ["roads", ...], "runs": [{"code": "...", "ok": false}, ...]}
+
+``runs`` are the generated script and each fix-round script in order, with
+whether executing them succeeded. A failed run is wasted; with the pre-flight
+check it is only wasted if the check lets it through (the fix that followed
+is assumed to be the same either way). Passing runs that the check rejects
+are reported as false positives.
+
+Algorithm ids are checked against the catalogue shipped in ``qgis모음.txt``.
+Without ``--corpus`` a synthetic corpus with typical failures is generated.
+
+    python scripts/bench_preflight.py [--corpus runs.jsonl] [--queries 200]
+"""
+
+import argparse
+import builtins
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from bench_common import PLUGIN_DIR, load_plugin_module
+
+HELPERS = {"iface", "qgis", "processing", "processing_feedback", "find_layer_by_keyword",
+           "get_layer_safe", "shorten_layer_name"}
+
+
+def load_catalogue():
+    ids = set()
+    with open(os.path.join(PLUGIN_DIR, "qgis모음.txt"), encoding="utf-8") as fh:
+        for line in fh:
+            if line.startswith("ID:"):
+                ids.add(line[3:].split("|")[0].strip())
+    return ids
+
+
+def synthetic_corpus(n, rng):
+    layers = ["roads", "buildings", "parcels", "rivers", "도로", "행정구역"]
+    good = ("layer = get_layer_safe('{layer}')\n"
+            "res = processing.run('native:buffer', {{'INPUT': layer, 'DISTANCE': 50, 'OUTPUT': 'memory:'}})\n"
+            "QgsProject.instance().addMapLayer(res['OUTPUT'])\n"
+            "print('Done!')\n")
+    failures = [
+        lambda layer: good.format(layer=layer).replace("native:buffer", "native:bufer"),
+        lambda layer: good.format(layer="railways"),
+        lambda layer: good.format(layer=layer).replace("print('Done!')", "print(result_layer.name())"),
+        # Only found by running: a bad parameter value
+        lambda layer: good.format(layer=layer).replace("'DISTANCE': 50", "'DISTANCE': 'fifty'"),
+    ]
+    corpus = []
+    for q in range(n):
+        layer = rng.choice(layers)
+        runs = [{"code": rng.choice(failures)(layer), "ok": False} for _ in range(rng.choice((0, 0, 1, 1, 2, 3)))]
+        runs.append({"code": good.format(layer=layer), "ok": True})
+        corpus.append({"query": f"buffer {layer} #{q}", "layers": layers, "runs": runs})
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    plugin = load_plugin_module()
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as fh:
+            corpus = [json.loads(line) for line in fh if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.queries, random.Random(11))
+
+    catalogue = load_catalogue()
+    known = HELPERS | set(dir(builtins))
+    for module_name, name in plugin.RUNTIME_IMPORTS:
+        if name == "*":
+            known.update(dir(sys.modules.get(module_name) or __import__(module_name, fromlist=["*"])))
+
+    wasted_before, wasted_after = [], []
+    false_positives = caught = checks = 0
+    check_time = 0.0
+    for record in corpus:
+        before = after = 0
+        for run in record["runs"]:
+            try:
+                prepared = plugin.CodeRewriter.prepare(run["code"])
+            except SyntaxError:
+                continue  # already caught before execution
+            start = time.perf_counter()
+            issues, _ = plugin.preflight_issues(prepared, catalogue.__contains__, record["layers"], known)
+            check_time += time.perf_counter() - start
+            checks += 1
+            if run["ok"]:
+                false_positives += bool(issues)
+                continue
+            before += 1
+            if issues:
+                caught += 1
+            else:
+                after += 1
+        wasted_before.append(before)
+        wasted_after.append(after)
+
+    print(f"{len(corpus)} queries, {sum(wasted_before)} failed executions")
+    print(f"  wasted executions per query, median (mean): "
+          f"{statistics.median(wasted_before):.1f} ({statistics.mean(wasted_before):.2f}) without pre-flight, "
+          f"{statistics.median(wasted_after):.1f} ({statistics.mean(wasted_after):.2f}) with")
+    print(f"  caught before running: {caught}; passing runs rejected: {false_positives}")
+    print(f"  check cost: {check_time / max(1, checks) * 1000:.3f} ms per script")
+
+
+if __name__ == "__main__":
+    main()
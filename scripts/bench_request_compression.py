@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Wire size and CPU cost of compressing /chat and /fix-code request bodies.
+
+Pass captured request bodies (one JSON payload per file) with ``--payloads``;
+without them, payloads shaped like the plugin's are generated: a /chat request
+with a 30-layer context, a tool follow-up whose tool_data is the full context,
+and a /fix-code request with 500 lines of broken code.
+
+The second table posts the same payloads through HttpSessionPool to a stub
+that advertises ``Accept-Encoding: gzip`` (RFC 7694) and one that does not.
+
+    python scripts/bench_request_compression.py [--payloads dumps/*.json]
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import random
+import time
+
+from bench_common import StubServer, load_plugin_module
+from stub_context_backend import synthetic_context
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def synthetic_payloads():
+    rng = random.Random(3)
+    context = json.dumps(synthetic_context(30, rng), ensure_ascii=False)
+    broken = "\n".join(
+        f"layer_{i} = get_layer_safe('도로_{i}')\nresult_{i} = processing.run('native:buffer', "
+        f"{{'INPUT': layer_{i}, 'DISTANCE': {i}, 'OUTPUT': 'memory:'}})"
+        for i in range(250)
+    )
+    base = {"api_key": "x" * 32, "user_input": "선택한 필지를 50m 버퍼", "model": "gemini-3-flash-preview",
+            "version": "QueryGIS-Plugin/1.5"}
+    return {
+        "chat": dict(base, mode="instruction_only", context=context),
+        "tool_followup": dict(base, mode="tool_followup", context=context, tool_data={"context": context}),
+        "fix_code": dict(base, broken_code=broken, error_message="NameError: name 'layer_3' is not defined",
+                         context=context[:4000]),
+    }
+
+
+def codecs():
+    out = [("gzip-1", lambda b: gzip.compress(b, compresslevel=1)),
+           ("gzip-6", lambda b: gzip.compress(b, compresslevel=6)),
+           ("gzip-9", lambda b: gzip.compress(b, compresslevel=9))]
+    if zstandard is not None:
+        out.append(("zstd-3", zstandard.ZstdCompressor(level=3).compress))
+    return out
+
+
+def best_ms(fn, body, repeat=10):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(body)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payloads", nargs="*", default=[])
+    args = parser.parse_args()
+
+    paths = [p for pattern in args.payloads for p in glob.glob(pattern)]
+    if paths:
+        payloads = {p: json.load(open(p, encoding="utf-8")) for p in paths}
+    else:
+        payloads = synthetic_payloads()
+
+    print(f"{'payload':>16} {'raw KiB':>8}  " + "  ".join(f"{name:>16}" for name, _ in codecs()))
+    for name, payload in payloads.items():
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        cells = []
+        for _, fn in codecs():
+            size = len(fn(body))
+            cells.append(f"{size / 1024.0:6.1f}K {best_ms(fn, body):6.2f}ms")
+        print(f"{name[-16:]:>16} {len(body) / 1024.0:8.1f}  " + "  ".join(f"{c:>16}" for c in cells))
+
+    plugin = load_plugin_module()
+    print()
+    for label, codings in (("identity server", ()), ("gzip server", ("gzip",))):
+        pool = plugin.HttpSessionPool()
+        with StubServer(request_codings=codings) as server:
+            # First request learns the server's codings; measure the ones after it
+            pool.post_json(server.url + "/chat", {"hello": True}, timeout=10)
+            server.reset()
+            for payload in payloads.values():
+                pool.post_json(server.url + "/chat", payload, timeout=10)
+            stats = server.stats
+        pool.close_all()
+        print(f"{label:>16}: {stats['bytes_in'] / 1024.0:8.1f} KiB on the wire for {stats['requests']} requests")
+
+
+if __name__ == "__main__":
+    main()
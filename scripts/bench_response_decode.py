@@ -0,0 +1,99 @@
+# coding=utf-8
+"""Cost of handing a /chat response from BackendWorker to handle_response.
+
+Before: resp.json() -> json.dumps() for the str signal -> json.loads() in
+handle_response -> json.loads() again in _parse_backend_response.
+Now: resp.json() once; the dict travels through pyqtSignal(object).
+
+Pass recorded response bodies (one JSON document per file) with
+``--responses``; without them, synthetic responses shaped like the
+backend's (answer text, token_count, and a large prompt_full) are used.
+
+    python scripts/bench_response_decode.py [--responses dumps/*.json] [--prompt-kb 200]
+"""
+
+import argparse
+import glob
+import json
+import tracemalloc
+import types
+
+from bench_common import load_plugin_module, timed
+
+
+def synthetic_bodies(prompt_kb):
+    prompt = ("레이어 context / layer context " * 64 + "\n") * max(1, prompt_kb * 1024 // 2100)
+    answer = "Here is the code.\n\n```python\nlayer = get_layer_safe('roads')\nprint(layer.featureCount())\n```\n"
+    bodies = []
+    for i in range(10):
+        data = {
+            "response": answer,
+            "token_count": 1200 + i,
+            "mode": "instruction_only",
+            "cache_used": bool(i % 2),
+            "prompt_full": prompt,
+        }
+        bodies.append(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    return bodies
+
+
+def old_path(body, parse):
+    data = json.loads(body)                              # BackendWorker: resp.json()
+    text = json.dumps(data, ensure_ascii=False)          # emitted as str
+    meta = json.loads(text)                              # handle_response
+    reparsed = json.loads(text)                          # _parse_backend_response
+    return meta.get("token_count"), parse(reparsed)
+
+
+def new_path(body, parse):
+    data = json.loads(body)                              # BackendWorker: resp.json(), emitted as object
+    return data.get("token_count"), parse(data)
+
+
+def peak_kib(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--responses", nargs="*", default=[])
+    parser.add_argument("--prompt-kb", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    plugin = load_plugin_module()
+    # _parse_backend_response only needs _extract_code_blocks from the instance
+    owner = types.SimpleNamespace()
+    owner._extract_code_blocks = lambda text: plugin.QueryGIS._extract_code_blocks(owner, text)
+
+    def parse(data):
+        return plugin.QueryGIS._parse_backend_response(owner, data)
+
+    paths = [p for pattern in args.responses for p in glob.glob(pattern)]
+    bodies = [open(p, "rb").read() for p in paths] if paths else synthetic_bodies(args.prompt_kb)
+    total_kib = sum(len(b) for b in bodies) / 1024.0
+
+    for body in bodies:
+        assert old_path(body, parse) == new_path(body, parse)
+
+    def run_all(path):
+        return lambda: [path(body, parse) for body in bodies]
+
+    old_t = timed(run_all(old_path), repeat=args.repeat)
+    new_t = timed(run_all(new_path), repeat=args.repeat)
+    old_peak = peak_kib(run_all(old_path))
+    new_peak = peak_kib(run_all(new_path))
+
+    source = f"{len(paths)} recorded" if paths else f"{len(bodies)} synthetic"
+    print(f"{source} responses, {total_kib:.0f} KiB total")
+    print(f"  decode+encode+decode+decode: {old_t * 1000:8.2f} ms, peak {old_peak:8.0f} KiB")
+    print(f"  decode once (object signal): {new_t * 1000:8.2f} ms, peak {new_peak:8.0f} KiB")
+    print(f"  speedup x{old_t / new_t:.2f}")
+
+
+if __name__ == "__main__":
+    main()
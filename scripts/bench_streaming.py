@@ -0,0 +1,100 @@
+# coding=utf-8
+"""Time to first visible text: buffered /chat JSON vs. server-sent events.
+
+The stub backend produces the same answer either way, one token every
+``--token-ms`` milliseconds. The buffered route only replies once the whole
+answer exists (what the plugin waited for before); the SSE route flushes
+each token as an event followed by a ``final`` event with the metadata.
+
+    python scripts/bench_streaming.py [--tokens 200] [--token-ms 20]
+"""
+
+import argparse
+import json
+import time
+
+from bench_common import StubServer, load_plugin_module
+
+ANSWER_HEAD = "Buffering the roads layer by 100 m.\n\n```python\n"
+ANSWER_CODE = "layer = get_layer_safe('roads')\n"
+ANSWER_TAIL = "```\n"
+
+
+def answer_tokens(count):
+    body = ANSWER_HEAD + ANSWER_CODE * max(1, count // 8) + ANSWER_TAIL
+    step = max(1, len(body) // count)
+    return [body[i:i + step] for i in range(0, len(body), step)]
+
+
+def buffered_route(tokens, delay):
+    def route(handler, body):
+        time.sleep(delay * len(tokens))
+        payload = {"response": "".join(tokens), "token_count": len(tokens), "mode": "instruction_only"}
+        return 200, {"Content-Type": "application/json"}, json.dumps(payload).encode("utf-8")
+    return route
+
+
+def sse_route(tokens, delay):
+    def events():
+        for tok in tokens:
+            time.sleep(delay)
+            yield f"data: {json.dumps({'text': tok})}\n\n".encode("utf-8")
+        final = {"token_count": len(tokens), "mode": "instruction_only"}
+        yield f"event: final\ndata: {json.dumps(final)}\n\n".encode("utf-8")
+
+    def route(handler, body):
+        if "text/event-stream" not in (handler.headers.get("Accept") or ""):
+            return buffered_route(tokens, delay)(handler, body)
+        return 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}, events()
+    return route
+
+
+def run_worker(plugin, url, stream):
+    # run() is called directly: signals are delivered synchronously on this thread
+    worker = plugin.BackendWorker({"user_input": "buffer roads"}, backend_url=url, timeout_sec=60, stream=stream)
+    marks = {"start": time.perf_counter(), "first": None, "done": None, "tokens": 0, "data": None}
+
+    def on_token(text):
+        marks["tokens"] += 1
+        if marks["first"] is None:
+            marks["first"] = time.perf_counter()
+
+    def on_finished(data):
+        marks["done"] = time.perf_counter()
+        marks["data"] = data
+        if marks["first"] is None:
+            marks["first"] = marks["done"]
+
+    worker.token.connect(on_token)
+    worker.finished.connect(on_finished)
+    worker.error.connect(lambda msg: print("error:", msg))
+    worker.run()
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    plugin = load_plugin_module()
+    tokens = answer_tokens(args.tokens)
+    delay = args.token_ms / 1000.0
+    routes = {"/buffered": buffered_route(tokens, delay), "/sse": sse_route(tokens, delay)}
+    with StubServer(routes=routes) as server:
+        results = {
+            "buffered JSON": run_worker(plugin, server.url + "/buffered", stream=False),
+            "server-sent events": run_worker(plugin, server.url + "/sse", stream=True),
+        }
+
+    expected = "".join(tokens)
+    for label, m in results.items():
+        same = isinstance(m["data"], dict) and m["data"].get("response") == expected
+        print(f"{label:>20}: first text {(m['first'] - m['start']) * 1000:7.1f} ms, "
+              f"complete {(m['done'] - m['start']) * 1000:7.1f} ms, "
+              f"{m['tokens']} token signals, same answer: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# coding=utf-8
+"""Local stand-in for the /chat context delta protocol, plus an upload-size benchmark.
+
+The stand-in keeps, per ``context_version.session``, the layer entries of the
+latest acknowledged request keyed by their hash. ``{"ref": <hash>}`` entries
+are resolved from that store; an unknown ref answers ``context_resync`` and
+the client resends everything. Successful requests answer ``context_ack``.
+
+    python scripts/stub_context_backend.py [--layers 30] [--queries 10] [--forget-every 0]
+"""
+
+import argparse
+import json
+import random
+
+import requests
+
+from bench_common import StubServer, load_plugin_module
+
+
+class DeltaBackend:
+    def __init__(self, forget_every=0):
+        self.sessions = {}
+        self.forget_every = forget_every
+        self.requests = 0
+        self.resyncs = 0
+        self.last_context = None
+
+    def route(self, handler, body):
+        self.requests += 1
+        if self.forget_every and self.requests % self.forget_every == 0:
+            self.sessions.clear()  # e.g. backend restart or eviction
+        payload = json.loads(body)
+        ctx = json.loads(payload.get("context") or "{}")
+        version = payload.get("context_version")
+        store = self.sessions.get(version["session"], {}) if version else {}
+
+        resolved = []
+        for entry in ctx.get("layers", []):
+            if isinstance(entry, dict) and set(entry) == {"ref"}:
+                if entry["ref"] not in store:
+                    self.resyncs += 1
+                    return self._reply({"context_resync": True})
+                resolved.append(store[entry["ref"]])
+            else:
+                resolved.append(entry)
+        ctx["layers"] = resolved
+        self.last_context = ctx
+
+        reply = {"response": f"Saw {len(resolved)} layers.", "mode": payload.get("mode")}
+        if version:
+            self.sessions[version["session"]] = dict(zip(version["layer_hashes"], resolved))
+            reply["context_ack"] = version["version"]
+        return self._reply(reply)
+
+    @staticmethod
+    def _reply(data):
+        return 200, {"Content-Type": "application/json"}, json.dumps(data).encode("utf-8")
+
+
+def synthetic_context(n_layers, rng):
+    layers = []
+    for i in range(n_layers):
+        layers.append({
+            "name": f"layer_{i}",
+            "type": "vector",
+            "crs": "EPSG:5186",
+            "provider": "ogr",
+            "source": f"/data/project/layer_{i}.gpkg|layername=layer_{i}",
+            "geometry": "MultiPolygon",
+            "fields": [f"attr_{j}" for j in range(20)],
+            "feature_count": rng.randint(100, 100000),
+            "feature_samples": [{f"attr_{j}": f"value {rng.random():.6f}" for j in range(20)} for _ in range(3)],
+        })
+    return {"project": {"crs": "EPSG:5186", "title": "bench"}, "layers": layers}
+
+
+def run_session(plugin, url, ctx, queries, use_delta, rng):
+    encoder = plugin.ContextDeltaEncoder()
+    session = requests.Session()
+    full_contexts = []
+    for q in range(queries):
+        if q:
+            # A follow-up question: typically one layer changed (or a new output layer appeared)
+            victim = ctx["layers"][rng.randrange(len(ctx["layers"]))]
+            victim["feature_count"] += 1
+        context_text = json.dumps(ctx, ensure_ascii=False)
+        full_contexts.append(json.loads(context_text))
+        while True:
+            payload = {"user_input": f"question {q}", "mode": "instruction_only", "context": context_text}
+            if use_delta:
+                sent_text, version = encoder.encode(context_text)
+                payload["context"] = sent_text
+                payload["context_version"] = {k: version[k] for k in ("session", "version", "layer_hashes")}
+            reply = session.post(url, json=payload, timeout=10).json()
+            if reply.get("context_resync") and use_delta:
+                encoder.resync()
+                continue
+            if "context_ack" in reply:
+                encoder.ack(reply["context_ack"])
+            break
+    session.close()
+    return full_contexts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layers", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--forget-every", type=int, default=0)
+    args = parser.parse_args()
+
+    plugin = load_plugin_module()
+    for use_delta in (False, True):
+        backend = DeltaBackend(forget_every=args.forget_every)
+        with StubServer(default_route=backend.route) as server:
+            rng = random.Random(7)
+            contexts = run_session(plugin, server.url + "/chat", synthetic_context(args.layers, rng),
+                                   args.queries, use_delta, rng)
+            stats = server.stats
+        assert backend.last_context == contexts[-1], "backend context differs from the client's"
+        label = "delta + refs" if use_delta else "full context"
+        print(f"{label:>13}: {stats['bytes_in'] / 1024.0:8.1f} KiB uploaded over {stats['requests']} requests "
+              f"({backend.resyncs} resyncs)")
+
+
+if __name__ == "__main__":
+    main()
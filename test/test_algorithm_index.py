@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Processing algorithm index tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import unittest
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+AlgorithmEntry = query_gis.AlgorithmEntry
+AlgorithmIndex = query_gis.AlgorithmIndex
+CodeRewriter = query_gis.CodeRewriter
+correct_processing_calls = query_gis.correct_processing_calls
+
+VECTOR_PARAMS = (('INPUT', 'source'), ('DISTANCE', 'distance'), ('SEGMENTS', 'number'),
+                 ('DISSOLVE', 'boolean'), ('OUTPUT', 'sink'))
+ENTRIES = [
+    AlgorithmEntry('native:buffer', 'Buffer', '버퍼', VECTOR_PARAMS),
+    AlgorithmEntry('native:clip', 'Clip', '자르기', (('INPUT', 'source'), ('OVERLAY', 'source'),
+                                                    ('OUTPUT', 'sink'))),
+    AlgorithmEntry('native:dissolve', 'Dissolve', '디졸브', (('INPUT', 'source'), ('FIELD', 'field'),
+                                                          ('OUTPUT', 'sink'))),
+    AlgorithmEntry('native:centroids', 'Centroids', '중심점', (('INPUT', 'source'), ('OUTPUT', 'sink'))),
+    AlgorithmEntry('gdal:cliprasterbymasklayer', 'Clip raster by mask layer', '', ()),
+]
+
+
+class AlgorithmIndexTest(unittest.TestCase):
+    """Test algorithm ids and parameter keys are resolved locally."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.index = AlgorithmIndex(ENTRIES)
+
+    def test_resolve(self):
+        """Exact, case-insensitive, display-name and near-miss ids resolve."""
+        self.assertEqual(self.index.resolve('native:buffer'), 'native:buffer')
+        self.assertEqual(self.index.resolve('Native:Buffer'), 'native:buffer')
+        self.assertEqual(self.index.resolve('Dissolve'), 'native:dissolve')
+        self.assertEqual(self.index.resolve('자르기'), 'native:clip')
+        self.assertEqual(self.index.resolve('native:bufer'), 'native:buffer')
+        self.assertEqual(self.index.resolve('qgis:centroids'), 'native:centroids')
+
+    def test_unsure_ids_stay_unresolved(self):
+        """Ids close to nothing are not guessed."""
+        self.assertIsNone(self.index.resolve('native:voronoipolygons'))
+        self.assertIsNone(self.index.resolve('grass7:v.net'))
+
+    def test_suggest(self):
+        """Suggestions list the closest ids first."""
+        self.assertEqual(self.index.suggest('native:dissolv')[0], 'native:dissolve')
+        self.assertEqual(self.index.suggest('nothing:like_it'), [])
+
+    def test_correct_param(self):
+        """Parameter keys are matched exactly, by case, then by similarity."""
+        self.assertEqual(self.index.correct_param('native:buffer', 'DISTANCE'), 'DISTANCE')
+        self.assertEqual(self.index.correct_param('native:buffer', 'distance'), 'DISTANCE')
+        self.assertEqual(self.index.correct_param('native:buffer', 'DISTANSE'), 'DISTANCE')
+        self.assertIsNone(self.index.correct_param('native:buffer', 'END_CAP'))
+        self.assertIsNone(self.index.correct_param('native:unknown', 'INPUT'))
+
+    def test_correct_processing_calls(self):
+        """Literal ids and keys are rewritten in place, keeping the rest of the source."""
+        source = ("res = processing.run(\"native:bufer\", {'INPUT': 'roads', 'distance': 50,\n"
+                  "                      'OUTPUT': 'memory:'})  # 도로 버퍼\n")
+        fixed, notes = correct_processing_calls(CodeRewriter.prepare(source), self.index)
+        self.assertEqual(fixed, ("res = processing.run(\"native:buffer\", {'INPUT': 'roads', 'DISTANCE': 50,\n"
+                                 "                      'OUTPUT': 'memory:'})  # 도로 버퍼\n"))
+        self.assertEqual(notes, ['native:bufer -> native:buffer', 'native:buffer: distance -> DISTANCE'])
+
+    def test_registered_aliases_are_kept(self):
+        """Ids the registry accepts as written are not rewritten."""
+        source = "processing.run('qgis:centroids', {'INPUT': 'a', 'OUTPUT': 'memory:'})\n"
+        fixed, notes = correct_processing_calls(CodeRewriter.prepare(source), self.index,
+                                                algorithm_exists=lambda alg_id: True)
+        self.assertEqual((fixed, notes), (source, []))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(AlgorithmIndexTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
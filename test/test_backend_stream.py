@@ -0,0 +1,78 @@
+# coding=utf-8
+"""Streamed backend response tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import unittest
+from unittest import mock
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+BackendWorker = query_gis.BackendWorker
+
+
+class FakeResponse(object):
+    """A text/event-stream response made of the given lines."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.encoding = None
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False):
+        return iter(self.lines)
+
+
+class EventStreamTest(unittest.TestCase):
+    """Test server-sent events are turned into one response."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.worker = BackendWorker({'user_input': 'buffer roads'}, stream=True)
+        for name in ('finished', 'error', 'step_update', 'token'):
+            setattr(self.worker, name, mock.Mock())
+        report = mock.patch.object(query_gis, '_send_error_report')
+        self.report = report.start()
+        self.addCleanup(report.stop)
+
+    def read(self, *lines):
+        return self.worker._read_event_stream(FakeResponse(list(lines)))
+
+    def test_text_deltas_make_the_response(self):
+        """Deltas are emitted as tokens and joined when the final event has no text."""
+        final = self.read('data: {"text": "x = "}', '',
+                          'data: {"text": "1"}', '',
+                          'event: final', 'data: {"token_count": 7}', '')
+        self.assertEqual(final, {'token_count': 7, 'response': 'x = 1'})
+        self.assertEqual([c.args[0] for c in self.worker.token.emit.call_args_list], ['x = ', '1'])
+        self.assertFalse(self.worker.error.emit.called)
+
+    def test_done_marker_ends_the_stream(self):
+        """A [DONE] data line is a terminal event too."""
+        self.assertEqual(self.read('data: {"delta": "ok"}', '', 'data: [DONE]', ''), {'response': 'ok'})
+
+    def test_stream_without_final_event_is_an_error(self):
+        """Text from a stream cut off before its final event is never returned."""
+        self.assertIsNone(self.read('data: {"text": "processing.run(\\"native:buf"}', ''))
+        self.worker.error.emit.assert_called_once_with("Stream ended before final event")
+        self.assertTrue(self.report.called)
+
+    def test_error_event(self):
+        """An error event is reported and ends the stream."""
+        self.assertIsNone(self.read('event: error', 'data: {"error": "quota"}', ''))
+        self.worker.error.emit.assert_called_once_with("Server error: quota")
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(EventStreamTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,197 @@
+# coding=utf-8
+"""Generated code preparation tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import contextlib
+import io
+import sys
+import types
+import unittest
+from unittest import mock
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+CodeRewriter = query_gis.CodeRewriter
+CompiledCodeCache = query_gis.CompiledCodeCache
+
+FEEDBACK = object()
+
+
+class FakeProcessing(object):
+    """Records processing.run calls made by prepared code."""
+
+    def __init__(self):
+        self.calls = []
+        self.module = types.ModuleType('processing')
+        self.module.run = self.run
+        self.module.runAndLoadResults = self.run
+
+    def run(self, alg, parameters, *args, **kwargs):
+        self.calls.append((alg, dict(parameters), args, kwargs))
+        return {'OUTPUT': '%s:%s' % (alg, parameters.get('INPUT'))}
+
+    def execute(self, source, **scope):
+        prepared = CodeRewriter.prepare(source)
+        # What the execution scope provides besides the script's own names
+        scope.setdefault('processing_feedback', FEEDBACK)
+        scope.setdefault('__run_steps__', query_gis.run_processing_steps)
+        out = io.StringIO()
+        with mock.patch.dict(sys.modules, {'processing': self.module}), \
+                contextlib.redirect_stdout(out):
+            exec(prepared.code, scope)
+        return prepared, scope, out.getvalue()
+
+
+class CompiledCodeCacheTest(unittest.TestCase):
+    """Test prepared code is memoised per source."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.calls = []
+
+    def transform(self, source):
+        self.calls.append(source)
+        return compile(source, '<string>', 'exec')
+
+    def test_same_source_is_prepared_once(self):
+        """A repeated source is served from the cache."""
+        cache = CompiledCodeCache()
+        first = cache.prepare('x = 1', self.transform)
+        self.assertIs(cache.prepare('x = 1', self.transform), first)
+        self.assertEqual(self.calls, ['x = 1'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_source_is_evicted(self):
+        """Past max_entries the least recently used source is prepared again."""
+        cache = CompiledCodeCache(max_entries=2)
+        cache.prepare('a = 1', self.transform)
+        cache.prepare('b = 1', self.transform)
+        cache.prepare('a = 1', self.transform)
+        cache.prepare('c = 1', self.transform)
+        cache.prepare('a = 1', self.transform)
+        cache.prepare('b = 1', self.transform)
+        self.assertEqual(self.calls, ['a = 1', 'b = 1', 'c = 1', 'b = 1'])
+
+    def test_errors_are_not_cached(self):
+        """A source that fails to prepare raises every time."""
+        cache = CompiledCodeCache()
+        for _ in range(2):
+            with self.assertRaises(SyntaxError):
+                cache.prepare('x = (', self.transform)
+        self.assertEqual(len(self.calls), 2)
+
+
+class CodeRewriterTest(unittest.TestCase):
+    """Test the single AST pass over generated code."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.processing = FakeProcessing()
+
+    def test_feedback_is_injected(self):
+        """processing.run calls without feedback get the run's feedback object."""
+        prepared, _, _ = self.processing.execute(
+            "processing.run('native:buffer', {'INPUT': 'roads', 'DISTANCE': 5})")
+        self.assertEqual(prepared.algorithms, ('native:buffer',))
+        self.assertIs(self.processing.calls[0][3]['feedback'], FEEDBACK)
+
+    def test_explicit_feedback_is_kept(self):
+        """Feedback passed positionally, by keyword or through **kwargs is left alone."""
+        mine = object()
+        self.processing.execute(
+            "processing.run('native:buffer', {}, None, mine)\n"
+            "processing.run('native:buffer', {}, feedback=mine)\n"
+            "processing.run('native:buffer', {}, **{'feedback': mine})\n", mine=mine)
+        self.assertEqual(self.processing.calls[0][2], (None, mine))
+        self.assertNotIn('feedback', self.processing.calls[0][3])
+        self.assertIs(self.processing.calls[1][3]['feedback'], mine)
+        self.assertIs(self.processing.calls[2][3]['feedback'], mine)
+
+    def test_import_aliases(self):
+        """Aliased modules and imported run functions are rewritten too."""
+        prepared, _, _ = self.processing.execute(
+            "import processing as p\n"
+            "from processing import run as go\n"
+            "p.run('native:clip', {'INPUT': 'a'})\n"
+            "go('native:dissolve', {'INPUT': 'b'})\n")
+        self.assertEqual(prepared.algorithms, ('native:clip', 'native:dissolve'))
+        self.assertTrue(all(call[3]['feedback'] is FEEDBACK for call in self.processing.calls))
+
+    def test_run_calls_record_literal_spans(self):
+        """Algorithm ids and parameter keys are recorded with their source spans."""
+        source = "res = processing.run('native:buffer', {'INPUT': 'roads', 'OUTPUT': 'memory:'})"
+        run = CodeRewriter.prepare(source).runs[0]
+        self.assertEqual(run.alg, 'native:buffer')
+        line, start, _, end = run.alg_span
+        self.assertEqual(source.encode('utf-8')[start:end], b"'native:buffer'")
+        self.assertEqual([key for key, _ in run.params], ['INPUT', 'OUTPUT'])
+
+    def test_top_level_return_is_wrapped(self):
+        """A top-level return ends the script and its value is printed."""
+        prepared, _, out = self.processing.execute(
+            "x = 41\n"
+            "if x:\n"
+            "    return x + 1\n"
+            "print('not reached')\n")
+        self.assertTrue(prepared.wrapped)
+        self.assertEqual(out.strip(), '42')
+
+    def scheduled(self, source):
+        """Dependency lists passed to __run_steps__, or None when the steps stay as written."""
+        graphs = []
+
+        def run_steps(namespace, steps, deps):
+            graphs.append(deps)
+            query_gis.run_processing_steps(namespace, steps, deps)
+        self.processing.execute(source, __run_steps__=run_steps)
+        return graphs[0] if graphs else None
+
+    def test_shared_inputs_order_steps(self):
+        """A step reading the variable or path another step uses runs after it."""
+        self.assertIsNone(self.scheduled(
+            "parcels = 'parcels'\n"
+            "processing.run('native:selectbylocation', {'INPUT': parcels, 'INTERSECT': 'roads'})\n"
+            "processing.run('native:saveselectedfeatures', {'INPUT': parcels, 'OUTPUT': 'memory:'})\n"))
+        self.assertIsNone(self.scheduled(
+            "out = '/tmp/buffered.gpkg'\n"
+            "processing.run('native:buffer', {'INPUT': 'roads', 'OUTPUT': out})\n"
+            "processing.run('native:clip', {'INPUT': out, 'OVERLAY': 'parcels'})\n"))
+        self.assertIsNone(self.scheduled(
+            "processing.run('native:buffer', {'INPUT': 'roads', 'OUTPUT': 'buffered'})\n"
+            "processing.run('native:clip', {'INPUT': 'buffered', 'OVERLAY': 'parcels'})\n"))
+        self.assertEqual([call[0] for call in self.processing.calls],
+                         ['native:selectbylocation', 'native:saveselectedfeatures',
+                          'native:buffer', 'native:clip', 'native:buffer', 'native:clip'])
+
+    def test_disjoint_steps_are_scheduled(self):
+        """Steps sharing nothing but the module and temporary outputs may run side by side."""
+        deps = self.scheduled(
+            "a = processing.run('native:buffer', {'INPUT': 'roads', 'OUTPUT': 'memory:'})\n"
+            "b = processing.run('native:centroids', {'INPUT': 'parcels', 'OUTPUT': 'TEMPORARY_OUTPUT'})\n"
+            "c = processing.run('native:clip', {'INPUT': a['OUTPUT'], 'OVERLAY': 'rivers'})\n")
+        self.assertEqual(deps, [[], [], [0]])
+        self.assertEqual(self.processing.calls[2][1]['INPUT'], 'native:buffer:roads')
+
+    def test_syntax_errors_propagate(self):
+        """Code that does not parse raises SyntaxError before anything runs."""
+        with self.assertRaises(SyntaxError):
+            CodeRewriter.prepare("processing.run('native:buffer', {")
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CompiledCodeCacheTest))
+    suite.addTest(unittest.makeSuite(CodeRewriterTest))
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,106 @@
+# coding=utf-8
+"""Layer context budget tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import json
+import unittest
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+ContextBudgeter = query_gis.ContextBudgeter
+
+
+def make_layer(name, n_fields=20, samples=5):
+    fields = ['field_%d' % i for i in range(n_fields)]
+    return {
+        'name': name,
+        'type': 'vector',
+        'geometry': 'Polygon',
+        'crs': 'EPSG:5186',
+        'provider': 'ogr',
+        'source': '/data/%s.gpkg|layername=%s' % (name, name),
+        'feature_count': 1000,
+        'metadata': {'title': name, 'abstract': 'x' * 200, 'keywords': []},
+        'fields': fields,
+        'field_stats': {f: {'type': 'String', 'samples': ['a', 'b', 'c'],
+                            'distinct': 3, 'null_ratio': 0.0} for f in fields},
+        'feature_samples': [{f: 'value' for f in fields} for _ in range(samples)],
+    }
+
+
+def make_context(names):
+    return {'project': {'crs': 'EPSG:5186'}, 'layers': [make_layer(n) for n in names]}
+
+
+def size(ctx):
+    return len(json.dumps(ctx, ensure_ascii=False, default=str))
+
+
+class ContextBudgeterTest(unittest.TestCase):
+    """Test the layer context is fitted into its budget."""
+
+    def test_fitting_context_is_unchanged(self):
+        """A context under the budget is returned as is."""
+        ctx = make_context(['roads', 'parcels'])
+        fitted, report = ContextBudgeter(max_tokens=10 ** 6).fit(ctx)
+        self.assertEqual(fitted, ctx)
+        self.assertEqual(report['layers'], {})
+        self.assertEqual(report['dropped_layers'], [])
+
+    def test_least_relevant_layers_degrade_first(self):
+        """Layers that are neither selected nor named lose their samples first."""
+        ctx = make_context(['roads', 'parcels', 'rivers'])
+        budget = ContextBudgeter.estimate_tokens(size(ctx)) - 50
+        fitted, report = ContextBudgeter(max_tokens=budget).fit(
+            ctx, selected_names=['roads'], query='clip parcels')
+        self.assertEqual(report['layers'], {'rivers': 'no_samples'})
+        by_name = {li['name']: li for li in fitted['layers']}
+        self.assertIn('feature_samples', by_name['roads'])
+        self.assertIn('feature_samples', by_name['parcels'])
+        self.assertNotIn('feature_samples', by_name['rivers'])
+        self.assertLessEqual(report['after']['tokens'], budget)
+
+    def test_selected_layers_are_never_dropped(self):
+        """Under a tiny budget only the selected layer's identity survives."""
+        ctx = make_context(['roads', 'parcels', 'rivers'])
+        fitted, report = ContextBudgeter(max_tokens=1).fit(ctx, selected_names=['roads'])
+        self.assertEqual([li['name'] for li in fitted['layers']], ['roads'])
+        self.assertEqual(sorted(report['dropped_layers']), ['parcels', 'rivers'])
+        self.assertEqual(report['layers'], {'roads': 'identity_only'})
+        self.assertEqual(set(fitted['layers'][0]), set(ContextBudgeter.IDENTITY_KEYS) & set(make_layer('x')))
+
+    def test_byte_budget(self):
+        """A byte budget counts UTF-8 bytes, not characters."""
+        ctx = {'project': {}, 'layers': [make_layer('도로'), make_layer('건물')]}
+        limit = len(json.dumps(ctx, ensure_ascii=False).encode('utf-8')) - 10
+        fitted, report = ContextBudgeter(max_bytes=limit).fit(ctx)
+        self.assertLessEqual(report['after']['bytes'], limit)
+        self.assertEqual(report['layers'], {'건물': 'no_samples'})
+
+    def test_short_source_masks_credentials(self):
+        """Secrets in data source URIs are masked and long URIs are cut."""
+        budgeter = ContextBudgeter()
+        source = budgeter.short_source(
+            "dbname='gis' host=db user=admin password='s3cret' table=\"public\".\"roads\"")
+        self.assertNotIn('admin', source)
+        self.assertNotIn('s3cret', source)
+        self.assertIn('password=***', source)
+        long_source = budgeter.short_source('/data/' + 'a' * 500)
+        self.assertEqual(len(long_source), query_gis.CONTEXT_SOURCE_MAX_CHARS + 3)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ContextBudgeterTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
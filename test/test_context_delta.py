@@ -0,0 +1,95 @@
+# coding=utf-8
+"""Layer context delta encoding tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import json
+import unittest
+
+from utilities import get_plugin_module
+
+ContextDeltaEncoder = get_plugin_module().ContextDeltaEncoder
+
+
+def context_text(*layers):
+    return json.dumps({'project': {'crs': 'EPSG:4326'}, 'layers': list(layers)})
+
+
+ROADS = {'name': 'roads', 'fields': ['id', 'type']}
+PARCELS = {'name': 'parcels', 'fields': ['pnu']}
+
+
+class ContextDeltaEncoderTest(unittest.TestCase):
+    """Test unchanged layer entries are sent as references."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.encoder = ContextDeltaEncoder()
+
+    def test_full_until_acknowledged(self):
+        """Entries are sent in full until the backend acknowledges them."""
+        text = context_text(ROADS, PARCELS)
+        encoded, info = self.encoder.encode(text)
+        self.assertEqual(encoded, text)
+        self.assertEqual(info['refs'], 0)
+        encoded, info = self.encoder.encode(text)
+        self.assertEqual(encoded, text)
+        self.assertEqual(info['version'], 2)
+
+    def test_acknowledged_entries_become_references(self):
+        """After an ack, unchanged entries are references and changed ones stay in full."""
+        _, info = self.encoder.encode(context_text(ROADS, PARCELS))
+        self.encoder.ack(info['version'])
+        changed = dict(PARCELS, fields=['pnu', 'area'])
+        encoded, info = self.encoder.encode(context_text(ROADS, changed))
+        layers = json.loads(encoded)['layers']
+        self.assertEqual(layers[0], {'ref': ContextDeltaEncoder.entry_hash(ROADS)})
+        self.assertEqual(layers[1], changed)
+        self.assertEqual(info['refs'], 1)
+
+    def test_stale_and_unknown_acks_are_ignored(self):
+        """Acks for unknown or already superseded versions change nothing."""
+        _, first = self.encoder.encode(context_text(ROADS))
+        _, second = self.encoder.encode(context_text(PARCELS))
+        self.encoder.ack(second['version'])
+        self.encoder.ack(first['version'])
+        self.encoder.ack('not a version')
+        encoded, info = self.encoder.encode(context_text(ROADS, PARCELS))
+        layers = json.loads(encoded)['layers']
+        self.assertEqual(layers[0], ROADS)
+        self.assertEqual(layers[1], {'ref': ContextDeltaEncoder.entry_hash(PARCELS)})
+
+    def test_resync_sends_everything_again(self):
+        """A resync drops every acknowledgement."""
+        text = context_text(ROADS, PARCELS)
+        _, info = self.encoder.encode(text)
+        self.encoder.ack(info['version'])
+        self.encoder.resync()
+        encoded, info = self.encoder.encode(text)
+        self.assertEqual(encoded, text)
+        self.assertEqual(info['refs'], 0)
+
+    def test_text_without_layers_passes_through(self):
+        """Context text without a layer list is not versioned."""
+        text = json.dumps({'project': {}})
+        self.assertEqual(self.encoder.encode(text), (text, None))
+
+    def test_hash_ignores_key_order(self):
+        """Entry hashes do not depend on key order."""
+        self.assertEqual(ContextDeltaEncoder.entry_hash({'a': 1, 'b': 2}),
+                         ContextDeltaEncoder.entry_hash({'b': 2, 'a': 1}))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ContextDeltaEncoderTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Script execution tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import unittest
+from unittest import mock
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+QueryGIS = query_gis.QueryGIS
+
+
+class FakeSettings(object):
+    """Settings holding only their defaults."""
+
+    def value(self, key, default=None, type=None):
+        return default
+
+
+class FakeThread(object):
+
+    @staticmethod
+    def idealThreadCount():
+        return 4
+
+
+class ExecutionTest(unittest.TestCase):
+    """Test how a script run is settled."""
+
+    def setUp(self):
+        """Runs before each test."""
+        plugin = QueryGIS.__new__(QueryGIS)
+        plugin.ui = None
+        plugin.iface = None
+        plugin.wave_manager = None
+        plugin.ui_bridge = mock.Mock()
+        plugin._compiled_code = query_gis.CompiledCodeCache()
+        plugin._get_algorithm_index = lambda: None
+        plugin._preflight_issues = lambda prepared, scope: ([], [])
+        plugin._active_run = None
+        plugin._last_soft_error_info = None
+        plugin._current_run_id = 'run'
+        plugin._request_attempt = 1
+        plugin._correction = {'user_input': 'buffer roads'}
+        self.fix_path = mock.Mock()
+        for name in ('_settle_execution', '_advance_attempt', '_collect_context_async',
+                     '_start_fix_worker', 'update_wave_message'):
+            setattr(plugin, name, getattr(self.fix_path, name))
+        patches = [mock.patch.object(query_gis, '_send_error_report', self.fix_path.report),
+                   mock.patch.object(query_gis, 'QSettings', FakeSettings),
+                   mock.patch.object(query_gis, 'QThread', FakeThread)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.plugin = plugin
+
+    def execute(self, code):
+        return self.plugin.execute_with_self_correction(code, {'plugin': self.plugin}, 'buffer roads', '')
+
+    def test_failure_goes_to_the_fix_path(self):
+        """A failing script is reported and a fix is requested."""
+        self.assertIsNone(self.execute("raise RuntimeError('broken')\n"))
+        self.assertTrue(self.fix_path.report.called)
+        self.assertTrue(self.fix_path._collect_context_async.called)
+
+    def test_cancelled_run_is_abandoned(self):
+        """A run cancelled by unload or closing the dock is neither reported, fixed nor retried."""
+        self.assertIsNone(self.execute(
+            "plugin._cancel_active_run()\n"
+            "raise RuntimeError('native:buffer was cancelled')\n"))
+        self.assertEqual(self.fix_path.mock_calls, [])
+        self.assertIsNone(self.plugin._active_run)
+        self.assertEqual(self.plugin._correction, {})
+        self.assertIsNone(self.plugin._current_run_id)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ExecutionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
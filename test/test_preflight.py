@@ -0,0 +1,128 @@
+# coding=utf-8
+"""Pre-flight check tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import builtins
+import unittest
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+CodeRewriter = query_gis.CodeRewriter
+preflight_issues = query_gis.preflight_issues
+
+LAYERS = ['roads', '건물', 'parcels_2024']
+KNOWN = set(dir(builtins)) | {'processing', 'processing_feedback', 'get_layer_safe',
+                              'find_layer_by_keyword', 'QgsProject', 'QgsVectorLayer', 'iface',
+                              '__run_steps__'}
+ALGORITHMS = {'native:buffer', 'native:clip'}
+
+
+def check(source, **kwargs):
+    kwargs.setdefault('algorithm_exists', ALGORITHMS.__contains__)
+    kwargs.setdefault('layer_names', LAYERS)
+    kwargs.setdefault('known_names', KNOWN)
+    return preflight_issues(CodeRewriter.prepare(source), **kwargs)
+
+
+class PreflightTest(unittest.TestCase):
+    """Test generated code is checked before it runs."""
+
+    def test_clean_script(self):
+        """A script using existing algorithms, layers and names passes."""
+        issues, warnings = check(
+            "layer = get_layer_safe('roads')\n"
+            "res = processing.run('native:buffer', {'INPUT': layer, 'OUTPUT': 'memory:'})\n"
+            "QgsProject.instance().addMapLayer(res['OUTPUT'])\n")
+        self.assertEqual((issues, warnings), ([], []))
+
+    def test_unknown_algorithm(self):
+        """Unknown algorithm ids are reported once, with suggestions."""
+        issues, _ = check(
+            "processing.run('native:bufer', {})\n"
+            "processing.run('native:bufer', {})\n",
+            suggest=lambda alg_id: ['native:buffer'])
+        self.assertEqual(issues, ["Unknown processing algorithm 'native:bufer' (did you mean native:buffer?)"])
+
+    def test_layer_names_are_matched_like_get_layer_safe(self):
+        """Extensions, substrings and keywords resolve as they do at run time."""
+        issues, warnings = check(
+            "a = get_layer_safe('roads.shp')\n"
+            "b = find_layer_by_keyword('parcels')\n"
+            "c = get_layer_safe('건물')\n")
+        self.assertEqual((issues, warnings), ([], []))
+
+    def test_missing_layer_name_is_an_issue(self):
+        """A plain name literal matching no layer is certain to fail."""
+        issues, warnings = check("layer = get_layer_safe('railways')\n")
+        self.assertEqual(issues, ["Line 1: get_layer_safe('railways') matches no layer in the project"])
+        self.assertEqual(warnings, [])
+
+    def test_paths_are_warnings(self):
+        """Literals that may be paths or provider sources are only warnings."""
+        issues, warnings = check(
+            "a = get_layer_safe('/data/rail.gpkg')\n"
+            "b = get_layer_safe('C:\\\\gis\\\\rail')\n"
+            "c = get_layer_safe('memory:rail')\n")
+        self.assertEqual(issues, [])
+        self.assertEqual(len(warnings), 3)
+
+    def test_layers_created_by_the_script_are_warnings(self):
+        """A name the script itself may create is not a certain failure."""
+        issues, warnings = check(
+            "res = processing.run('native:buffer', {'INPUT': get_layer_safe('roads'), 'OUTPUT': 'memory:river_zone'})\n"
+            "buffered = get_layer_safe('river_zone')\n"
+            "v = QgsVectorLayer('Point?crs=EPSG:4326', 'wells', 'memory')\n"
+            "wells = get_layer_safe('wells')\n")
+        self.assertEqual(issues, [])
+        self.assertEqual(len(warnings), 2)
+
+    def test_lookups_after_loading_layers_are_warnings(self):
+        """After a call that adds layers, any lookup may find the script's own output."""
+        issues, warnings = check(
+            "QgsProject.instance().addMapLayer(x)\n"
+            "y = get_layer_safe('output')\n",
+            known_names=None)
+        self.assertEqual(issues, [])
+        self.assertEqual(warnings, ["Line 2: get_layer_safe('output') matches no layer in the project"])
+
+    def test_runtime_names_are_not_checked(self):
+        """Only literal layer names are looked at."""
+        issues, warnings = check(
+            "for name in ['a', 'b']:\n"
+            "    get_layer_safe(name)\n")
+        self.assertEqual((issues, warnings), ([], []))
+
+    def test_undefined_names(self):
+        """Names bound nowhere in the script or the scope are reported."""
+        issues, _ = check("print(result_layer.name())\n")
+        self.assertEqual(issues, ["Line 1: name 'result_layer' is not defined"])
+        issues, _ = check(
+            "try:\n"
+            "    print(result_layer)\n"
+            "except NameError:\n"
+            "    pass\n")
+        self.assertEqual(issues, [])
+
+    def test_skipped_checks(self):
+        """A check whose input is None is skipped."""
+        issues, warnings = preflight_issues(CodeRewriter.prepare(
+            "processing.run('x:y', {'INPUT': get_layer_safe('railways')})\n"
+            "print(undefined_name)\n"))
+        self.assertEqual((issues, warnings), ([], []))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PreflightTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
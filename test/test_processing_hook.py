@@ -0,0 +1,179 @@
+# coding=utf-8
+"""processing.run hook tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import io
+import sys
+import types
+import unittest
+from unittest import mock
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+ProcessingRunHook = query_gis.ProcessingRunHook
+
+FEEDBACK = object()
+
+
+def run(algOrName, parameters, onFinish=None, feedback=None, context=None, is_child_algorithm=False):
+    return feedback, is_child_algorithm
+
+
+class FakeRun(object):
+    """Stands in for the _RunProgressProxy of an active execution."""
+
+    checkpoints = None
+    background = False
+
+    def __init__(self):
+        self.events = []
+
+    def default_feedback(self):
+        return FEEDBACK
+
+    def started(self):
+        self.events.append('started')
+
+    def finished(self, ok):
+        self.events.append(ok)
+
+
+class FakeLoop(object):
+    """A nested event loop that records what a callback would see while it spins."""
+
+    def __init__(self, during=None):
+        self.during = during
+        self.seen = None
+        self.quits = 0
+
+    def exec_(self):
+        self.seen = (query_gis._ACTIVE_RUN.get(), sys.stdout)
+        if self.during is not None:
+            self.during()
+
+    def quit(self):
+        self.quits += 1
+
+
+class FakeTask(object):
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ProcessingRunHookTest(unittest.TestCase):
+    """Test the session-wide processing.run hook."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.module = types.ModuleType('processing')
+        self.module.run = run
+        self.hook = ProcessingRunHook()
+        self.hook.install(self.module)
+        self.proxy = FakeRun()
+        self.token = query_gis._ACTIVE_RUN.set(self.proxy)
+
+    def tearDown(self):
+        """Runs after each test."""
+        query_gis._ACTIVE_RUN.reset(self.token)
+        self.hook.uninstall()
+
+    def test_install_is_idempotent(self):
+        """Installing twice, or from a second hook, wraps the original once."""
+        hooked = self.module.run
+        self.assertTrue(self.hook.install(self.module))
+        self.assertIs(self.module.run, hooked)
+        other = ProcessingRunHook()
+        other.install(self.module)
+        self.assertTrue(other.hooks(self.module.run))
+        other.uninstall()
+        self.assertIs(self.module.run, run)
+
+    def test_uninstall_restores_original(self):
+        """Unload puts the original function back."""
+        self.hook.uninstall()
+        self.assertIs(self.module.run, run)
+
+    def test_calls_outside_a_run_pass_through(self):
+        """Without an active run nothing is injected."""
+        query_gis._ACTIVE_RUN.reset(self.token)
+        self.token = query_gis._ACTIVE_RUN.set(None)
+        self.assertEqual(self.module.run('native:buffer', {}), (None, False))
+
+    def test_defaults_are_injected(self):
+        """Feedback and is_child_algorithm are filled in when not given."""
+        self.assertEqual(self.module.run('native:buffer', {}), (FEEDBACK, False))
+        self.assertEqual(self.proxy.events, ['started', True])
+
+    def test_positional_arguments_are_respected(self):
+        """Arguments passed positionally are never passed again by keyword."""
+        mine = object()
+        self.assertEqual(self.module.run('native:buffer', {}, None, mine, None, True), (mine, True))
+        self.assertEqual(self.module.run('native:buffer', {}, None, None, None, True), (None, True))
+        self.assertEqual(self.module.run('native:buffer', {}, is_child_algorithm=True), (FEEDBACK, True))
+
+    def test_waiting_run_is_not_active(self):
+        """While a run waits in a nested loop, other code sees no run and the real stdout."""
+        real, redirected = io.StringIO(), io.StringIO()
+        run_proxy = query_gis._RunProgressProxy(None, stdout=real)
+        token = query_gis._ACTIVE_RUN.set(run_proxy)
+        original_stdout = sys.stdout
+        sys.stdout = redirected
+        try:
+            loop = FakeLoop()
+            run_proxy.wait(loop)
+            self.assertEqual(loop.seen, (None, real))
+            self.assertIs(query_gis._ACTIVE_RUN.get(), run_proxy)
+            self.assertIs(sys.stdout, redirected)
+        finally:
+            sys.stdout = original_stdout
+            query_gis._ACTIVE_RUN.reset(token)
+
+    def test_cancel_leaves_the_loop(self):
+        """Cancelling cancels tracked tasks and quits the loop being waited in."""
+        run_proxy = query_gis._RunProgressProxy(None)
+        task = FakeTask()
+        run_proxy.track(task)
+        loop = FakeLoop(during=run_proxy.cancel)
+        run_proxy.wait(loop)
+        self.assertTrue(run_proxy.cancelled)
+        self.assertTrue(task.cancelled)
+        self.assertEqual(loop.quits, 1)
+        later = FakeLoop()
+        run_proxy.wait(later)
+        self.assertIsNone(later.seen)
+
+    def test_step_feedback_forwards_to_the_shared_feedback(self):
+        """A parallel step reports its own progress and passes messages and cancellation on."""
+        shared = mock.Mock()
+        shared.isCanceled.return_value = False
+        seen = []
+        step = query_gis._StepFeedback(shared, seen.append)
+        self.assertEqual(shared.canceled.connect.call_count, 1)
+        step.setProgress(40)
+        step.pushInfo('Buffering')
+        step.reportError('Invalid geometry', False)
+        self.assertEqual(seen, [40])
+        self.assertFalse(shared.setProgress.called)
+        shared.pushInfo.assert_called_once_with('Buffering')
+        shared.reportError.assert_called_once_with('Invalid geometry', False)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProcessingRunHookTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
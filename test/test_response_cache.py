@@ -0,0 +1,116 @@
+# coding=utf-8
+"""Local /chat response cache tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from utilities import get_plugin_module
+
+ResponseCache = get_plugin_module().ResponseCache
+
+FINGERPRINT = [['roads', 'vector', 'LineString', 'EPSG:5186', ['id', 'type']]]
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Test final /chat responses are cached by query and project structure."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResponseCache(os.path.join(self.directory, 'responses.sqlite'), max_entries=3)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.cache.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_key_normalises_query(self):
+        """Case, width, spacing and trailing punctuation do not change the key."""
+        key = ResponseCache.make_key('Buffer  roads by 50m.', FINGERPRINT, 'model')
+        self.assertEqual(key, ResponseCache.make_key('buffer roads by ５０m', FINGERPRINT, 'model'))
+        self.assertNotEqual(key, ResponseCache.make_key('buffer roads by 50m', FINGERPRINT, 'other'))
+        self.assertNotEqual(key, ResponseCache.make_key('buffer roads by 50m', [], 'model'))
+
+    def test_nocache_directive(self):
+        """#nocache opts out and is stripped before the query is sent."""
+        self.assertTrue(ResponseCache.opted_out('count roads #nocache'))
+        self.assertFalse(ResponseCache.opted_out('count roads'))
+        self.assertEqual(ResponseCache.strip_directives('count roads #NoCache'), 'count roads')
+
+    def test_put_get_and_stats(self):
+        """Stored responses come back and hits and misses are counted."""
+        self.assertIsNone(self.cache.get('k'))
+        self.cache.put('k', {'output': {'text': 'print(1)'}})
+        self.assertEqual(self.cache.get('k'), {'output': {'text': 'print(1)'}})
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Past max_entries the least recently used entry goes first."""
+        for key in ('a', 'b', 'c'):
+            self.cache.put(key, key)
+            time.sleep(0.01)
+        self.cache.get('a')
+        time.sleep(0.01)
+        self.cache.put('d', 'd')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(self.cache.get('d'), 'd')
+
+    def test_expired_entries_are_misses(self):
+        """Entries older than the TTL are removed on lookup."""
+        self.cache.ttl_sec = 0
+        self.cache.put('k', 'v')
+        time.sleep(0.01)
+        self.assertIsNone(self.cache.get('k'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_unverified_entries_are_not_run(self):
+        """Answers whose code never ran are served only to lookups that will not run it."""
+        self.cache.put('k', 'v', verified=False)
+        self.assertIsNone(self.cache.get('k', verified_only=True))
+        self.assertEqual(self.cache.get('k'), 'v')
+        self.cache.put('k', 'v')
+        self.assertEqual(self.cache.get('k', verified_only=True), 'v')
+
+    def test_entries_from_before_verification_are_unverified(self):
+        """A cache written without the verified flag is upgraded and its entries are unverified."""
+        self.cache.close()
+        path = os.path.join(self.directory, 'old.sqlite')
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                   "created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)")
+        db.execute("INSERT INTO responses VALUES ('k', '\"v\"', ?, ?, 0)", (time.time(), time.time()))
+        db.commit()
+        db.close()
+        self.cache = ResponseCache(path)
+        self.assertIsNone(self.cache.get('k', verified_only=True))
+        self.assertEqual(self.cache.get('k'), 'v')
+
+    def test_discard(self):
+        """A discarded response is gone and counted as a failure eviction."""
+        self.cache.put('k', 'v')
+        self.cache.discard('k')
+        self.assertIsNone(self.cache.get('k'))
+        self.assertEqual(self.cache.stats()['evicted_failures'], 1)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ResponseCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,194 @@
+# coding=utf-8
+"""Processing step checkpoint tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+StepCheckpointStore = query_gis.StepCheckpointStore
+
+
+class FakeDefinition(object):
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class FakeAlgorithm(query_gis.QgsProcessingAlgorithm):
+    """An algorithm with the given id and destination parameters."""
+
+    def __init__(self, alg_id, destinations):
+        super().__init__()
+        self._id = alg_id
+        self._destinations = destinations
+
+    def id(self):
+        return self._id
+
+    def destinationParameterDefinitions(self):
+        return [FakeDefinition(name) for name in self._destinations]
+
+
+class FakeProject(object):
+    """A project without layers."""
+
+    @classmethod
+    def instance(cls):
+        return cls()
+
+    def mapLayer(self, layer_id):
+        return None
+
+    def mapLayersByName(self, name):
+        return []
+
+    def mapLayers(self):
+        return {}
+
+
+class FakeRegistry(object):
+
+    def __init__(self, algorithms):
+        self._algorithms = {alg.id(): alg for alg in algorithms}
+
+    def algorithmById(self, alg_id):
+        return self._algorithms.get(alg_id)
+
+
+class FakeLayer(query_gis.QgsVectorLayer):
+    """A vector layer output with a fixed id."""
+
+    def __init__(self, layer_id):
+        super().__init__()
+        self._id = layer_id
+
+    def id(self):
+        return self._id
+
+    def name(self):
+        return 'Buffered'
+
+    def source(self):
+        return 'memory'
+
+
+BUFFER = FakeAlgorithm('native:buffer', ['OUTPUT'])
+SELECT = FakeAlgorithm('native:selectbylocation', [])
+
+
+class StepCheckpointStoreTest(unittest.TestCase):
+    """Test checkpoint keys stay stable across fix rounds and unsafe steps are not replayed."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        patches = [mock.patch.object(query_gis, 'QgsProject', FakeProject),
+                   mock.patch.object(query_gis.QgsApplication, 'processingRegistry',
+                                     lambda: FakeRegistry([BUFFER, SELECT]))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.store = StepCheckpointStore(os.path.join(self.directory, 'checkpoints'))
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        return path
+
+    def key(self, output, alg='native:buffer', **inputs):
+        parameters = dict({'INPUT': 'roads', 'DISTANCE': 50}, **inputs)
+        if output is not None:
+            parameters['OUTPUT'] = output
+        return self.store.key_for({'algOrName': alg, 'parameters': parameters})
+
+    def test_destinations_do_not_change_the_key(self):
+        """Renaming or moving an output, even onto an existing file, keeps the key."""
+        digests = {self.key(output).digest for output in
+                   ('memory:', 'memory:buffered', 'TEMPORARY_OUTPUT', self.path('round1.gpkg'),
+                    self.path('round2.gpkg'), None)}
+        self.assertEqual(len(digests), 1)
+        self.assertEqual(self.key('memory:buffered').destinations, {'OUTPUT': 'memory:buffered'})
+
+    def test_inputs_change_the_key(self):
+        """Different inputs or algorithm instances are different steps."""
+        self.assertNotEqual(self.key('memory:').digest, self.key('memory:', DISTANCE=100).digest)
+        instance = self.store.key_for({'algOrName': BUFFER, 'parameters': {'INPUT': 'roads', 'DISTANCE': 50}})
+        self.assertEqual(instance.digest, self.key('memory:').digest)
+
+    def test_unsafe_steps_have_no_key(self):
+        """Steps without destinations, unknown algorithms and callbacks are not checkpointed."""
+        self.assertIsNone(self.key(None, alg='native:selectbylocation'))
+        self.assertIsNone(self.key('memory:', alg='native:nothing'))
+        self.assertIsNone(self.store.key_for({'algOrName': 'native:buffer', 'parameters': {},
+                                              'onFinish': print}))
+
+    def test_values_replay_under_a_new_destination(self):
+        """A result saved in one round is found by the next round's key."""
+        self.store.save(self.key('memory:a'), {'COUNT': 3})
+        self.assertEqual(self.store.load(self.key('memory:b')), {'COUNT': 3})
+        self.assertEqual(self.store.hits, 1)
+
+    def test_file_outputs_replay_only_to_the_same_path(self):
+        """A file output is not handed back for a round writing to another path."""
+        first = self.path('first.gpkg')
+        self.store.save(self.key(first), {'OUTPUT': first})
+        self.assertIsNone(self.store.load(self.key(os.path.join(self.directory, 'second.gpkg'))))
+        self.assertEqual(self.store.load(self.key(first)), {'OUTPUT': first})
+
+    def test_saving_again_keeps_files_in_use(self):
+        """A second save of a step never overwrites the file an earlier layer reads from."""
+        writes = []
+
+        def write_gpkg(layer, path):
+            writes.append(path)
+            with open(path, 'w') as f:
+                f.write(layer.id())
+            return True
+        self.store._write_gpkg = write_gpkg
+        os.makedirs(self.store.directory)
+        key = self.key('memory:')
+        self.store.save(key, {'OUTPUT': FakeLayer('first')})
+        in_use = self.store._entries[key.digest]['OUTPUT'][1]
+        self.store.save(key, {'OUTPUT': FakeLayer('second')})
+        latest = self.store._entries[key.digest]['OUTPUT'][1]
+        self.assertEqual(writes, [in_use, latest])
+        self.assertNotEqual(in_use, latest)
+        with open(in_use) as f:
+            self.assertEqual(f.read(), 'first')
+
+    def test_outputs_aliasing_inputs_are_not_saved(self):
+        """A step returning one of its inputs is not replayed."""
+        source = self.path('roads.gpkg')
+        key = self.key('memory:', INPUT=source + '|layername=roads')
+        self.store.save(key, {'OUTPUT': source})
+        self.assertIsNone(self.store.load(key))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(StepCheckpointStoreTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,134 @@
+# coding=utf-8
+"""Verified code library tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'juseonglee99@3dlabs.co.kr'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, 3DLabs, Juseong Lee'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from utilities import get_plugin_module
+
+query_gis = get_plugin_module()
+TfidfIndex = query_gis.TfidfIndex
+VerifiedCodeLibrary = query_gis.VerifiedCodeLibrary
+
+BUFFER_CODE = "processing.run('native:buffer', {'INPUT': 'roads', 'DISTANCE': 50, 'OUTPUT': 'memory:'})"
+
+
+def accept(entry):
+    return True
+
+
+class TfidfIndexTest(unittest.TestCase):
+    """Test the query similarity index."""
+
+    def test_tokens(self):
+        """Numbers split from units; longer Korean words become bigrams."""
+        self.assertEqual(TfidfIndex.tokens('Buffer 50m'), ['buffer', '50', 'm'])
+        self.assertEqual(TfidfIndex.tokens('필지를'), ['~필지', '~지를'])
+
+    def test_search_ranks_similar_text_first(self):
+        """The closest document ranks first and an exact match scores 1."""
+        index = TfidfIndex()
+        index.add(1, 'buffer roads by 50 m')
+        index.add(2, 'count buildings in each parcel')
+        results = index.search('buffer roads by 50 m')
+        self.assertEqual(results[0][0], 1)
+        self.assertAlmostEqual(results[0][1], 1.0)
+        self.assertEqual([d for d, _ in results], [1])
+
+    def test_korean_particles_share_weight(self):
+        """Queries differing only in particles still match."""
+        index = TfidfIndex()
+        index.add(1, '필지를 도로로 자르기')
+        index.add(2, '건물 개수 세기')
+        doc_id, score = index.search('필지에 도로로 자르기')[0]
+        self.assertEqual(doc_id, 1)
+        self.assertGreater(score, 0.5)
+
+    def test_remove(self):
+        """Removed documents are no longer found."""
+        index = TfidfIndex()
+        index.add(1, 'buffer roads')
+        index.add(1, 'clip parcels')
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.search('buffer roads'), [])
+        index.remove(1)
+        self.assertEqual(index.search('clip parcels'), [])
+        self.assertEqual(len(index), 0)
+
+
+class VerifiedCodeLibraryTest(unittest.TestCase):
+    """Test code that ran successfully is stored and matched."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'verified.sqlite')
+        self.library = VerifiedCodeLibrary(self.path, max_entries=2)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.library.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_match_needs_same_numbers(self):
+        """A 50 m buffer is never offered for a 100 m request."""
+        self.library.record('buffer roads by 50m', BUFFER_CODE, 1.5, {}, [])
+        entry = self.library.best_match('Buffer roads by 50m.', accept)
+        self.assertEqual(entry['code'], BUFFER_CODE)
+        self.assertIsNone(self.library.best_match('buffer roads by 100m', accept))
+
+    def test_incompatible_entries_are_skipped(self):
+        """is_compatible decides whether a match applies to the current project."""
+        self.library.record('buffer roads by 50m', BUFFER_CODE, 1.5, {'roads': {'type': 'vector'}}, [])
+        seen = []
+        self.assertIsNone(self.library.best_match('buffer roads by 50m', lambda e: seen.append(e) and False))
+        self.assertEqual(seen[0]['layers'], {'roads': {'type': 'vector'}})
+
+    def test_rerecording_counts_uses(self):
+        """Recording the same query and code again bumps its use count."""
+        first = self.library.record('buffer roads by 50m', BUFFER_CODE, 1.5, {}, [])
+        second = self.library.record('buffer roads by 50m', BUFFER_CODE, 1.0, {}, [])
+        self.assertEqual(first, second)
+        self.assertEqual(self.library.best_match('buffer roads by 50m', accept)['uses'], 2)
+
+    def test_oldest_entries_are_evicted(self):
+        """Past max_entries the least recently used entries are removed from index and table."""
+        self.library.record('buffer roads by 50m', BUFFER_CODE, 1.0, {}, [])
+        self.library.record('clip parcels with districts', 'clip()', 1.0, {}, [])
+        self.library.record('count buildings per parcel', 'count()', 1.0, {}, [])
+        self.assertEqual(len(self.library.index), 2)
+        self.assertIsNone(self.library.best_match('buffer roads by 50m', accept))
+
+    def test_index_is_rebuilt_on_open(self):
+        """Entries stored by an earlier session are found after reopening."""
+        self.library.record('buffer roads by 50m', BUFFER_CODE, 1.0, {}, [])
+        self.library.close()
+        self.library = VerifiedCodeLibrary(self.path)
+        self.assertIsNotNone(self.library.best_match('buffer roads by 50m', accept))
+
+    def test_discard(self):
+        """A discarded entry is not offered again."""
+        entry_id = self.library.record('buffer roads by 50m', BUFFER_CODE, 1.0, {}, [])
+        self.library.discard(entry_id)
+        self.assertIsNone(self.library.best_match('buffer roads by 50m', accept))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TfidfIndexTest))
+    suite.addTest(unittest.makeSuite(VerifiedCodeLibraryTest))
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -1,6 +1,8 @@
 # coding=utf-8
 """Common functionality used by regression tests."""
 
+import importlib
+import os
 import sys
 import logging
 
@@ -59,3 +61,22 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+def get_plugin_module(name='query_gis'):
+    """Import a plugin module as part of the plugin package.
+
+    The plugin modules use relative imports, so they are loaded the way QGIS
+    loads them: as ``<plugin directory name>.<name>``.
+
+    :param name: Module name inside the plugin package.
+    :type name: str
+
+    :returns: The imported module.
+    """
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parent = os.path.dirname(plugin_dir)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    return importlib.import_module(
+        '%s.%s' % (os.path.basename(plugin_dir), name))